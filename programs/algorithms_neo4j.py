@@ -1,7 +1,10 @@
+import argparse
 import pprint
-from session_helper_neo4j import create_session
-
-session = create_session()
+from session_helper_neo4j import session_scope
+from async_runner_neo4j import AsyncStep
+from projection_catalog_neo4j import ProjectionSpec, ensure_projection, ensure_projection_async
+from similarity_neo4j import build_similarity, fetch_paper_keywords, top_pairs
+from betweenness_neo4j import EPSILON, run_native_betweenness
 
 # Printing query results and summary 
 def print_query_results(records, summary):
@@ -19,14 +22,20 @@ def print_query_results(records, summary):
 # Algorithm 1: Node Similarity
 # Use Case: How similar are two papers based on their keywords
 
-def query_simulate_node_similarity_algorithm(session):
-    print('Dropping the graph from cypher catalog, only if exists')
-    session.run("""CALL gds.graph.drop('myGraph1',false);""")
+GRAPH1 = ProjectionSpec('myGraph1', """CALL gds.graph.project('myGraph1', ['Paper','Keyword'], 'has');""",
+                        ['Paper', 'Keyword'], ['has'])
 
-    print('Project the graph')
-    session.run(
-        """CALL gds.graph.project('myGraph1', ['Paper','Keyword'], 'has');"""
-    )
+QUERY_NODE_SIMILARITY_STREAM = """CALL gds.nodeSimilarity.stream('myGraph1')
+            YIELD node1, node2, similarity
+            RETURN gds.util.asNode(node1).title AS Paper1, 
+                gds.util.asNode(node2).title AS Paper2, 
+                similarity
+            ORDER BY similarity, Paper1, Paper2
+            LIMIT 5;"""
+
+def query_simulate_node_similarity_algorithm(session):
+    print('Projecting the graph, unless the stored projection is still up to date')
+    ensure_projection(session, GRAPH1)
 
     print('Simulating the node similarity algorithm for the stored graph')
     session.run(
@@ -37,15 +46,7 @@ def query_simulate_node_similarity_algorithm(session):
     )
 
     print('Running the node similarity algorithm for the stored graph')
-    result = session.run(
-        """CALL gds.nodeSimilarity.stream('myGraph1')
-            YIELD node1, node2, similarity
-            RETURN gds.util.asNode(node1).title AS Paper1, 
-                gds.util.asNode(node2).title AS Paper2, 
-                similarity
-            ORDER BY similarity, Paper1, Paper2
-            LIMIT 5;"""
-    )
+    result = session.run(QUERY_NODE_SIMILARITY_STREAM)
     records = list(result)
     summary = result.consume()
     return records, summary
@@ -78,14 +79,19 @@ def query_simulate_node_similarity_algorithm(session):
 # Algorithm 2: Betweeness Centrality
 # Use Case: Measure the importance of paper using the betweeness centrality algorithm
 
-def query_simulate_betweeneness_centrality_algorithm(session):
-    print('Dropping the graph from cypher catalog, only if exists')
-    session.run("""CALL gds.graph.drop('myGraph2',false);""")
+GRAPH2 = ProjectionSpec('myGraph2', """CALL gds.graph.project('myGraph2', 'Paper', {cites: {orientation: 'UNDIRECTED'}});""",
+                        ['Paper'], ['cites'])
 
-    print('Projecting the graph')
-    session.run(
-        """CALL gds.graph.project('myGraph2', 'Paper', {cites: {orientation: 'UNDIRECTED'}});"""
-    )
+QUERY_BETWEENNESS_STREAM = """CALL gds.betweenness.stream('myGraph2')
+            YIELD nodeId, score
+            RETURN gds.util.asNode(nodeId).title AS title, 
+            score
+            ORDER BY score, title DESC
+            LIMIT 5;"""
+
+def query_simulate_betweeneness_centrality_algorithm(session):
+    print('Projecting the graph, unless the stored projection is still up to date')
+    ensure_projection(session, GRAPH2)
 
     print('Simulating the node similarity algorithm for the stored graph')
     session.run(
@@ -94,27 +100,43 @@ def query_simulate_betweeneness_centrality_algorithm(session):
     )
 
     print('Running the node similarity algorithm for the stored graph')
-    result = session.run(
-        """CALL gds.betweenness.stream('myGraph2')
-            YIELD nodeId, score
-            RETURN gds.util.asNode(nodeId).title AS title, 
-            score
-            ORDER BY score, title DESC
-            LIMIT 5;"""
-    )
+    result = session.run(QUERY_BETWEENNESS_STREAM)
     records = list(result)
     summary = result.consume()
     return records, summary
 
 
 
-print('Algorithm 1 - Node Similarity..........')
-records, summary = session.execute_read(query_simulate_node_similarity_algorithm)
-print_query_results(records, summary)
-
-
-print('Algorithm 2 - Betweenness Centrality..........')
-records, summary = session.execute_read(query_simulate_betweeneness_centrality_algorithm)
-print_query_results(records, summary)
-
-session.close()
\ No newline at end of file
+# Write steps, since ensuring a projection updates its (:GraphProjection) node
+ALGORITHM_STEPS = [
+    AsyncStep('query_simulate_node_similarity_algorithm',
+              [lambda tx: ensure_projection_async(tx, GRAPH1), QUERY_NODE_SIMILARITY_STREAM], write = True),
+    AsyncStep('query_simulate_betweeneness_centrality_algorithm',
+              [lambda tx: ensure_projection_async(tx, GRAPH2), QUERY_BETWEENNESS_STREAM], write = True),
+]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Graph algorithms on the papers.')
+    parser.add_argument('--native', action = 'store_true', help = 'run the algorithms in-process instead of with GDS')
+    parser.add_argument('--epsilon', type = float, default = EPSILON,
+                        help = 'error of the sampled native betweenness (0 for the exact algorithm)')
+    args = parser.parse_args()
+
+    with session_scope() as session:
+        print('Algorithm 1 - Node Similarity..........')
+        if args.native:
+            paper_ids, similarity = build_similarity(session.execute_read(fetch_paper_keywords))
+            for score, paper, other in top_pairs(similarity):
+                print(paper_ids[paper], paper_ids[other], round(score, 4))
+        else:
+            records, summary = session.execute_write(query_simulate_node_similarity_algorithm)
+            print_query_results(records, summary)
+
+
+        print('Algorithm 2 - Betweenness Centrality..........')
+        if args.native:
+            for title, score in run_native_betweenness(session, args.epsilon or None):
+                print(round(score, 4), title)
+        else:
+            records, summary = session.execute_write(query_simulate_betweeneness_centrality_algorithm)
+            print_query_results(records, summary)
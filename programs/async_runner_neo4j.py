@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+import re
+from collections import namedtuple
+from session_helper_neo4j import create_async_driver, session_config
+
+# A step is a list of Cypher statements run in order inside one transaction; the records of
+# the last statement are returned, and parameters are passed to every statement. Statements
+# other than the last one can also be coroutine functions taking the transaction. Reads only wait
+# for the steps named in depends_on, while write steps additionally run one after another in the
+# order they are listed. The hooks in after are coroutine functions taking the transaction and the
+# summaries of the step's statements; they run last in the same transaction (e.g. to bump the write
+# epochs), so that the last statement stays the step's own. With a cache (result_cache_neo4j), the
+# read steps of a single statement are answered from it until the next graph write.
+AsyncStep = namedtuple('AsyncStep', ['name', 'queries', 'write', 'depends_on', 'parameters', 'after'],
+                       defaults = (False, (), None, ()))
+
+CONCURRENCY = 4
+
+# GDS procedures that write their results back (gds.pageRank.write, not the .write.estimate ones)
+GDS_WRITE = re.compile(r'\bCALL\s+gds\.[\w.]+\.write\s*\(', re.IGNORECASE)
+
+# The Cypher statements of a step, the ones the benchmark and the plan gate measure; the
+# coroutine functions (projections) are setup
+def step_statements(step):
+    return [query for query in step.queries if not callable(query)]
+
+async def run_step(driver, step, semaphore, cache = None):
+    parameters = step.parameters or {}
+
+    async def work(tx):
+        if cache is not None and not step.write and len(step.queries) == 1 and not step.after:
+            return await cache.run_async(tx, step.queries[0], step.parameters)
+
+        summaries = []
+        for query in step.queries[:-1]:
+            if callable(query):
+                await query(tx)
+                continue
+            result = await tx.run(query, parameters)
+            summaries.append(await result.consume())
+
+        result = await tx.run(step.queries[-1], parameters)
+        records = [record async for record in result]
+        summary = await result.consume()
+        for hook in step.after:
+            await hook(tx, summaries + [summary])
+        return records, summary
+
+    async with semaphore:
+        async with driver.session(**session_config()) as session:
+            if step.write:
+                return await session.execute_write(work)
+            return await session.execute_read(work)
+
+# Schedules every step as soon as its dependencies are done, with at most `concurrency`
+# steps talking to the database at once. on_result(name, records, summary) is called as
+# each step finishes; the results are also returned by step name.
+async def run_steps(steps, concurrency = CONCURRENCY, on_result = None, cache = None):
+    driver = create_async_driver()
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = {}
+    results = {}
+
+    async def schedule(step, dependencies):
+        await asyncio.gather(*dependencies)
+        records, summary = await run_step(driver, step, semaphore, cache)
+        results[step.name] = (records, summary)
+        if on_result is not None:
+            on_result(step.name, records, summary)
+
+    try:
+        last_write = None
+        for step in steps:
+            dependencies = [tasks[name] for name in step.depends_on]
+            if step.write and last_write is not None:
+                dependencies.append(tasks[last_write])
+
+            tasks[step.name] = asyncio.ensure_future(schedule(step, dependencies))
+            if step.write:
+                last_write = step.name
+
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await driver.close()
+
+    return results
+
+# The step lists of the pipelines, imported lazily since their modules import this one
+def pipeline_steps():
+    from queries_neo4j import QUERY_STEPS
+    from recommender_neo4j import RECOMMENDER_STEPS
+    from algorithms_neo4j import ALGORITHM_STEPS
+    return {'queries': QUERY_STEPS, 'recommender': RECOMMENDER_STEPS, 'algorithms': ALGORITHM_STEPS}
+
+if __name__ == '__main__':
+    from queries_neo4j import print_query_results
+    from result_cache_neo4j import ResultCache
+
+    parser = argparse.ArgumentParser(description = 'Run the query steps concurrently with the async driver.')
+    parser.add_argument('pipeline', choices = sorted(pipeline_steps()))
+    parser.add_argument('--concurrency', type = int, default = CONCURRENCY)
+    parser.add_argument('--cache-dir', default = None,
+                        help = 'answer the reads from a result cache kept in this directory until the next graph write')
+    args = parser.parse_args()
+
+    steps = pipeline_steps()[args.pipeline]
+    def print_step_results(name, records, summary):
+        print('Result of {name}.........'.format(name = name))
+        print_query_results(records, summary)
+
+    cache = ResultCache(disk_dir = args.cache_dir) if args.cache_dir else None
+    asyncio.run(run_steps(steps, args.concurrency, print_step_results, cache))
@@ -0,0 +1,214 @@
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from datetime import datetime, timezone
+from session_helper_neo4j import create_async_driver, session_config
+from async_runner_neo4j import GDS_WRITE, pipeline_steps, step_statements
+
+WARMUP = 3
+ITERATIONS = 20
+PERCENTILES = (50, 95, 99)
+THRESHOLD = 0.2
+MIN_MILLIS = 5
+
+# Query latency benchmark.
+# Every step of the queries, recommender and algorithms pipelines is benchmarked as a whole: each
+# of its Cypher statements, the writes of the write steps included, is measured and the times and
+# db hits of the step are their sums. Projections and the post-step hooks (epoch bumps) run
+# unmeasured in the same transaction. The write steps merge what already exists, so every run
+# starts from the same graph. A step is run WARMUP times unmeasured, ITERATIONS times measured,
+# and once more with PROFILE to count the db hits of its plans; GDS write procedures are not
+# profiled, their work is not in the Cypher plan. The server times result_available_after and
+# result_consumed_after are kept for every run, next to the client time from sending each
+# statement to consuming its last record.
+
+# Nearest-rank percentile of a list of numbers
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+def describe(values):
+    described = {'p{p}'.format(p = p): percentile(values, p) for p in PERCENTILES}
+    described['mean'] = sum(values) / len(values)
+    described['min'] = min(values)
+    described['max'] = max(values)
+    return described
+
+def plan_db_hits(plan):
+    return plan.get('dbHits', 0) + sum(plan_db_hits(child) for child in plan.get('children', []))
+
+# Runs the step once; returns the rows of its last statement, the summaries of its statements and
+# their client time
+async def run_measured(driver, step, profile = False):
+    parameters = step.parameters or {}
+
+    async def work(tx):
+        summaries = []
+        millis = 0.0
+        rows = 0
+        for query in step.queries:
+            if callable(query):
+                await query(tx)
+                continue
+            if profile and not GDS_WRITE.search(query):
+                query = 'PROFILE ' + query
+            started = time.perf_counter()
+            result = await tx.run(query, parameters)
+            rows = len([record async for record in result])
+            summaries.append(await result.consume())
+            millis += (time.perf_counter() - started) * 1000
+        for hook in step.after:
+            await hook(tx, summaries)
+        return rows, summaries, millis
+
+    async with driver.session(**session_config()) as session:
+        if step.write:
+            return await session.execute_write(work)
+        return await session.execute_read(work)
+
+async def benchmark_step(driver, step, warmup, iterations):
+    for _ in range(warmup):
+        await run_measured(driver, step)
+
+    available_after = []
+    consumed_after = []
+    client_millis = []
+    for _ in range(iterations):
+        rows, summaries, millis = await run_measured(driver, step)
+        available_after.append(sum(summary.result_available_after or 0 for summary in summaries))
+        consumed_after.append(sum(summary.result_consumed_after or 0 for summary in summaries))
+        client_millis.append(millis)
+
+    _, summaries, _ = await run_measured(driver, step, profile = True)
+    return {
+        'queries': step_statements(step),
+        'write': step.write,
+        'rows': rows,
+        'db_hits': sum(plan_db_hits(summary.profile or {}) for summary in summaries),
+        'available_after': describe(available_after),
+        'consumed_after': describe(consumed_after),
+        'client_millis': describe(client_millis),
+    }
+
+async def run_benchmark(names, warmup = WARMUP, iterations = ITERATIONS, reads_only = False):
+    driver = create_async_driver()
+    results = {}
+    try:
+        for pipeline, steps in pipeline_steps().items():
+            if pipeline not in names:
+                continue
+            for step in steps:
+                if reads_only and step.write:
+                    continue
+                print('Benchmarking {pipeline}/{name}...'.format(pipeline = pipeline, name = step.name))
+                results[step.name] = dict(pipeline = pipeline, **await benchmark_step(driver, step, warmup, iterations))
+    finally:
+        await driver.close()
+    return results
+
+def print_results(results):
+    for name, result in results.items():
+        print('{name}: p50 {p50} ms, p95 {p95} ms, p99 {p99} ms (consumed p95 {consumed} ms), {rows} rows, {db_hits} db hits'.format(
+            name = name, rows = result['rows'], db_hits = result['db_hits'],
+            consumed = result['consumed_after']['p95'], **result['available_after'],
+        ))
+
+# Regressions of current against baseline: a query regresses when its metric percentile grew by
+# more than threshold (and by at least min_millis, so that millisecond noise is not reported),
+# or when its plan needs more db hits than threshold allows.
+def compare(baseline, current, metric = 'p95', threshold = THRESHOLD, min_millis = MIN_MILLIS):
+    regressions = []
+    for name, result in current['queries'].items():
+        if name not in baseline['queries']:
+            continue
+        before = baseline['queries'][name]
+        old = before['available_after'][metric] + before['consumed_after'][metric]
+        new = result['available_after'][metric] + result['consumed_after'][metric]
+        if new > old * (1 + threshold) and new - old >= min_millis:
+            regressions.append((name, '{metric} latency'.format(metric = metric), old, new))
+        if result['db_hits'] > before['db_hits'] * (1 + threshold):
+            regressions.append((name, 'db hits', before['db_hits'], result['db_hits']))
+    return regressions
+
+# p50 latency and db hits of every query at each scale factor, and the growth exponent between
+# the smallest and the largest scale factor (1 is linear in the data size)
+def scaling(runs):
+    runs = sorted(runs, key = lambda run: run['scale_factor'])
+    names = sorted({name for run in runs for name in run['queries']})
+    for name in names:
+        points = [(run['scale_factor'], run['queries'][name]) for run in runs if name in run['queries']]
+        cells = ['sf {sf}: {p50} ms / {db_hits} hits'.format(
+            sf = sf, p50 = result['available_after']['p50'] + result['consumed_after']['p50'], db_hits = result['db_hits'],
+        ) for sf, result in points]
+        (first_sf, first), (last_sf, last) = points[0], points[-1]
+        first_millis = first['available_after']['p50'] + first['consumed_after']['p50']
+        last_millis = last['available_after']['p50'] + last['consumed_after']['p50']
+        if last_sf > first_sf and first_millis > 0 and last_millis > 0:
+            cells.append('exponent {exponent:.2f}'.format(
+                exponent = math.log(last_millis / first_millis) / math.log(last_sf / first_sf)))
+        print('{name}: {cells}'.format(name = name, cells = ', '.join(cells)))
+
+def read_results(file_name):
+    with open(file_name) as results_file:
+        return json.load(results_file)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the latency of the queries.')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    run_parser = commands.add_parser('run', help = 'benchmark the queries and write the results as json')
+    run_parser.add_argument('--output', required = True)
+    run_parser.add_argument('--pipeline', nargs = '+', choices = ['queries', 'recommender', 'algorithms'],
+                            default = ['queries', 'recommender', 'algorithms'])
+    run_parser.add_argument('--warmup', type = int, default = WARMUP)
+    run_parser.add_argument('--iterations', type = int, default = ITERATIONS)
+    run_parser.add_argument('--reads-only', action = 'store_true', help = 'skip the steps that write to the graph')
+    run_parser.add_argument('--scale-factor', type = float, default = 1, help = 'scale factor of the loaded dataset')
+    run_parser.add_argument('--load', metavar = 'DATA_DIR',
+                            help = 'empty the database and load this dataset with the batched loader first')
+
+    compare_parser = commands.add_parser('compare', help = 'exit with 1 if the current results regressed')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--metric', choices = ['p{p}'.format(p = p) for p in PERCENTILES], default = 'p95')
+    compare_parser.add_argument('--threshold', type = float, default = THRESHOLD)
+    compare_parser.add_argument('--min-millis', type = float, default = MIN_MILLIS)
+
+    scaling_parser = commands.add_parser('scaling', help = 'compare results taken at several scale factors')
+    scaling_parser.add_argument('results', nargs = '+')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        if args.load:
+            from load_data_neo4j import load_dataset
+            from session_helper_neo4j import session_scope
+            with session_scope() as session:
+                load_dataset(session, batched = True, data_dir = args.load)
+
+        started = datetime.now(timezone.utc).isoformat()
+        results = asyncio.run(run_benchmark(args.pipeline, args.warmup, args.iterations, args.reads_only))
+        print_results(results)
+        with open(args.output, 'w') as output:
+            json.dump({
+                'started': started,
+                'scale_factor': args.scale_factor,
+                'dataset': args.load,
+                'warmup': args.warmup,
+                'iterations': args.iterations,
+                'queries': results,
+            }, output, indent = 2)
+
+    elif args.command == 'compare':
+        regressions = compare(read_results(args.baseline), read_results(args.current),
+                              args.metric, args.threshold, args.min_millis)
+        for name, what, old, new in regressions:
+            print('REGRESSION {name}: {what} {old} -> {new}'.format(name = name, what = what, old = old, new = new))
+        if regressions:
+            sys.exit(1)
+        print('No regressions.')
+
+    else:
+        scaling([read_results(file_name) for file_name in args.results])
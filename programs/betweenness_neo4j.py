@@ -0,0 +1,248 @@
+import argparse
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from graph_store import CSR
+from session_helper_neo4j import session_scope
+from graph_version_neo4j import bump_write_epoch
+
+TOP_N = 5
+EPSILON = 0.05
+PATH_SAMPLE_CONSTANT = 0.5
+CONFIDENCE = 0.95
+BATCH_SIZE = 10000
+
+# Undirected, simple version of the cites graph, like the {cites: {orientation: 'UNDIRECTED'}}
+# projection: both directions of every citation, without duplicates or self citations.
+def undirected_adjacency(sources, targets, node_count):
+    pairs = np.concatenate([np.stack([sources, targets], axis = 1), np.stack([targets, sources], axis = 1)])
+    pairs = np.unique(pairs[pairs[:, 0] != pairs[:, 1]], axis = 0).reshape(-1, 2)
+    adjacency = CSR(pairs[:, 0], pairs[:, 1], node_count)
+    return adjacency.indptr, adjacency.indices
+
+def expand(indptr, indices, nodes):
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    return np.repeat(nodes, counts), indices[positions]
+
+# Shortest paths from one source with a level-synchronous BFS, where every level is expanded with
+# array operations: the distance (-1 if unreachable) and number of shortest paths of every node,
+# and the nodes of every level.
+def shortest_paths(indptr, indices, source):
+    node_count = len(indptr) - 1
+    distance = np.full(node_count, -1, dtype = np.int64)
+    sigma = np.zeros(node_count)
+    distance[source] = 0
+    sigma[source] = 1.0
+
+    levels = [np.array([source], dtype = np.int64)]
+    while True:
+        depth = len(levels)
+        parents, children = expand(indptr, indices, levels[-1])
+        discovered = np.unique(children[distance[children] == -1])
+        if len(discovered) == 0:
+            break
+        distance[discovered] = depth
+        on_path = distance[children] == depth
+        np.add.at(sigma, children[on_path], sigma[parents[on_path]])
+        levels.append(discovered)
+    return distance, sigma, levels
+
+# Brandes' dependencies of one source, accumulated back level by level
+def source_dependencies(indptr, indices, source):
+    distance, sigma, levels = shortest_paths(indptr, indices, source)
+
+    delta = np.zeros(len(indptr) - 1)
+    for depth in range(len(levels) - 1, 0, -1):
+        children, parents = expand(indptr, indices, levels[depth])
+        on_path = distance[parents] == depth - 1
+        children = children[on_path]
+        parents = parents[on_path]
+        np.add.at(delta, parents, sigma[parents] / sigma[children] * (1.0 + delta[children]))
+
+    delta[source] = 0.0
+    return delta
+
+# The inner nodes of a shortest path to target drawn uniformly at random, walking back from the
+# target and choosing every predecessor in proportion to its number of shortest paths
+def sample_path(indptr, indices, distance, sigma, target, generator):
+    inner = []
+    node = target
+    while distance[node] > 1:
+        neighbors = indices[indptr[node]:indptr[node + 1]]
+        parents = neighbors[distance[neighbors] == distance[node] - 1]
+        weights = np.cumsum(sigma[parents])
+        node = parents[min(np.searchsorted(weights, generator.random() * weights[-1], side = 'right'), len(parents) - 1)]
+        inner.append(node)
+    return inner
+
+# Riondato-Kornaropoulos sample size: with that many shortest paths, the normalized betweenness of
+# every node is estimated within epsilon with probability `confidence`. The vertex diameter is
+# bounded by the number of nodes, which only costs a few samples since it enters as a log.
+def sample_size(node_count, epsilon, confidence = CONFIDENCE):
+    vertex_diameter = max(node_count, 3)
+    return math.ceil(PATH_SAMPLE_CONSTANT / epsilon ** 2 * (
+        math.floor(math.log2(vertex_diameter - 2)) + 1 + math.log(1 / (1 - confidence))))
+
+# The adjacency is shared with the worker processes through shared memory, read-only. Every
+# array is passed as (shared memory name, dtype, size), since the CSR arrays of the GraphStore
+# are int32 and the ones built here int64.
+_shared = {}
+
+def attach_adjacency(indptr, indices):
+    for key, (name, dtype, size) in (('indptr', indptr), ('indices', indices)):
+        memory = shared_memory.SharedMemory(name = name)
+        _shared[key + '_memory'] = memory
+        _shared[key] = np.ndarray((size,), dtype = np.dtype(dtype), buffer = memory.buf)
+
+def dependencies_of_sources(sources):
+    total = np.zeros(len(_shared['indptr']) - 1)
+    for source in sources:
+        total += source_dependencies(_shared['indptr'], _shared['indices'], source)
+    return total
+
+# Number of sampled paths through every node. Every sample has its own random stream, so the
+# result does not depend on how the samples are split between the workers.
+def paths_of_samples(task):
+    seed, samples, sources, targets = task
+    indptr, indices = _shared['indptr'], _shared['indices']
+    counts = np.zeros(len(indptr) - 1)
+    order = np.argsort(sources, kind = 'stable')
+    for position, index in enumerate(order):
+        if position == 0 or sources[index] != sources[order[position - 1]]:
+            distance, sigma, _ = shortest_paths(indptr, indices, sources[index])
+        if distance[targets[index]] > 0:
+            generator = np.random.default_rng((seed, int(samples[index])))
+            for node in sample_path(indptr, indices, distance, sigma, targets[index], generator):
+                counts[node] += 1
+    return counts
+
+def share_array(array):
+    memory = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype = array.dtype, buffer = memory.buf)[:] = array
+    return memory
+
+def run_tasks(indptr, indices, function, tasks, workers):
+    indptr = np.ascontiguousarray(indptr)
+    indices = np.ascontiguousarray(indices)
+    node_count = len(indptr) - 1
+    if workers == 1:
+        _shared['indptr'] = indptr
+        _shared['indices'] = indices
+        return sum((function(task) for task in tasks), np.zeros(node_count))
+
+    indptr_memory = share_array(indptr)
+    indices_memory = share_array(indices)
+    try:
+        with ProcessPoolExecutor(
+            max_workers = workers, initializer = attach_adjacency,
+            initargs = ((indptr_memory.name, indptr.dtype.str, len(indptr)),
+                        (indices_memory.name, indices.dtype.str, len(indices))),
+        ) as executor:
+            return sum(executor.map(function, tasks), np.zeros(node_count))
+    finally:
+        indptr_memory.close()
+        indptr_memory.unlink()
+        indices_memory.close()
+        indices_memory.unlink()
+
+# Betweenness centrality of an undirected graph given as CSR arrays, halved like GDS because each
+# undirected pair is counted from both ends. Returns the scores and an error bound on them.
+# With epsilon=None every node is a source of Brandes' algorithm (exact, O(V.E)). Otherwise
+# sample_size(n, epsilon) pairs of distinct nodes are drawn uniformly, a shortest path between
+# them is drawn uniformly, and every node gets the fraction of the sampled paths it is inside of
+# (Riondato-Kornaropoulos). That estimates the normalized betweenness, over the n(n - 1) ordered
+# pairs, within epsilon for every node at once with probability `confidence`; the scores and the
+# bound are scaled back by n(n - 1) / 2. Sampling is only used when it needs fewer BFS than the
+# exact algorithm.
+def betweenness(indptr, indices, epsilon = None, workers = None, seed = 0, confidence = CONFIDENCE):
+    node_count = len(indptr) - 1
+    workers = workers or os.cpu_count() or 1
+    samples = None if epsilon is None or node_count < 2 else sample_size(node_count, epsilon, confidence)
+
+    if samples is None or samples >= node_count:
+        chunks = [chunk for chunk in np.array_split(np.arange(node_count), workers * 4) if len(chunk)]
+        return run_tasks(indptr, indices, dependencies_of_sources, chunks, workers) / 2.0, 0.0
+
+    generator = np.random.default_rng(seed)
+    sources = generator.integers(0, node_count, size = samples)
+    targets = generator.integers(0, node_count - 1, size = samples)
+    targets += targets >= sources
+    tasks = [(seed, chunk, sources[chunk], targets[chunk])
+             for chunk in np.array_split(np.arange(samples), workers * 4) if len(chunk)]
+    counts = run_tasks(indptr, indices, paths_of_samples, tasks, workers)
+
+    pairs = node_count * (node_count - 1) / 2.0
+    return counts / samples * pairs, epsilon * pairs
+
+def fetch_citation_graph(session):
+    result = session.run(
+        """MATCH (p:Paper)
+            RETURN p.ID AS ID, p.title AS title;"""
+    )
+    ids = []
+    titles = []
+    for record in result:
+        ids.append(record['ID'])
+        titles.append(record['title'])
+
+    positions = {paper_id: position for position, paper_id in enumerate(ids)}
+    result = session.run(
+        """MATCH (p1:Paper) - [:cites] -> (p2:Paper)
+            RETURN p1.ID AS source, p2.ID AS target;"""
+    )
+    edges = np.array([(positions[record['source']], positions[record['target']]) for record in result],
+                     dtype = np.int64).reshape(-1, 2)
+    return ids, titles, edges[:, 0], edges[:, 1]
+
+def write_betweenness_batch(tx, rows):
+    tx.run(
+        """UNWIND $rows AS row
+            MATCH (p:Paper {ID: row.ID})
+            SET p.betweenness = row.betweenness""",
+        rows = rows
+    )
+
+def write_betweenness(session, ids, scores, batch_size = BATCH_SIZE):
+    for start in range(0, len(ids), batch_size):
+        rows = [{'ID': paper_id, 'betweenness': float(score)}
+                for paper_id, score in zip(ids[start:start + batch_size], scores[start:start + batch_size])]
+        session.execute_write(write_betweenness_batch, rows)
+    session.execute_write(bump_write_epoch, ['betweenness'])
+
+# Same output as the GDS stream in algorithms_neo4j: (title, score) of the top n papers
+def run_native_betweenness(session, epsilon = EPSILON, workers = None, top_n = TOP_N, write = True):
+    ids, titles, sources, targets = session.execute_read(fetch_citation_graph)
+    indptr, indices = undirected_adjacency(sources, targets, len(ids))
+    scores, error = betweenness(indptr, indices, epsilon, workers)
+
+    if error == 0.0:
+        print('Exact betweenness over {nodes} papers.'.format(nodes = len(ids)))
+    else:
+        print('Betweenness from {samples} sampled shortest paths over {nodes} papers, within +/- {error:.1f} '
+              '(epsilon {epsilon} of the normalized score) with {confidence:.0%} confidence.'.format(
+            samples = sample_size(len(ids), epsilon), nodes = len(ids), error = error, epsilon = epsilon,
+            confidence = CONFIDENCE,
+        ))
+
+    if write:
+        write_betweenness(session, ids, scores)
+
+    top = np.lexsort((np.arange(len(scores)), -scores))[:top_n]
+    return [(titles[node], float(scores[node])) for node in top]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Betweenness centrality of the citation graph without GDS.')
+    parser.add_argument('--epsilon', type = float, default = EPSILON,
+                        help = 'additive error on the normalized scores, which sizes the samples')
+    parser.add_argument('--exact', action = 'store_true', help = 'use every paper as a source')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--top', type = int, default = TOP_N)
+    args = parser.parse_args()
+
+    with session_scope() as session:
+        for title, score in run_native_betweenness(session, None if args.exact else args.epsilon, args.workers, args.top):
+            print(round(score, 4), title)
@@ -0,0 +1,93 @@
+import argparse
+from session_helper_neo4j import session_scope
+from graph_version_neo4j import write_epoch_query
+
+COMMUNITY_RATIO = 0.9
+
+# Materialized research community membership.
+# A paper is a community paper when one of its keywords belongs to the community, and a
+# conference or journal is in the community when at least 90% of its papers are community
+# papers. The result is stored once as (x)-[:in_community {ratio}]->(rc) for the venues and
+# (p)-[:in_community]->(rc) for the papers of those venues, which is what the recommender reads.
+# Every community is computed in the same pass over the venues' papers, so the cost does not
+# grow with the number of communities.
+# A refresh only deletes the memberships that do not hold anymore and merges the new ones, so the
+# in_community epoch is only bumped when the membership actually changed; the projections and
+# cached results that read it stay valid otherwise.
+MEMBERSHIP_ELEMENTS = ['in_community']
+
+QUERY_BUMP_MEMBERSHIP_EPOCH = write_epoch_query(MEMBERSHIP_ELEMENTS)
+
+QUERY_DELETE_STALE_VENUE_MEMBERSHIP = """MATCH (x) - [m:in_community] -> (rc:ResearchCommunity)
+            WHERE x:Journal OR x:Conference
+            OPTIONAL MATCH (p:Paper) - [:published_in|presented_in] -> (x)
+            WITH m, rc, COLLECT(DISTINCT p) AS papers
+            WITH m, SIZE(papers) AS numberOfPapers,
+                 SIZE([p IN papers WHERE EXISTS { (p) - [:has] -> (:Keyword) - [:belongs_to] -> (rc) }]) AS numberOfCommunityPapers
+            WHERE numberOfPapers = 0 OR toFloat(numberOfCommunityPapers) / numberOfPapers < $ratio
+            DELETE m;"""
+
+QUERY_VENUE_COMMUNITY_MEMBERSHIP = """MATCH (p:Paper) - [:published_in|presented_in] -> (x)
+            WHERE x:Journal OR x:Conference
+            WITH x, COLLECT(DISTINCT p) AS papers
+            UNWIND papers AS p
+            MATCH (p) - [:has] -> (:Keyword) - [:belongs_to] -> (rc:ResearchCommunity)
+            WITH x, SIZE(papers) AS numberOfPapers, rc, COUNT(DISTINCT p) AS numberOfCommunityPapers
+            WITH x, rc, toFloat(numberOfCommunityPapers) / numberOfPapers AS ratio
+            WHERE ratio >= $ratio
+            MERGE (x) - [m:in_community] -> (rc)
+            ON CREATE SET m.ratio = ratio
+            WITH m, ratio
+            WHERE m.ratio <> ratio
+            SET m.ratio = ratio;"""
+
+QUERY_DELETE_STALE_PAPER_MEMBERSHIP = """MATCH (p:Paper) - [m:in_community] -> (rc:ResearchCommunity)
+            WHERE NOT EXISTS { (p) - [:published_in|presented_in] -> () - [:in_community] -> (rc) }
+            DELETE m;"""
+
+QUERY_PAPER_COMMUNITY_MEMBERSHIP = """MATCH (p:Paper) - [:published_in|presented_in] -> (x) - [:in_community] -> (rc:ResearchCommunity)
+            WITH DISTINCT p, rc
+            MERGE (p) - [:in_community] -> (rc);"""
+
+MEMBERSHIP_QUERIES = [QUERY_DELETE_STALE_VENUE_MEMBERSHIP, QUERY_VENUE_COMMUNITY_MEMBERSHIP,
+                      QUERY_DELETE_STALE_PAPER_MEMBERSHIP, QUERY_PAPER_COMMUNITY_MEMBERSHIP]
+
+QUERY_COMMUNITY_MEMBERSHIP = """MATCH (rc:ResearchCommunity)
+            OPTIONAL MATCH (x) - [m:in_community] -> (rc)
+            WHERE x:Journal OR x:Conference
+            WITH rc, COUNT(x) AS venues, AVG(m.ratio) AS averageRatio
+            OPTIONAL MATCH (p:Paper) - [:in_community] -> (rc)
+            RETURN rc.name AS researchCommunity,
+                   venues,
+                   averageRatio,
+                   COUNT(p) AS papers;"""
+
+# Has to be run again whenever keywords, has or belongs_to relations change. Returns whether the
+# membership changed.
+def refresh_community_membership(session, ratio = COMMUNITY_RATIO):
+    changed = False
+    for query in MEMBERSHIP_QUERIES:
+        changed = session.run(query, ratio = ratio).consume().counters.contains_updates or changed
+    if changed:
+        session.run(QUERY_BUMP_MEMBERSHIP_EPOCH)
+    return changed
+
+def query_community_membership(session):
+    result = session.run(QUERY_COMMUNITY_MEMBERSHIP)
+    records = list(result)
+    summary = result.consume()
+    return records, summary
+
+if __name__ == '__main__':
+    from queries_neo4j import print_query_results
+
+    parser = argparse.ArgumentParser(description = 'Refresh the stored research community membership.')
+    parser.add_argument('--ratio', type = float, default = COMMUNITY_RATIO)
+    args = parser.parse_args()
+
+    with session_scope() as session:
+        print('Refreshing the research community membership of venues and papers...')
+        if not session.execute_write(refresh_community_membership, args.ratio):
+            print('The membership has not changed.')
+        records, summary = session.execute_read(query_community_membership)
+        print_query_results(records, summary)
@@ -0,0 +1,116 @@
+import argparse
+from collections import namedtuple
+from session_helper_neo4j import session_scope, run_with_retry
+from graph_version_neo4j import bump_write_epoch
+
+BATCH_SIZE = 1000
+THRESHOLD = 0.5
+
+# Incremental review decisions.
+# Whatever writes reviews marks the reviewed paper with the PendingDecision label (see
+# QUERY_MARK_PENDING_DECISION). A decision pass only reads the pending papers, through the label
+# index, recomputes their review aggregates (count, sum and mean acceptance probability, and the
+# votes of the reviewers whose probability is above 0.5) and applies the acceptance rule to the
+# whole paper. The aggregates and the decision are stored on the paper and the label is removed,
+# so the cost of a pass follows the reviews that changed, not all the reviews.
+ReviewAggregate = namedtuple('ReviewAggregate', ['count', 'sum', 'mean', 'votes'])
+
+# Acceptance rules: (aggregate, threshold) -> accepted
+RULES = {
+    # Sum of the acceptance probabilities of the paper above the threshold
+    'probability_sum': lambda aggregate, threshold: aggregate.sum > threshold,
+    'mean': lambda aggregate, threshold: aggregate.mean > threshold,
+    # More than the threshold share of the reviewers accept the paper (half of them by default)
+    'majority': lambda aggregate, threshold: aggregate.votes > threshold * aggregate.count,
+    # Every reviewer gives a score out of 10 (their probability times 10), accepted above the
+    # threshold (15 by default)
+    'score': lambda aggregate, threshold: aggregate.sum * 10 > threshold,
+}
+
+# Threshold of each rule when none is given
+RULE_THRESHOLDS = {'probability_sum': THRESHOLD, 'mean': THRESHOLD, 'majority': THRESHOLD, 'score': 15}
+
+QUERY_MARK_PENDING_DECISION = """MATCH (:Author) - [:reviews] -> (p:Paper)
+            SET p:PendingDecision;"""
+
+def aggregate_reviews(probabilities, threshold = THRESHOLD):
+    probabilities = [probability for probability in probabilities if probability is not None]
+    total = sum(probabilities)
+    return ReviewAggregate(
+        count = len(probabilities),
+        sum = total,
+        mean = total / len(probabilities) if probabilities else None,
+        votes = sum(1 for probability in probabilities if probability > threshold),
+    )
+
+# One batch of pending papers is read, decided and written in the same transaction
+def decide_batch(tx, rule, threshold, batch_size):
+    result = tx.run(
+        """MATCH (p:Paper:PendingDecision)
+            WITH p LIMIT $limit
+            OPTIONAL MATCH (:Author) - [r:reviews] -> (p)
+            RETURN p.ID AS ID, COLLECT(r.acceptanceProbability) AS probabilities;""",
+        limit = batch_size
+    )
+    rows = []
+    for record in result:
+        aggregate = aggregate_reviews(record['probabilities'])
+        rows.append(dict(aggregate._asdict(), ID = record['ID'],
+                         decision = RULES[rule](aggregate, threshold) if aggregate.count else None))
+
+    tx.run(
+        """UNWIND $rows AS row
+            MATCH (p:Paper:PendingDecision {ID: row.ID})
+            SET p.reviewCount = row.count,
+                p.reviewProbabilitySum = row.sum,
+                p.reviewProbabilityMean = row.mean,
+                p.reviewVotes = row.votes,
+                p.decision = row.decision,
+                p.decisionRule = $rule
+            REMOVE p:PendingDecision""",
+        rows = rows, rule = rule
+    )
+    return len(rows)
+
+def decide_pending(session, rule = 'probability_sum', threshold = None, batch_size = BATCH_SIZE):
+    threshold = RULE_THRESHOLDS[rule] if threshold is None else threshold
+    decided = 0
+    while True:
+        papers = run_with_retry(session.execute_write, decide_batch, rule, threshold, batch_size)
+        decided += papers
+        if papers < batch_size:
+            break
+    if decided:
+        session.execute_write(bump_write_epoch, ['decision'])
+    return decided
+
+def query_decisions(session):
+    result = session.run(
+        """MATCH (p:Paper)
+            WHERE p.decision IS NOT NULL
+            RETURN p.decisionRule AS rule,
+                   p.decision AS decision,
+                   COUNT(p) AS papers,
+                   AVG(p.reviewProbabilityMean) AS averageProbability;"""
+    )
+    records = list(result)
+    summary = result.consume()
+    return records, summary
+
+if __name__ == '__main__':
+    from queries_neo4j import print_query_results
+
+    parser = argparse.ArgumentParser(description = 'Decide on the papers whose reviews changed.')
+    parser.add_argument('--rule', choices = sorted(RULES), default = 'probability_sum')
+    parser.add_argument('--threshold', type = float, default = None, help = 'defaults to the threshold of the rule')
+    parser.add_argument('--batch-size', type = int, default = BATCH_SIZE)
+    parser.add_argument('--all', action = 'store_true', help = 'decide again on every reviewed paper, e.g. after changing the rule')
+    args = parser.parse_args()
+
+    with session_scope() as session:
+        if args.all:
+            session.run(QUERY_MARK_PENDING_DECISION).consume()
+        print('Decided on {papers} papers.'.format(
+            papers = decide_pending(session, args.rule, args.threshold, args.batch_size)))
+        records, summary = session.execute_read(query_decisions)
+        print_query_results(records, summary)
@@ -0,0 +1,361 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+from session_helper_neo4j import session_scope, run_with_retry
+from load_data_neo4j import DATA_DIR, BATCH_SIZE, write_batch
+from graph_store import normalize_id
+from impact_factor_neo4j import (build_journal_year_table, apply_published_in_delta, apply_cites_delta,
+                                 retract_published_in_delta, retract_cites_delta)
+from graph_version_neo4j import bump_write_epoch
+from h_index_neo4j import update_h_index
+from venue_editions import update_venue_editions
+
+MANIFEST = '.load_manifest.json'
+
+# Incremental loading.
+# The manifest of the last load keeps a fingerprint of every csv file and of every row by key
+# (the ID of a node, or the START_ID and END_ID of a relation). A file whose fingerprint did not
+# change is skipped; otherwise its rows are compared with the manifest and only the inserted,
+# updated and deleted ones are written, in UNWIND batches of their own transactions, so the graph
+# stays online. Relations are MERGEd, so a pair of nodes has at most one relation of each type;
+# like the full load, only the first row of a repeated key counts. The full load writes the
+# manifest of the files it loaded (write_load_manifest).
+#
+# Nodes are upserted first and deleted last, after the relations of the deleted rows. The
+# citationCount of the papers, the PendingDecision label of reviewed papers and the JournalYear
+# table follow the changes; a file that is not in the manifest yet rebuilds the JournalYear
+# table instead. The manifest entry of a file is saved once its changes are applied.
+# The JournalYear deltas of a batch run in the transaction of its upsert or delete, and only for
+# the relations the batch actually creates, moves or deletes, so a load interrupted in the middle
+# of a file can be run again without counting a batch twice. The inserted and deleted writes and
+# cites edges go to the saved h-index engine (h_index_neo4j), which rewrites the hIndex of the
+# authors they touch, and the new conferences and writes and presented_in edges to the saved
+# venue-edition index (venue_editions).
+DeltaFile = namedtuple('DeltaFile', ['file_name', 'element', 'upsert', 'delete'])
+
+DELTA_NODES = [
+    DeltaFile('keywords_semantic.csv', 'Keyword',
+        """UNWIND $rows AS line
+            MERGE (k:Keyword {ID: line.ID})
+            SET k.name = line.name, k.domain = line.domain""",
+        """UNWIND $rows AS line
+            MATCH (k:Keyword {ID: line.ID})
+            DETACH DELETE k"""),
+    DeltaFile('authors_semantic.csv', 'Author',
+        """UNWIND $rows AS line
+            MERGE (a:Author {ID: line.ID})
+            SET a.name = line.name, a.email = line.email""",
+        """UNWIND $rows AS line
+            MATCH (a:Author {ID: line.ID})
+            DETACH DELETE a"""),
+    DeltaFile('conference_semantic.csv', 'Conference',
+        """UNWIND $rows AS line
+            MERGE (c:Conference {ID: line.ID})
+            SET c.name = line.name, c.year = toInteger(line.year), c.edition = toInteger(line.edition)""",
+        """UNWIND $rows AS line
+            MATCH (c:Conference {ID: line.ID})
+            DETACH DELETE c"""),
+    DeltaFile('journal_semantic.csv', 'Journal',
+        """UNWIND $rows AS line
+            MERGE (j:Journal {ID: line.ID})
+            SET j.name = line.name""",
+        """UNWIND $rows AS line
+            MATCH (j:Journal {ID: line.ID})
+            OPTIONAL MATCH (j) - [:has_year] -> (jy:JournalYear)
+            DETACH DELETE j, jy"""),
+    DeltaFile('proceedings_semantic.csv', 'Proceeding',
+        """UNWIND $rows AS line
+            MERGE (p:Proceeding {ID: line.ID})
+            SET p.name = line.name, p.city = line.city""",
+        """UNWIND $rows AS line
+            MATCH (p:Proceeding {ID: line.ID})
+            DETACH DELETE p"""),
+    DeltaFile('papers_semantic.csv', 'Paper',
+        """UNWIND $rows AS line
+            MERGE (p:Paper {ID: line.ID})
+            ON CREATE SET p.citationCount = 0
+            SET p.title = line.title, p.abstract = line.abstract, p.pages = line.pages,
+                p.doi = line.doi, p.link = line.link""",
+        """UNWIND $rows AS line
+            MATCH (p:Paper {ID: line.ID})
+            DETACH DELETE p"""),
+]
+
+DELTA_RELATIONS = [
+    DeltaFile('conference_part_of_proceedings.csv', 'is_part',
+        """UNWIND $rows AS line
+            MATCH (conf:Conference {ID: line.START_ID})
+            WITH conf, line
+            MATCH (proc:Proceeding {ID: line.END_ID})
+            MERGE (conf) - [:is_part] -> (proc)""",
+        """UNWIND $rows AS line
+            MATCH (:Conference {ID: line.START_ID}) - [r:is_part] -> (:Proceeding {ID: line.END_ID})
+            DELETE r"""),
+    DeltaFile('author_writes_papers.csv', 'writes',
+        """UNWIND $rows AS line
+            MATCH (author:Author {ID: line.START_ID})
+            WITH author, line
+            MATCH (paper:Paper {ID: line.END_ID})
+            MERGE (author) - [w:writes] -> (paper)
+            SET w.corresponding_author = toBoolean(line.corresponding_author)""",
+        """UNWIND $rows AS line
+            MATCH (:Author {ID: line.START_ID}) - [r:writes] -> (:Paper {ID: line.END_ID})
+            DELETE r"""),
+    DeltaFile('paper_has_keywords.csv', 'has',
+        """UNWIND $rows AS line
+            MATCH (paper:Paper {ID: line.START_ID})
+            WITH paper, line
+            MATCH (keyword:Keyword {ID: line.END_ID})
+            MERGE (paper) - [:has] -> (keyword)""",
+        """UNWIND $rows AS line
+            MATCH (:Paper {ID: line.START_ID}) - [r:has] -> (:Keyword {ID: line.END_ID})
+            DELETE r"""),
+    DeltaFile('paper_presented_in_conference.csv', 'presented_in',
+        """UNWIND $rows AS line
+            MATCH (paper:Paper {ID: line.START_ID})
+            WITH paper, line
+            MATCH (conf:Conference {ID: line.END_ID})
+            MERGE (paper) - [:presented_in] -> (conf)""",
+        """UNWIND $rows AS line
+            MATCH (:Paper {ID: line.START_ID}) - [r:presented_in] -> (:Conference {ID: line.END_ID})
+            DELETE r"""),
+    DeltaFile('paper_published_in_journal.csv', 'published_in',
+        """UNWIND $rows AS line
+            MATCH (paper:Paper {ID: line.START_ID})
+            WITH paper, line
+            MATCH (jour:Journal {ID: line.END_ID})
+            MERGE (paper) - [r:published_in] -> (jour)
+            SET r.volume = toInteger(line.volume), r.year = toInteger(line.year)""",
+        """UNWIND $rows AS line
+            MATCH (:Paper {ID: line.START_ID}) - [r:published_in] -> (:Journal {ID: line.END_ID})
+            DELETE r"""),
+    DeltaFile('paper_cites_paper.csv', 'cites',
+        """UNWIND $rows AS line
+            MATCH (paper:Paper {ID: line.START_ID})
+            WITH paper, line
+            MATCH (citedPaper:Paper {ID: line.END_ID})
+            MERGE (paper) - [:cites] -> (citedPaper)
+            ON CREATE SET citedPaper.citationCount = citedPaper.citationCount + 1""",
+        """UNWIND $rows AS line
+            MATCH (:Paper {ID: line.START_ID}) - [r:cites] -> (citedPaper:Paper {ID: line.END_ID})
+            DELETE r
+            SET citedPaper.citationCount = citedPaper.citationCount - 1"""),
+    DeltaFile('author_review_papers.csv', 'reviews',
+        """UNWIND $rows AS line
+            MATCH (author:Author {ID: line.START_ID})
+            WITH author, line
+            MATCH (paper:Paper {ID: line.END_ID})
+            MERGE (author) - [r:reviews] -> (paper)
+            SET r.comment = line.comment, r.acceptanceProbability = toFloat(line.acceptanceProbability),
+                paper:PendingDecision""",
+        """UNWIND $rows AS line
+            MATCH (:Author {ID: line.START_ID}) - [r:reviews] -> (paper:Paper {ID: line.END_ID})
+            DELETE r
+            SET paper:PendingDecision"""),
+]
+
+Delta = namedtuple('Delta', ['inserted', 'updated', 'deleted', 'fingerprint', 'rows'])
+
+def file_fingerprint(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as data_file:
+        for block in iter(lambda: data_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def row_key(line):
+    if 'ID' in line:
+        return line['ID']
+    return line['START_ID'] + '\t' + line['END_ID']
+
+def row_fingerprint(line):
+    return hashlib.sha1(json.dumps(line, sort_keys = True).encode('utf-8')).hexdigest()[:16]
+
+# Rows without their ids are skipped, since they can not be matched in the graph anyway
+def read_rows(path):
+    with open(path, newline = '', encoding = 'utf-8') as csv_file:
+        for line in csv.DictReader(csv_file):
+            line = {column: value if value != '' else None for column, value in line.items()}
+            if any(column in line and line[column] is None for column in ('ID', 'START_ID', 'END_ID')):
+                continue
+            for column in ('ID', 'START_ID', 'END_ID'):
+                if line.get(column) is not None:
+                    line[column] = normalize_id(line[column])
+            yield line
+
+# Inserted and updated rows, and the keys of the deleted ones, against the manifest entry of a file
+def file_delta(path, previous):
+    previous_rows = previous['rows'] if previous else {}
+    inserted, updated = [], []
+    rows = {}
+    for line in read_rows(path):
+        key = row_key(line)
+        if key in rows:
+            continue
+        fingerprint = row_fingerprint(line)
+        rows[key] = fingerprint
+        if key not in previous_rows:
+            inserted.append(line)
+        elif previous_rows[key] != fingerprint:
+            updated.append(line)
+    deleted = [key for key in previous_rows if key not in rows]
+    return Delta(inserted, updated, deleted, file_fingerprint(path), rows)
+
+def key_rows(keys):
+    return [dict(zip(('START_ID', 'END_ID'), key.split('\t'))) if '\t' in key else {'ID': key} for key in keys]
+
+def write_batches(session, query, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        run_with_retry(session.execute_write, write_batch, query, rows[start:start + batch_size])
+
+# The rows of a batch whose relation does not exist yet, or is published in another year
+QUERY_PENDING_ROWS = {
+    'published_in': """UNWIND $rows AS row
+            MATCH (p:Paper {ID: row.START_ID})
+            WITH p, row
+            MATCH (j:Journal {ID: row.END_ID})
+            OPTIONAL MATCH (p) - [r:published_in] -> (j)
+            WITH row, r
+            WHERE r IS NULL OR r.year <> toInteger(row.year)
+            RETURN row;""",
+    'cites': """UNWIND $rows AS row
+            MATCH (p:Paper {ID: row.START_ID})
+            WITH p, row
+            MATCH (c:Paper {ID: row.END_ID})
+            WHERE NOT (p) - [:cites] -> (c)
+            RETURN row;""",
+}
+
+def pending_rows(tx, element, rows):
+    return [record['row'] for record in tx.run(QUERY_PENDING_ROWS[element], rows = rows)]
+
+# The JournalYear deltas are taken while the old relations are still in the graph
+def upsert_batch(tx, delta_file, rows, journal_years):
+    element = delta_file.element
+    pending = pending_rows(tx, element, rows) if journal_years and element in QUERY_PENDING_ROWS else []
+    if element == 'published_in':
+        retract_published_in_delta(tx, pending)
+    tx.run(delta_file.upsert, rows = rows).consume()
+    if element == 'published_in':
+        apply_published_in_delta(tx, pending)
+    if element == 'cites':
+        apply_cites_delta(tx, pending)
+
+def delete_batch(tx, delta_file, rows, journal_years):
+    if journal_years and delta_file.element == 'published_in':
+        retract_published_in_delta(tx, rows)
+    if journal_years and delta_file.element == 'cites':
+        retract_cites_delta(tx, rows)
+    tx.run(delta_file.delete, rows = rows).consume()
+
+def delta_batches(session, function, delta_file, rows, batch_size, journal_years):
+    for start in range(0, len(rows), batch_size):
+        run_with_retry(session.execute_write, function, delta_file, rows[start:start + batch_size], journal_years)
+
+def read_manifest(path):
+    if not os.path.exists(path):
+        return {'files': {}}
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+def write_manifest(path, manifest):
+    with open(path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(path + '.tmp', path)
+
+# Manifest of the csv files of data_dir as they are, for the graph a full load built from them
+def write_load_manifest(data_dir = DATA_DIR, manifest_path = None):
+    manifest = {'files': {}}
+    for delta_file in DELTA_NODES + DELTA_RELATIONS:
+        delta = file_delta(os.path.join(data_dir, delta_file.file_name), None)
+        manifest['files'][delta_file.file_name] = {'fingerprint': delta.fingerprint, 'rows': delta.rows}
+    write_manifest(manifest_path or os.path.join(data_dir, MANIFEST), manifest)
+
+def load_delta(session, data_dir = DATA_DIR, manifest_path = None, batch_size = BATCH_SIZE, dry_run = False):
+    manifest_path = manifest_path or os.path.join(data_dir, MANIFEST)
+    manifest = read_manifest(manifest_path)
+    changed = []
+    rebuild_journal_years = False
+    h_index_changes = {}
+    rebuild_h_index = False
+    venue_changes = {}
+    rebuild_venue_editions = False
+    node_deletes = []
+
+    for delta_file in DELTA_NODES + DELTA_RELATIONS:
+        path = os.path.join(data_dir, delta_file.file_name)
+        previous = manifest['files'].get(delta_file.file_name)
+        fingerprint = file_fingerprint(path)
+        if previous and previous['fingerprint'] == fingerprint:
+            continue
+
+        delta = file_delta(path, previous)
+        print('{file_name}: {inserted} inserted, {updated} updated, {deleted} deleted.'.format(
+            file_name = delta_file.file_name, inserted = len(delta.inserted), updated = len(delta.updated),
+            deleted = len(delta.deleted),
+        ))
+        if dry_run or not (delta.inserted or delta.updated or delta.deleted):
+            continue
+        start = time.perf_counter()
+        incremental = previous is not None
+        deleted = key_rows(delta.deleted)
+        is_node = delta_file in DELTA_NODES
+
+        delta_batches(session, upsert_batch, delta_file, delta.inserted + delta.updated, batch_size, incremental)
+        if not is_node:
+            delta_batches(session, delete_batch, delta_file, deleted, batch_size, incremental)
+        if not incremental and delta_file.element in ('published_in', 'cites'):
+            rebuild_journal_years = True
+        if delta_file.element in ('writes', 'cites'):
+            h_index_changes[delta_file.element] = (delta.inserted, deleted)
+            rebuild_h_index = rebuild_h_index or not incremental
+        if delta_file.element in ('Conference', 'writes', 'presented_in'):
+            venue_changes[delta_file.element] = delta
+            rebuild_venue_editions = rebuild_venue_editions or not incremental
+
+        if is_node and deleted:
+            node_deletes.append((delta_file, deleted, delta))
+        else:
+            manifest['files'][delta_file.file_name] = {'fingerprint': delta.fingerprint, 'rows': delta.rows}
+            write_manifest(manifest_path, manifest)
+        changed.append(delta_file.element)
+        print('Applied the changes of {file_name} in {elapsed:.2f} s.'.format(
+            file_name = delta_file.file_name, elapsed = time.perf_counter() - start))
+
+    # Nodes go last, once the relations of the deleted rows are gone
+    for delta_file, deleted, delta in node_deletes:
+        write_batches(session, delta_file.delete, deleted, batch_size)
+        manifest['files'][delta_file.file_name] = {'fingerprint': delta.fingerprint, 'rows': delta.rows}
+        write_manifest(manifest_path, manifest)
+
+    if rebuild_journal_years:
+        print('Rebuilding the journal-year impact factor table...')
+        session.execute_write(build_journal_year_table)
+        changed.append('JournalYear')
+    elif 'published_in' in changed or 'cites' in changed:
+        changed.append('JournalYear')
+    if h_index_changes:
+        authors = update_h_index(session, h_index_changes, data_dir, rebuild_h_index, batch_size)
+        if authors:
+            print('Updated the h-index of {authors} authors.'.format(authors = authors))
+    if venue_changes:
+        update_venue_editions(venue_changes, data_dir, rebuild_venue_editions)
+    if changed:
+        session.execute_write(bump_write_epoch, changed)
+    return changed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Apply the changes of the csv files since the last load.')
+    parser.add_argument('--data-dir', default = DATA_DIR)
+    parser.add_argument('--manifest', default = None, help = 'defaults to {manifest} in the data directory'.format(manifest = MANIFEST))
+    parser.add_argument('--batch-size', type = int, default = BATCH_SIZE)
+    parser.add_argument('--dry-run', action = 'store_true', help = 'only print the number of changed rows')
+    args = parser.parse_args()
+
+    with session_scope() as session:
+        changed = load_delta(session, args.data_dir, args.manifest, args.batch_size, args.dry_run)
+        print('Changed: {changed}'.format(changed = ', '.join(changed) or 'nothing'))
@@ -1,52 +1,127 @@
-from session_helper_neo4j import create_session
-
-def drop_indexes(session):
-    session.run("""
-        DROP INDEX idx_paper IF EXISTS; 
-        DROP INDEX idx_author IF EXISTS;
-        DROP INDEX idx_journal IF EXISTS;
-        DROP INDEX idx_conference IF EXISTS;
-        DROP INDEX idx_proceeding IF EXISTS;
-        DROP INDEX idx_keyword IF EXISTS;"""
-    )
-
-def create_indexes(session):
-    print('Index for Paper')
-    session.run("""CREATE INDEX idx_paper IF NOT EXISTS
-        FOR (p:Paper) 
-        ON (p.ID);"""
-    )
-
-    print('Index for Keyword')
-    session.run("""CREATE INDEX idx_keyword IF NOT EXISTS
-        FOR (k:Keyword) 
-        ON (k.keyword);"""
-    )
-
-    print('Index for Author')
-    session.run("""CREATE INDEX idx_author IF NOT EXISTS
-        FOR (a:Author) 
-        ON (a.ID);"""
-    )
-
-    print('Index for Conference')
-    session.run("""CREATE INDEX idx_conference IF NOT EXISTS
-        FOR (c:Conference) 
-        ON (c.ID);"""
-    )
-
-    print('Index for Journal')
-    session.run("""CREATE INDEX idx_journal IF NOT EXISTS 
-        FOR (j:Journal) 
-        ON (j.ID);"""
-    )
-
-    print('Index for Proceeding')
-    session.run("""CREATE INDEX idx_proceeding IF NOT EXISTS 
-        FOR (p:Proceeding) 
-        ON (p.ID);"""
-    )
-
-session = create_session()
-
-session.close()
\ No newline at end of file
+import argparse
+from collections import namedtuple
+from session_helper_neo4j import session_scope
+
+AWAIT_SECONDS = 300
+
+# Declarative schema.
+# SCHEMA lists every index and constraint the programs need. apply_schema compares it with
+# SHOW INDEXES / SHOW CONSTRAINTS and only runs the statements for what differs: it drops what
+# is not in the spec anymore (or has a different definition), creates what is missing and waits
+# for the new indexes to be online. Every statement is run on its own.
+#
+# kind is 'unique' (a uniqueness constraint, which is backed by its own index), 'range' or
+# 'fulltext'; entity is 'NODE' or 'RELATIONSHIP'. Other kinds of constraints found in the
+# database are dropped.
+SchemaElement = namedtuple('SchemaElement', ['name', 'kind', 'entity', 'label', 'properties'])
+
+SCHEMA = [
+    # The loader matches every relationship end on these ids, so they exist before the load
+    SchemaElement('paper_id', 'unique', 'NODE', 'Paper', ['ID']),
+    SchemaElement('author_id', 'unique', 'NODE', 'Author', ['ID']),
+    SchemaElement('keyword_id', 'unique', 'NODE', 'Keyword', ['ID']),
+    SchemaElement('conference_id', 'unique', 'NODE', 'Conference', ['ID']),
+    SchemaElement('journal_id', 'unique', 'NODE', 'Journal', ['ID']),
+    SchemaElement('proceeding_id', 'unique', 'NODE', 'Proceeding', ['ID']),
+    # MERGE keys
+    SchemaElement('institution_name', 'unique', 'NODE', 'Institution', ['name']),
+    SchemaElement('research_community_name', 'unique', 'NODE', 'ResearchCommunity', ['name']),
+    SchemaElement('graph_version_element', 'unique', 'NODE', 'GraphVersion', ['element']),
+    SchemaElement('graph_projection_name', 'unique', 'NODE', 'GraphProjection', ['name']),
+    SchemaElement('migration_version', 'unique', 'NODE', 'Migration', ['version']),
+    # Query filters and sort keys
+    SchemaElement('idx_keyword_name', 'range', 'NODE', 'Keyword', ['name']),
+    SchemaElement('idx_conference_name_edition', 'range', 'NODE', 'Conference', ['name', 'edition']),
+    SchemaElement('idx_paper_citation_count', 'range', 'NODE', 'Paper', ['citationCount']),
+    SchemaElement('idx_journal_year_year', 'range', 'NODE', 'JournalYear', ['year']),
+    SchemaElement('idx_published_in_year', 'range', 'RELATIONSHIP', 'published_in', ['year']),
+    SchemaElement('idx_paper_text', 'fulltext', 'NODE', 'Paper', ['title', 'abstract']),
+]
+
+def pattern(element):
+    if element.entity == 'NODE':
+        return '(n:`{label}`)'.format(label = element.label)
+    return '() - [n:`{label}`] - ()'.format(label = element.label)
+
+def properties(element):
+    return ', '.join('n.`{prop}`'.format(prop = prop) for prop in element.properties)
+
+def create_statement(element):
+    if element.kind == 'unique':
+        return 'CREATE CONSTRAINT `{name}` IF NOT EXISTS FOR {pattern} REQUIRE ({properties}) IS UNIQUE'.format(
+            name = element.name, pattern = pattern(element), properties = properties(element))
+    if element.kind == 'fulltext':
+        return 'CREATE FULLTEXT INDEX `{name}` IF NOT EXISTS FOR {pattern} ON EACH [{properties}]'.format(
+            name = element.name, pattern = pattern(element), properties = properties(element))
+    return 'CREATE INDEX `{name}` IF NOT EXISTS FOR {pattern} ON ({properties})'.format(
+        name = element.name, pattern = pattern(element), properties = properties(element))
+
+def drop_statement(name, kind):
+    constraint = kind == 'unique' or kind.startswith('constraint')
+    return 'DROP {what} `{name}` IF EXISTS'.format(what = 'CONSTRAINT' if constraint else 'INDEX', name = name)
+
+# The schema of the database as SchemaElements by name. The token lookup indexes and the indexes
+# owned by constraints are not listed, since they are not managed separately.
+def query_schema(session):
+    existing = {}
+    for record in session.run(
+        """SHOW CONSTRAINTS YIELD name, type, entityType, labelsOrTypes, properties
+            RETURN name, type, entityType, labelsOrTypes, properties;"""
+    ):
+        unique = record['type'] in ('UNIQUENESS', 'RELATIONSHIP_UNIQUENESS',
+                                    'NODE_PROPERTY_UNIQUENESS', 'RELATIONSHIP_PROPERTY_UNIQUENESS')
+        kind = 'unique' if unique else 'constraint ' + record['type']
+        existing[record['name']] = SchemaElement(record['name'], kind, record['entityType'],
+                                                 record['labelsOrTypes'][0], list(record['properties']))
+    for record in session.run(
+        """SHOW INDEXES YIELD name, type, entityType, labelsOrTypes, properties, owningConstraint
+            WHERE type <> 'LOOKUP' AND owningConstraint IS NULL
+            RETURN name, type, entityType, labelsOrTypes, properties;"""
+    ):
+        kind = {'RANGE': 'range', 'FULLTEXT': 'fulltext'}.get(record['type'], record['type'])
+        existing[record['name']] = SchemaElement(record['name'], kind, record['entityType'],
+                                                 record['labelsOrTypes'][0], list(record['properties']))
+    return existing
+
+# (drops, creates): the statements turning the existing schema into the spec. Drops come first,
+# so that an index replaced by a constraint on the same property is gone before the constraint
+# is created, and constraints are created before the indexes.
+def schema_changes(existing, schema = SCHEMA):
+    wanted = {element.name: element for element in schema}
+    drops = [drop_statement(name, element.kind) for name, element in sorted(existing.items())
+             if wanted.get(name) != element]
+    creates = [create_statement(element) for element in sorted(schema, key = lambda element: element.kind != 'unique')
+               if existing.get(element.name) != element]
+    return drops, creates
+
+def apply_schema(session, schema = SCHEMA, dry_run = False, await_seconds = AWAIT_SECONDS):
+    drops, creates = schema_changes(query_schema(session), schema)
+    for statement in drops + creates:
+        print(statement)
+        if not dry_run:
+            session.run(statement).consume()
+    if creates and not dry_run:
+        print('Waiting for the indexes to be online...')
+        session.run('CALL db.awaitIndexes($seconds)', seconds = await_seconds).consume()
+    return drops, creates
+
+def drop_indexes(session, schema = SCHEMA):
+    for element in schema:
+        session.run(drop_statement(element.name, element.kind)).consume()
+
+def create_indexes(session, schema = SCHEMA):
+    apply_schema(session, schema)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Bring the indexes and constraints of the database in line with SCHEMA.')
+    parser.add_argument('--dry-run', action = 'store_true', help = 'only print the statements')
+    parser.add_argument('--drop', action = 'store_true', help = 'drop every index and constraint of SCHEMA')
+    args = parser.parse_args()
+
+    with session_scope() as session:
+        if args.drop:
+            print('Dropping the indexes and constraints...')
+            drop_indexes(session)
+        else:
+            drops, creates = apply_schema(session, dry_run = args.dry_run)
+            print('{drops} dropped, {creates} created.'.format(drops = len(drops), creates = len(creates)))
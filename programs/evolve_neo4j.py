@@ -1,55 +1,63 @@
-from session_helper_neo4j import create_session, clean_session
+import argparse
+from session_helper_neo4j import session_scope
+from decision_neo4j import decide_pending
+from migrations_neo4j import BATCH_SIZE, Migration, MigrationStep, migrate, query_migrations
 
-def load_node_institution_semantic(session):
-    session.run("""LOAD CSV WITH HEADERS FROM 'file:///authors_semantic.csv' AS line
-        MERGE(i:Institution {
-            name: line.institution
-        });""")
-
-    session.run(
-        """LOAD CSV WITH HEADERS FROM 'file:///authors_semantic.csv' AS line
-            CREATE (a:Author {name:line.name}) 
-            WITH a, line
+# Institutions are merged on their name, next to the authors already loaded, instead of
+# creating a second Author node per csv line.
+MIGRATION_INSTITUTIONS = Migration(
+    1, 'institutions',
+    ["""CREATE CONSTRAINT institution_name IF NOT EXISTS
+        FOR (i:Institution)
+        REQUIRE i.name IS UNIQUE;"""],
+    [MigrationStep(
+        """UNWIND $rows AS line
+            WITH line
+            WHERE line.institution IS NOT NULL
+            MATCH (a:Author {ID: line.ID})
             MERGE (i:Institution {name: line.institution})
-            WITH a, i, line
-            CREATE (a) - [r:is_from] -> (i)
-            SET r.department = line.department;"""
-    )
+            MERGE (a) - [r:is_from] -> (i)
+            SET r.department = line.department""",
+        'authors_semantic.csv')],
+    ['Institution', 'is_from'],
+)
 
 # To identify the decision on the basis of acceptance probability, we are assigning probability values
 # given by each author to their to-be-reviewed paper. 
 # We have assumed that acceptanceProbability is an temporary attribute (not to be included) in final graph
 # as it's finally evolved into decision.
-def load_relation_author_reviews_paper(session):
-    session.run(
-        """
-        LOAD CSV WITH HEADERS FROM 'file:///author_review_papers.csv' AS line
-            MATCH (author:Author {ID: toString(toInteger(line.START_ID))}) - [r:reviews] -> (paper:Paper {ID: line.END_ID})
-            SET r.comment = line.comment, r.acceptanceProbability = toFloat(line.acceptanceProbability);
-        """
-    )
+MIGRATION_REVIEW_COMMENTS = Migration(
+    2, 'review_comments',
+    [],
+    [MigrationStep(
+        """UNWIND $rows AS line
+            MATCH (author:Author {ID: toString(toInteger(line.START_ID))})
+            WITH author, line
+            MATCH (paper:Paper {ID: line.END_ID})
+            MERGE (author) - [r:reviews] -> (paper)
+            SET r.comment = line.comment, r.acceptanceProbability = toFloat(line.acceptanceProbability),
+                paper:PendingDecision""",
+        'author_review_papers.csv')],
+    ['reviews'],
+)
+
+MIGRATIONS = [MIGRATION_INSTITUTIONS, MIGRATION_REVIEW_COMMENTS]
 
-# In this case, we are assuming each reviewer assigns a particular probability / score out of 10 (each)
-# It is accepted when the probability > 0.5 or score > 15
-def query_accept_paper_publication(session):
-    session.run(
-        """
-        MATCH (a:Author) - [r:reviews] -> (p:Paper)
-        WITH a, r, p,
-        CASE
-            WHEN SUM(r.acceptanceProbability) > 0.5 
-            THEN True ELSE False 
-        END AS decision
-        SET r.decision = decision;
-        """
-    )
+if __name__ == '__main__':
+    from queries_neo4j import print_query_results
 
-session = create_session()
+    parser = argparse.ArgumentParser(description = 'Apply the pending graph evolutions.')
+    parser.add_argument('--target', type = int, default = None, help = 'last migration version to apply')
+    parser.add_argument('--batch-size', type = int, default = BATCH_SIZE)
+    parser.add_argument('--status', action = 'store_true', help = 'only print the applied migrations')
+    args = parser.parse_args()
 
-print('Creating and loading the evolved nodes and relations into the database...')
-session.execute_write(load_node_institution_semantic)
-session.execute_write(load_relation_author_reviews_paper)
-session.execute_write(query_accept_paper_publication)
-print('Creation and loading for evolved nodes done for the database.')
+    with session_scope() as session:
+        if not args.status:
+            print('Creating and loading the evolved nodes and relations into the database...')
+            migrate(session, MIGRATIONS, args.target, args.batch_size)
+            print('Decided on {papers} papers with new or changed reviews.'.format(papers = decide_pending(session)))
+            print('Creation and loading for evolved nodes done for the database.')
 
-session.close()
\ No newline at end of file
+        records, summary = session.execute_read(query_migrations)
+        print_query_results(records, summary)
@@ -0,0 +1,184 @@
+import argparse
+import csv
+import json
+import os
+from neo4j.graph import Node, Relationship, Path
+from session_helper_neo4j import session_scope
+
+FETCH_SIZE = 2000
+BATCH_SIZE = 10000
+MAX_BUFFERED_ROWS = 100000
+
+# Streaming export of query results.
+# The records are pulled from the driver fetch_size at a time while they are iterated, and
+# handed to the sink BATCH_SIZE at a time, so at most one batch is kept in memory whatever the
+# size of the result. The summary is consumed once the last record was written.
+
+# Converts driver values to plain Python values that json, csv and arrow can store
+def plain_value(value):
+    if isinstance(value, Node):
+        return dict(value.items(), _labels = sorted(value.labels))
+    if isinstance(value, Relationship):
+        return dict(value.items(), _type = value.type)
+    if isinstance(value, Path):
+        return [plain_value(node) for node in value.nodes]
+    if isinstance(value, (list, tuple)):
+        return [plain_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: plain_value(item) for key, item in value.items()}
+    if hasattr(value, 'iso_format'):
+        return value.iso_format()
+    return value
+
+# The schema only applies to the arrow formats
+class NDJSONSink:
+    def __init__(self, file_name, keys, schema = None):
+        self.output = open(file_name, 'w', encoding = 'utf-8')
+
+    def write(self, rows):
+        self.output.writelines(json.dumps(row, ensure_ascii = False, default = str) + '\n' for row in rows)
+
+    def close(self):
+        self.output.close()
+
+# Nested values (lists, maps, nodes) are written as json in their cell
+class CSVSink:
+    def __init__(self, file_name, keys, schema = None):
+        self.output = open(file_name, 'w', newline = '', encoding = 'utf-8')
+        self.writer = csv.DictWriter(self.output, fieldnames = keys)
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows({key: json.dumps(value, default = str) if isinstance(value, (list, dict)) else value
+                               for key, value in row.items()} for row in rows)
+
+    def close(self):
+        self.output.close()
+
+# Parquet or Arrow IPC files, with pyarrow. With no schema given, the batches are kept until every
+# column has a type (or MAX_BUFFERED_ROWS rows are kept) and the schema is the union of their
+# inferred schemas, so that a column that is null in the first rows still gets its type; columns
+# that are null in all those rows stay null, and a schema has to be given if they can have values
+# later. An empty result still writes a file, with null columns.
+class ArrowSink:
+    def __init__(self, file_name, keys, schema = None):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('Exporting to {file_name} needs pyarrow (pip install pyarrow)'.format(file_name = file_name))
+        self.pyarrow = pyarrow
+        self.file_name = file_name
+        self.keys = list(keys)
+        self.writer = None
+        self.schema = None
+        self.buffered = []
+        self.buffered_rows = 0
+        if schema is not None:
+            self.open(schema)
+
+    def open(self, schema):
+        self.schema = schema
+        if self.file_name.endswith('.parquet'):
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(self.file_name, schema)
+        else:
+            import pyarrow.ipc
+            self.writer = pyarrow.ipc.new_file(self.file_name, schema)
+
+    def buffered_schema(self):
+        columns = self.pyarrow.schema([(key, self.pyarrow.null()) for key in self.keys])
+        return self.pyarrow.unify_schemas([columns] + [table.schema for table in self.buffered],
+                                          promote_options = 'permissive')
+
+    def flush(self):
+        self.open(self.buffered_schema())
+        for table in self.buffered:
+            self.writer.write_table(table.select(self.schema.names).cast(self.schema))
+        self.buffered = []
+
+    def write(self, rows):
+        if self.writer is not None:
+            self.writer.write_table(self.pyarrow.Table.from_pylist(rows, schema = self.schema))
+            return
+
+        self.buffered.append(self.pyarrow.Table.from_pylist(rows))
+        self.buffered_rows += len(rows)
+        typed = not any(self.pyarrow.types.is_null(field.type) for field in self.buffered_schema())
+        if typed or self.buffered_rows >= MAX_BUFFERED_ROWS:
+            self.flush()
+
+    def close(self):
+        if self.writer is None:
+            self.flush()
+        self.writer.close()
+
+SINKS = {
+    '.ndjson': NDJSONSink,
+    '.jsonl': NDJSONSink,
+    '.csv': CSVSink,
+    '.parquet': ArrowSink,
+    '.arrow': ArrowSink,
+}
+
+def open_sink(file_name, keys, schema = None):
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension not in SINKS:
+        raise ValueError('Unknown export format {extension}, expected one of {formats}'.format(
+            extension = extension, formats = ', '.join(sorted(SINKS)),
+        ))
+    return SINKS[extension](file_name, keys, schema)
+
+# Yields the records of a result as lists of plain dicts of at most batch_size rows
+def record_batches(result, batch_size = BATCH_SIZE):
+    batch = []
+    for record in result:
+        batch.append({key: plain_value(value) for key, value in record.items()})
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# schema is an optional pyarrow schema for the parquet and arrow files
+def export_result(result, file_name, batch_size = BATCH_SIZE, schema = None):
+    sink = open_sink(file_name, result.keys(), schema)
+    rows = 0
+    try:
+        for batch in record_batches(result, batch_size):
+            sink.write(batch)
+            rows += len(batch)
+    finally:
+        sink.close()
+    return rows, result.consume()
+
+# Runs query in a read transaction of its own session, so that fetch_size only applies to it
+def export_query(query, file_name, parameters = None, fetch_size = FETCH_SIZE, batch_size = BATCH_SIZE, schema = None):
+    with session_scope(fetch_size = fetch_size) as session:
+        return session.execute_read(
+            lambda tx: export_result(tx.run(query, parameters or {}), file_name, batch_size, schema))
+
+if __name__ == '__main__':
+    from async_runner_neo4j import pipeline_steps
+
+    steps = {step.name: step for pipeline in pipeline_steps().values() for step in pipeline if not step.write}
+    parser = argparse.ArgumentParser(description = 'Stream the result of a query to a ndjson, csv, parquet or arrow file.')
+    parser.add_argument('output', help = 'the file extension selects the format: ' + ', '.join(sorted(SINKS)))
+    parser.add_argument('--step', choices = sorted(steps), help = 'a read step of the query pipelines')
+    parser.add_argument('--query', help = 'any read-only Cypher query')
+    parser.add_argument('--fetch-size', type = int, default = FETCH_SIZE)
+    parser.add_argument('--batch-size', type = int, default = BATCH_SIZE)
+    args = parser.parse_args()
+    if (args.step is None) == (args.query is None):
+        parser.error('give either --step or --query')
+
+    if args.step is not None:
+        step = steps[args.step]
+        query, parameters = step.queries[-1], step.parameters
+    else:
+        query, parameters = args.query, None
+
+    rows, summary = export_query(query, args.output, parameters, args.fetch_size, args.batch_size)
+    print('Exported {rows} rows to {output}; the first record was available after {available} ms and the last consumed after {consumed} ms.'.format(
+        rows = rows, output = args.output,
+        available = summary.result_available_after, consumed = summary.result_consumed_after,
+    ))
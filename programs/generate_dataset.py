@@ -0,0 +1,401 @@
+import argparse
+import csv
+import hashlib
+import os
+import shutil
+import uuid
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from graph_store import NODE_FILES, RELATION_FILES
+
+# Synthetic version of data/: the same csv files and columns, at any scale factor, without the
+# Semantic Scholar API. Everything is drawn from numpy generators seeded from (seed, task), where
+# the authors and papers are drawn in blocks of BLOCK_SIZE with one generator each, so the output
+# only depends on the seed and the settings, not on the number of worker processes or the chunk
+# size. The workers generate chunks of CHUNK_SIZE (rounded to whole blocks), each writing its own
+# part files, which are then concatenated in order. The popularity distributions every chunk
+# draws from are computed once and shared with the workers as memory-mapped .npy files.
+DatasetSettings = namedtuple('DatasetSettings', [
+    'scale_factor', 'seed',
+    'papers', 'authors', 'keywords', 'conference_series', 'editions', 'journals',
+    'mean_authors', 'mean_keywords', 'mean_citations', 'reviewers',
+    'citation_exponent', 'productivity_exponent', 'conference_share', 'first_year', 'last_year',
+])
+
+PAPERS = 1000
+AUTHORS_PER_PAPER = 1.5
+MEAN_AUTHORS = 4.0
+MEAN_KEYWORDS = 2.0
+MEAN_CITATIONS = 15.0
+REVIEWERS = 3
+# Exponents of the power-law tails: the number of citations of a paper and the number of
+# papers of an author follow P(k) ~ k^-exponent
+CITATION_EXPONENT = 2.1
+PRODUCTIVITY_EXPONENT = 2.5
+CONFERENCE_SHARE = 0.5
+EDITIONS = 6
+FIRST_YEAR = 2000
+LAST_YEAR = 2023
+BLOCK_SIZE = 10000
+CHUNK_SIZE = 50000
+
+COMMUNITY_KEYWORDS = ['Data Management', 'Indexing', 'Data Modeling', 'Big Data', 'Data Processing',
+                      'Data Storage', 'Data Querying']
+DOMAINS = ['Computer Science', 'Engineering', 'Medicine', 'Physics', 'Biology', 'Economics', 'Geography']
+WORDS = ['data', 'graph', 'query', 'learning', 'network', 'analysis', 'model', 'system', 'scalable',
+         'distributed', 'efficient', 'semantic', 'index', 'storage', 'stream', 'optimization', 'protein',
+         'clinical', 'deep', 'neural', 'software', 'evolution', 'probabilistic', 'approximate', 'parallel',
+         'transaction', 'privacy', 'secure', 'retrieval', 'knowledge', 'reasoning', 'benchmark', 'adaptive',
+         'temporal', 'spatial', 'sequence', 'genome', 'simulation', 'framework', 'evaluation', 'survey',
+         'robust', 'interactive', 'visual', 'processing', 'mining', 'inference', 'embedding', 'cloud',
+         'compression', 'partitioning', 'consistency', 'recovery', 'workload', 'estimation', 'sampling']
+FIRST_NAMES = ['Ana', 'Bo', 'Carla', 'David', 'Elena', 'Farid', 'Grace', 'Hiro', 'Ines', 'Jonas', 'Kiran',
+               'Lena', 'Mateo', 'Nadia', 'Omar', 'Priya', 'Quentin', 'Rosa', 'Sven', 'Tariq', 'Uma', 'Victor']
+LAST_NAMES = ['Garcia', 'Smith', 'Kumar', 'Chen', 'Novak', 'Silva', 'Okafor', 'Rossi', 'Muller', 'Sato',
+              'Dubois', 'Kowalski', 'Haddad', 'Jensen', 'Moreau', 'Ivanova', 'Lopez', 'Nakamura', 'Ali']
+DEPARTMENTS = ['Regular school', 'Graduate school', 'Research institute', 'Medical school', 'Business school']
+INSTITUTIONS = ['Universitat Politecnica de Catalunya', 'Universite libre de Bruxelles', 'CentraleSupelec',
+                'Technische Universitat Berlin', 'University of Padova', 'Eindhoven University of Technology',
+                'University of Tartu', 'Aalto University', 'KTH Royal Institute of Technology', 'ETH Zurich']
+CITIES = ['Barcelona', 'Brussels', 'Paris', 'Berlin', 'Padova', 'Eindhoven', 'Tartu', 'Helsinki', 'Stockholm',
+          'Zurich', 'Boston', 'Seattle', 'Tokyo', 'Singapore', 'Toronto']
+VENUE_TOPICS = ['Data Engineering', 'Management of Data', 'Very Large Data Bases', 'Knowledge Discovery',
+                'Software Engineering', 'Information Retrieval', 'Machine Learning', 'Bioinformatics',
+                'Distributed Computing', 'Computer Vision', 'Web Search', 'Database Theory']
+
+def dataset_settings(scale_factor = 1.0, seed = 0, mean_authors = MEAN_AUTHORS, mean_keywords = MEAN_KEYWORDS,
+                     mean_citations = MEAN_CITATIONS, reviewers = REVIEWERS,
+                     citation_exponent = CITATION_EXPONENT, productivity_exponent = PRODUCTIVITY_EXPONENT,
+                     conference_share = CONFERENCE_SHARE, editions = EDITIONS):
+    papers = max(int(PAPERS * scale_factor), 2)
+    return DatasetSettings(
+        scale_factor = scale_factor, seed = seed,
+        papers = papers,
+        authors = max(int(papers * AUTHORS_PER_PAPER), reviewers + int(mean_authors) + 1),
+        # The vocabularies grow slower than the papers
+        keywords = len(COMMUNITY_KEYWORDS) + max(int(20 * scale_factor ** 0.5), 1),
+        conference_series = max(int(20 * scale_factor ** 0.5), 1),
+        editions = editions,
+        journals = max(int(40 * scale_factor ** 0.5), 1),
+        mean_authors = mean_authors, mean_keywords = mean_keywords, mean_citations = mean_citations,
+        reviewers = reviewers, citation_exponent = citation_exponent,
+        productivity_exponent = productivity_exponent, conference_share = conference_share,
+        first_year = FIRST_YEAR, last_year = LAST_YEAR,
+    )
+
+def generator(settings, *task):
+    return np.random.default_rng(np.random.SeedSequence([settings.seed] + list(task)))
+
+# Cumulative distribution of a Zipf law over n items in a random order. With a Zipf exponent of
+# 1 / (exponent - 1), the number of draws per item has a power-law tail of the given exponent.
+def popularity(n, exponent, rng):
+    weights = np.arange(1, n + 1, dtype = np.float64) ** (-1.0 / (exponent - 1.0))
+    weights = weights[rng.permutation(n)]
+    cumulative = np.cumsum(weights)
+    return cumulative / cumulative[-1]
+
+def draw(cumulative, size, rng):
+    return np.minimum(np.searchsorted(cumulative, rng.random(size), side = 'right'), len(cumulative) - 1)
+
+# The first occurrence of every (group, item) pair, in the original order
+def first_occurrences(groups, items, item_count):
+    _, index = np.unique(groups.astype(np.int64) * item_count + items, return_index = True)
+    return np.sort(index)
+
+def paper_id(settings, paper):
+    return hashlib.sha1('{seed}:paper:{paper}'.format(seed = settings.seed, paper = paper).encode('utf-8')).hexdigest()
+
+def author_id(author):
+    return str(1000000 + author)
+
+def uuids(rng, count):
+    return [str(uuid.UUID(bytes = rng.bytes(16), version = 4)) for _ in range(count)]
+
+def sentences(rng, count, min_words, max_words):
+    lengths = rng.integers(min_words, max_words + 1, size = count)
+    words = rng.integers(0, len(WORDS), size = (count, max_words))
+    return [' '.join(WORDS[word] for word in row[:length]).capitalize() for row, length in zip(words, lengths)]
+
+def csv_header(file_name):
+    for label, (node_file, properties) in NODE_FILES.items():
+        if node_file == file_name:
+            return ['ID'] + list(properties)
+    for rel_type, (relation_file, _, _, properties) in RELATION_FILES.items():
+        if relation_file == file_name:
+            return ['START_ID', 'END_ID'] + list(properties)
+    raise ValueError('Unknown data file {file_name}'.format(file_name = file_name))
+
+def write_rows(path, rows, header = None):
+    with open(path, 'w', newline = '') as output:
+        writer = csv.writer(output)
+        if header:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+# Venues and keywords are small, so they are generated at once. Returns the ids the paper
+# chunks need: keywords, conference editions and journals.
+def generate_venues(settings, output_dir):
+    rng = generator(settings, 0)
+
+    keyword_ids = uuids(rng, settings.keywords)
+    names = COMMUNITY_KEYWORDS + ['{word} {domain}'.format(word = WORDS[i % len(WORDS)].capitalize(),
+                                                           domain = DOMAINS[i % len(DOMAINS)])
+                                  for i in range(settings.keywords - len(COMMUNITY_KEYWORDS))]
+    write_rows(os.path.join(output_dir, 'keywords_semantic.csv'),
+               [(keyword, name, 'Computer Science' if position < len(COMMUNITY_KEYWORDS) else DOMAINS[position % len(DOMAINS)])
+                for position, (keyword, name) in enumerate(zip(keyword_ids, names))],
+               csv_header('keywords_semantic.csv'))
+
+    conference_ids = uuids(rng, settings.conference_series * settings.editions)
+    proceeding_ids = uuids(rng, len(conference_ids))
+    conferences = []
+    proceedings = []
+    for series in range(settings.conference_series):
+        name = 'International Conference on {topic}'.format(topic = VENUE_TOPICS[series % len(VENUE_TOPICS)])
+        if series >= len(VENUE_TOPICS):
+            name += ' {number}'.format(number = series // len(VENUE_TOPICS) + 1)
+        first_year = int(rng.integers(settings.first_year, settings.last_year - settings.editions + 2))
+        for edition in range(settings.editions):
+            position = series * settings.editions + edition
+            conferences.append((conference_ids[position], name, first_year + edition, edition + 1))
+            proceedings.append((proceeding_ids[position], 'Proceedings of the {year} {name}'.format(
+                year = first_year + edition, name = name), CITIES[int(rng.integers(len(CITIES)))]))
+    write_rows(os.path.join(output_dir, 'conference_semantic.csv'), conferences, csv_header('conference_semantic.csv'))
+    write_rows(os.path.join(output_dir, 'proceedings_semantic.csv'), proceedings, csv_header('proceedings_semantic.csv'))
+    write_rows(os.path.join(output_dir, 'conference_part_of_proceedings.csv'), zip(conference_ids, proceeding_ids),
+               csv_header('conference_part_of_proceedings.csv'))
+
+    journal_ids = uuids(rng, settings.journals)
+    write_rows(os.path.join(output_dir, 'journal_semantic.csv'),
+               [(journal, 'Journal of {topic}{suffix}'.format(
+                   topic = VENUE_TOPICS[position % len(VENUE_TOPICS)],
+                   suffix = ' {letter}'.format(letter = chr(ord('A') + position // len(VENUE_TOPICS) - 1))
+                   if position >= len(VENUE_TOPICS) else '',
+               )) for position, journal in enumerate(journal_ids)],
+               csv_header('journal_semantic.csv'))
+
+    return keyword_ids, conference_ids, journal_ids
+
+def generate_authors(task):
+    settings, output_dir, chunk, start, end = task
+    with open(part_path(output_dir, 'authors_semantic.csv', chunk), 'w', newline = '') as output:
+        writer = csv.writer(output)
+        for block_start in range(start, end, BLOCK_SIZE):
+            generate_author_block(settings, block_start, min(block_start + BLOCK_SIZE, end), writer)
+
+def generate_author_block(settings, start, end, writer):
+    rng = generator(settings, 1, start // BLOCK_SIZE)
+    count = end - start
+    first = rng.integers(0, len(FIRST_NAMES), size = count)
+    last = rng.integers(0, len(LAST_NAMES), size = count)
+    departments = rng.integers(0, len(DEPARTMENTS), size = count)
+    institutions = rng.integers(0, len(INSTITUTIONS), size = count)
+    writer.writerows(
+        (author_id(author),
+         '{initial}. {last}'.format(initial = FIRST_NAMES[first[i]][0], last = LAST_NAMES[last[i]]),
+         '{first}.{last}.{author}@example.org'.format(first = FIRST_NAMES[first[i]], last = LAST_NAMES[last[i]], author = author),
+         DEPARTMENTS[departments[i]], INSTITUTIONS[institutions[i]])
+        for i, author in enumerate(range(start, end))
+    )
+
+PAPER_FILES = ['papers_semantic.csv', 'author_writes_papers.csv', 'paper_has_keywords.csv',
+               'paper_presented_in_conference.csv', 'paper_published_in_journal.csv', 'paper_cites_paper.csv',
+               'author_review_papers.csv']
+
+POPULARITIES = ['cited', 'productive', 'keyword', 'series', 'journal']
+
+# The popularity of papers, authors, keywords and venues, which is the same in every chunk
+def write_popularities(settings, output_dir, keyword_count, journal_count):
+    shared = generator(settings, 2)
+    distributions = {
+        'cited': popularity(settings.papers, settings.citation_exponent, shared),
+        'productive': popularity(settings.authors, settings.productivity_exponent, shared),
+        'keyword': popularity(keyword_count, 2.0, shared),
+        'series': popularity(settings.conference_series, 2.5, shared),
+        'journal': popularity(journal_count, 2.5, shared),
+    }
+    for name in POPULARITIES:
+        np.save(popularity_path(output_dir, name), distributions[name])
+
+def read_popularities(output_dir):
+    return {name: np.load(popularity_path(output_dir, name), mmap_mode = 'r') for name in POPULARITIES}
+
+def generate_papers(task):
+    settings, output_dir, chunk, start, end, keyword_ids, conference_ids, journal_ids = task
+    popularities = read_popularities(output_dir)
+    outputs = [open(part_path(output_dir, file_name, chunk), 'w', newline = '') for file_name in PAPER_FILES]
+    try:
+        parts = {file_name: csv.writer(output) for file_name, output in zip(PAPER_FILES, outputs)}
+        for block_start in range(start, end, BLOCK_SIZE):
+            generate_paper_block(settings, block_start, min(block_start + BLOCK_SIZE, end),
+                                 keyword_ids, conference_ids, journal_ids, popularities, parts)
+    finally:
+        for output in outputs:
+            output.close()
+
+def generate_paper_block(settings, start, end, keyword_ids, conference_ids, journal_ids, popularities, parts):
+    cited = popularities['cited']
+    productive = popularities['productive']
+    keyword_popularity = popularities['keyword']
+    series_popularity = popularities['series']
+    journal_popularity = popularities['journal']
+
+    rng = generator(settings, 3, start // BLOCK_SIZE)
+    papers = np.arange(start, end)
+    count = len(papers)
+    ids = [paper_id(settings, paper) for paper in papers]
+    def ref(paper):
+        return ids[paper - start]
+
+    titles = sentences(rng, count, 4, 10)
+    abstracts = sentences(rng, count, 20, 40)
+    has_abstract = rng.random(count) < 0.8
+    first_page = rng.integers(1, 400, size = count)
+    page_count = rng.integers(4, 30, size = count)
+    parts['papers_semantic.csv'].writerows((
+        (ids[i], titles[i], abstracts[i] if has_abstract[i] else '',
+         '{first}-{last}'.format(first = first_page[i], last = first_page[i] + page_count[i]),
+         '10.{registrant}/{suffix}'.format(registrant = 1000 + papers[i] % 9000, suffix = ids[i][:12]),
+         'https://example.org/papers/{id}'.format(id = ids[i]))
+        for i in range(count)
+    ))
+
+    # Multi-author papers: 1 + Poisson(mean - 1) authors, drawn by productivity; the first one is
+    # the corresponding author.
+    author_counts = np.minimum(1 + rng.poisson(settings.mean_authors - 1, size = count), settings.authors - settings.reviewers)
+    writers_paper = np.repeat(papers, author_counts)
+    writers = draw(productive, len(writers_paper), rng)
+    slots = np.arange(len(writers_paper)) - np.repeat(np.cumsum(author_counts) - author_counts, author_counts)
+    keep = first_occurrences(writers_paper, writers, settings.authors)
+    writers_paper, writers, slots = writers_paper[keep], writers[keep], slots[keep]
+    parts['author_writes_papers.csv'].writerows((
+        (author_id(author), ref(paper), 'TRUE' if slot == 0 else 'FALSE')
+        for author, paper, slot in zip(writers, writers_paper, slots)
+    ))
+
+    keyword_counts = np.minimum(1 + rng.poisson(settings.mean_keywords - 1, size = count), len(keyword_ids))
+    tagged = np.repeat(papers, keyword_counts)
+    keywords = draw(keyword_popularity, len(tagged), rng)
+    keep = first_occurrences(tagged, keywords, len(keyword_ids))
+    parts['paper_has_keywords.csv'].writerows((
+        (ref(paper), keyword_ids[keyword]) for paper, keyword in zip(tagged[keep], keywords[keep])
+    ))
+
+    at_conference = rng.random(count) < settings.conference_share
+    series = draw(series_popularity, count, rng)
+    editions = rng.integers(0, settings.editions, size = count)
+    journals = draw(journal_popularity, count, rng)
+    years = rng.integers(settings.first_year, settings.last_year + 1, size = count)
+    parts['paper_presented_in_conference.csv'].writerows((
+        (ids[i], conference_ids[series[i] * settings.editions + editions[i]]) for i in np.flatnonzero(at_conference)
+    ))
+    parts['paper_published_in_journal.csv'].writerows((
+        (ids[i], journal_ids[journals[i]], years[i] - settings.first_year + 1, years[i])
+        for i in np.flatnonzero(~at_conference)
+    ))
+
+    # Citations: Poisson(mean) references per paper, to papers drawn with a power-law popularity,
+    # without self citations or duplicates
+    citation_counts = rng.poisson(settings.mean_citations, size = count)
+    citing = np.repeat(papers, citation_counts)
+    targets = draw(cited, len(citing), rng)
+    targets = np.where(targets == citing, (targets + 1) % settings.papers, targets)
+    keep = first_occurrences(citing, targets, settings.papers)
+    parts['paper_cites_paper.csv'].writerows((
+        (ref(paper), paper_id(settings, target)) for paper, target in zip(citing[keep], targets[keep])
+    ))
+
+    # Reviewers are drawn uniformly and drawn again while they wrote the paper or already review it
+    reviewed = np.repeat(papers, settings.reviewers)
+    reviewers = rng.integers(0, settings.authors, size = len(reviewed))
+    written = np.unique(writers_paper.astype(np.int64) * settings.authors + writers)
+    while True:
+        keys = reviewed.astype(np.int64) * settings.authors + reviewers
+        conflicts = np.isin(keys, written)
+        conflicts[np.setdiff1d(np.arange(len(keys)), np.unique(keys, return_index = True)[1])] = True
+        if not conflicts.any():
+            break
+        reviewers[conflicts] = rng.integers(0, settings.authors, size = int(conflicts.sum()))
+    comments = sentences(rng, len(reviewed), 3, 12)
+    probabilities = rng.random(len(reviewed))
+    parts['author_review_papers.csv'].writerows((
+        (author_id(author), ref(paper), comments[i] + '.', probabilities[i])
+        for i, (author, paper) in enumerate(zip(reviewers, reviewed))
+    ))
+
+def popularity_path(output_dir, name):
+    return os.path.join(output_dir, 'parts', '{name}_popularity.npy'.format(name = name))
+
+def part_path(output_dir, file_name, chunk):
+    return os.path.join(output_dir, 'parts', '{file_name}.{chunk:06d}'.format(file_name = file_name, chunk = chunk))
+
+def concatenate_parts(output_dir, file_name, chunks):
+    with open(os.path.join(output_dir, file_name), 'w', newline = '') as output:
+        csv.writer(output).writerow(csv_header(file_name))
+        for chunk in range(chunks):
+            with open(part_path(output_dir, file_name, chunk), newline = '') as part:
+                shutil.copyfileobj(part, output)
+
+def run_tasks(function, tasks, workers):
+    if workers == 1:
+        for task in tasks:
+            function(task)
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            list(executor.map(function, tasks))
+
+def generate_dataset(output_dir, settings, workers = None, chunk_size = CHUNK_SIZE):
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(os.path.join(output_dir, 'parts'), exist_ok = True)
+    keyword_ids, conference_ids, journal_ids = generate_venues(settings, output_dir)
+    write_popularities(settings, output_dir, len(keyword_ids), len(journal_ids))
+    chunk_size = max(chunk_size // BLOCK_SIZE, 1) * BLOCK_SIZE
+
+    author_chunks = [(start, min(start + chunk_size, settings.authors)) for start in range(0, settings.authors, chunk_size)]
+    run_tasks(generate_authors, [(settings, output_dir, chunk, start, end)
+                                 for chunk, (start, end) in enumerate(author_chunks)], workers)
+    concatenate_parts(output_dir, 'authors_semantic.csv', len(author_chunks))
+
+    paper_chunks = [(start, min(start + chunk_size, settings.papers)) for start in range(0, settings.papers, chunk_size)]
+    run_tasks(generate_papers, [(settings, output_dir, chunk, start, end, keyword_ids, conference_ids, journal_ids)
+                                for chunk, (start, end) in enumerate(paper_chunks)], workers)
+    for file_name in PAPER_FILES:
+        concatenate_parts(output_dir, file_name, len(paper_chunks))
+
+    shutil.rmtree(os.path.join(output_dir, 'parts'))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate a synthetic dataset with the csv files of data/.')
+    parser.add_argument('output_dir')
+    parser.add_argument('--scale-factor', type = float, default = 1.0, help = '{papers} papers per unit'.format(papers = PAPERS))
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--chunk-size', type = int, default = CHUNK_SIZE,
+                        help = 'authors or papers per worker task, rounded to a multiple of {block}'.format(block = BLOCK_SIZE))
+    parser.add_argument('--mean-authors', type = float, default = MEAN_AUTHORS)
+    parser.add_argument('--mean-keywords', type = float, default = MEAN_KEYWORDS)
+    parser.add_argument('--mean-citations', type = float, default = MEAN_CITATIONS)
+    parser.add_argument('--reviewers', type = int, default = REVIEWERS)
+    parser.add_argument('--citation-exponent', type = float, default = CITATION_EXPONENT)
+    parser.add_argument('--productivity-exponent', type = float, default = PRODUCTIVITY_EXPONENT)
+    parser.add_argument('--conference-share', type = float, default = CONFERENCE_SHARE)
+    parser.add_argument('--editions', type = int, default = EDITIONS)
+    args = parser.parse_args()
+    # Every paper has at least one author and one keyword, and the rest are Poisson draws of mean - 1
+    if args.mean_authors < 1 or args.mean_keywords < 1:
+        parser.error('--mean-authors and --mean-keywords must be at least 1')
+    if args.mean_citations < 0:
+        parser.error('--mean-citations can not be negative')
+    # The Zipf exponent of the popularities is 1 / (exponent - 1)
+    if args.citation_exponent <= 1 or args.productivity_exponent <= 1:
+        parser.error('--citation-exponent and --productivity-exponent must be above 1')
+
+    settings = dataset_settings(
+        args.scale_factor, args.seed, args.mean_authors, args.mean_keywords, args.mean_citations, args.reviewers,
+        args.citation_exponent, args.productivity_exponent, args.conference_share, args.editions,
+    )
+    print('Generating {papers} papers and {authors} authors into {output_dir}...'.format(
+        papers = settings.papers, authors = settings.authors, output_dir = args.output_dir,
+    ))
+    generate_dataset(args.output_dir, settings, args.workers, args.chunk_size)
@@ -0,0 +1,329 @@
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+CACHE_NAME = '.columnar'
+CACHE_FORMAT = 2
+
+# Node files: label -> (csv file, {property: dtype}). The ID column is always kept as the key.
+NODE_FILES = {
+    'Keyword': ('keywords_semantic.csv', {'name': str, 'domain': str}),
+    'Author': ('authors_semantic.csv', {'name': str, 'email': str, 'department': str, 'institution': str}),
+    'Conference': ('conference_semantic.csv', {'name': str, 'year': int, 'edition': int}),
+    'Journal': ('journal_semantic.csv', {'name': str}),
+    'Proceeding': ('proceedings_semantic.csv', {'name': str, 'city': str}),
+    'Paper': ('papers_semantic.csv', {'title': str, 'abstract': str, 'pages': str, 'doi': str, 'link': str}),
+}
+
+# Relationship files: type -> (csv file, start label, end label, {property: dtype})
+RELATION_FILES = {
+    'is_part': ('conference_part_of_proceedings.csv', 'Conference', 'Proceeding', {}),
+    'writes': ('author_writes_papers.csv', 'Author', 'Paper', {'corresponding_author': bool}),
+    'has': ('paper_has_keywords.csv', 'Paper', 'Keyword', {}),
+    'presented_in': ('paper_presented_in_conference.csv', 'Paper', 'Conference', {}),
+    'published_in': ('paper_published_in_journal.csv', 'Paper', 'Journal', {'volume': int, 'year': int}),
+    'cites': ('paper_cites_paper.csv', 'Paper', 'Paper', {}),
+    'reviews': ('author_review_papers.csv', 'Author', 'Paper', {'comment': str, 'acceptanceProbability': float}),
+}
+
+# Author ids are written as floats in some files (e.g. '121567631.0'); the loaders store them
+# without the '.0' (load_data_neo4j.normalized_id), so the same normalization is applied here.
+def normalize_id(value):
+    if value.endswith('.0') and value[:-2].isdigit():
+        return value[:-2]
+    return value
+
+def read_csv(data_dir, file_name):
+    return pd.read_csv(os.path.join(data_dir, file_name), dtype = str, keep_default_na = False)
+
+def column_array(values, dtype):
+    if dtype is bool:
+        return np.array([value.strip().lower() == 'true' for value in values], dtype = bool)
+    if dtype is int:
+        return pd.to_numeric(values, errors = 'coerce').fillna(-1).to_numpy(dtype = np.int64)
+    if dtype is float:
+        return pd.to_numeric(values, errors = 'coerce').to_numpy(dtype = np.float64)
+    return values.to_numpy(dtype = object)
+
+# A column of strings stored as their concatenated utf-8 bytes and the offset of each string,
+# read through mmap. Indexing with a position gives a str, with an array or a slice an object array.
+class StringColumn:
+    def __init__(self, path):
+        self.data = np.memmap(path + '.bin', dtype = np.uint8, mode = 'r') if os.path.getsize(path + '.bin') else np.zeros(0, dtype = np.uint8)
+        self.offsets = np.load(path + '_offsets.npy', mmap_mode = 'r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        return (self[position] for position in range(len(self)))
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            position = np.arange(len(self))[position]
+        if np.ndim(position):
+            return np.array([self[int(item)] for item in position], dtype = object)
+        return self.data[self.offsets[position]:self.offsets[position + 1]].tobytes().decode('utf-8')
+
+def write_strings(path, values):
+    encoded = [str(value).encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype = np.int64)
+    np.cumsum([len(value) for value in encoded], out = offsets[1:])
+    with open(path + '.bin', 'wb') as data_file:
+        data_file.writelines(encoded)
+    np.save(path + '_offsets.npy', offsets)
+
+def write_column(path, values):
+    if values.dtype == object:
+        write_strings(path, values)
+    else:
+        np.save(path + '.npy', values)
+
+def open_column(path):
+    if os.path.exists(path + '.npy'):
+        return np.load(path + '.npy', mmap_mode = 'r')
+    return StringColumn(path)
+
+# Nodes are interned: position i of every column is the node with code i, and ids maps the code
+# back to its (normalized) csv ID. The reverse lookup is only built when it is first needed.
+class NodeTable:
+    def __init__(self, label, ids, properties):
+        self.label = label
+        self.ids = ids
+        self.properties = properties
+        self._positions = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def positions(self):
+        if self._positions is None:
+            self._positions = {node_id: position for position, node_id in enumerate(self.ids)}
+        return self._positions
+
+    def index(self, node_id):
+        return self.positions[normalize_id(node_id)]
+
+    def indices(self, node_ids):
+        return np.array([self.positions.get(normalize_id(node_id), -1) for node_id in node_ids], dtype = np.int32)
+
+# Compressed sparse row adjacency: the neighbours of node i are indices[indptr[i]:indptr[i + 1]]
+# and edges[...] gives the position of each of those edges in the relationship's columns.
+class CSR:
+    def __init__(self, sources, targets, node_count):
+        order = np.argsort(sources, kind = 'stable')
+        self.indptr = np.zeros(node_count + 1, dtype = np.int64)
+        np.cumsum(np.bincount(sources, minlength = node_count), out = self.indptr[1:])
+        self.indices = targets[order]
+        self.edges = order.astype(np.int32)
+
+    @classmethod
+    def from_arrays(cls, indptr, indices, edges):
+        adjacency = cls.__new__(cls)
+        adjacency.indptr, adjacency.indices, adjacency.edges = indptr, indices, edges
+        return adjacency
+
+    def neighbors(self, node):
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def edge_ids(self, node):
+        return self.edges[self.indptr[node]:self.indptr[node + 1]]
+
+    def degrees(self):
+        return np.diff(self.indptr)
+
+    # Positions in indices/edges of all the edges leaving the given nodes, without a Python loop
+    def positions(self, nodes):
+        starts = self.indptr[nodes]
+        counts = self.indptr[nodes + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return offsets + np.arange(counts.sum())
+
+class Relation:
+    def __init__(self, rel_type, source_label, target_label, sources, targets, properties, source_count, target_count,
+                 out = None, incoming = None):
+        self.type = rel_type
+        self.source_label = source_label
+        self.target_label = target_label
+        self.sources = sources
+        self.targets = targets
+        self.properties = properties
+        self.out = out if out is not None else CSR(sources, targets, source_count)
+        self.incoming = incoming if incoming is not None else CSR(targets, sources, target_count)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def adjacency(self, direction = 'out'):
+        return self.out if direction == 'out' else self.incoming
+
+class GraphStore:
+    def __init__(self, nodes, relations):
+        self.nodes = nodes
+        self.relations = relations
+
+    @classmethod
+    def from_csv(cls, data_dir = DATA_DIR):
+        nodes = {}
+        for label, (file_name, columns) in NODE_FILES.items():
+            frame = read_csv(data_dir, file_name)
+            ids = np.array([normalize_id(value) for value in frame['ID']], dtype = object)
+            properties = {name: column_array(frame[name], dtype) for name, dtype in columns.items()}
+            nodes[label] = NodeTable(label, ids, properties)
+
+        relations = {}
+        for rel_type, (file_name, source_label, target_label, columns) in RELATION_FILES.items():
+            frame = read_csv(data_dir, file_name)
+            sources = nodes[source_label].indices(frame['START_ID'])
+            targets = nodes[target_label].indices(frame['END_ID'])
+
+            # Like MATCH in the loader, rows pointing to unknown nodes are dropped, and like its
+            # MERGE only the first row of a pair of nodes is kept
+            found = (sources >= 0) & (targets >= 0)
+            pairs = np.where(found, sources.astype(np.int64) * len(nodes[target_label]) + targets, -1)
+            first = np.zeros(len(pairs), dtype = bool)
+            first[np.unique(pairs, return_index = True)[1]] = True
+            found &= first
+            properties = {name: column_array(frame[name], dtype)[found] for name, dtype in columns.items()}
+            relations[rel_type] = Relation(
+                rel_type, source_label, target_label, sources[found], targets[found], properties,
+                len(nodes[source_label]), len(nodes[target_label]),
+            )
+
+        return cls(nodes, relations)
+
+    # Columnar cache of the store: one directory per label and relationship type, with a .npy
+    # file per numeric column and the codes and CSR arrays of the relations as int32, string
+    # columns (the ID dictionary included) as utf-8 bytes and offsets. The directory is written
+    # aside and renamed into place, so a cache is never seen half written.
+    def save(self, cache_dir, sources = None):
+        temporary = cache_dir + '.tmp'
+        shutil.rmtree(temporary, ignore_errors = True)
+        for label, table in self.nodes.items():
+            directory = os.path.join(temporary, label)
+            os.makedirs(directory)
+            write_strings(os.path.join(directory, 'ids'), table.ids)
+            for name, values in table.properties.items():
+                write_column(os.path.join(directory, name), np.asarray(values))
+
+        for rel_type, relation in self.relations.items():
+            directory = os.path.join(temporary, rel_type)
+            os.makedirs(directory)
+            np.save(os.path.join(directory, 'sources.npy'), np.asarray(relation.sources, dtype = np.int32))
+            np.save(os.path.join(directory, 'targets.npy'), np.asarray(relation.targets, dtype = np.int32))
+            for direction in ('out', 'in'):
+                adjacency = relation.adjacency(direction)
+                np.save(os.path.join(directory, direction + '_indptr.npy'), np.asarray(adjacency.indptr, dtype = np.int64))
+                np.save(os.path.join(directory, direction + '_indices.npy'), np.asarray(adjacency.indices, dtype = np.int32))
+                np.save(os.path.join(directory, direction + '_edges.npy'), np.asarray(adjacency.edges, dtype = np.int32))
+            for name, values in relation.properties.items():
+                write_column(os.path.join(directory, name), np.asarray(values))
+
+        with open(os.path.join(temporary, 'manifest.json'), 'w') as manifest_file:
+            json.dump({
+                'sources': sources,
+                'nodes': {label: list(table.properties) for label, table in self.nodes.items()},
+                'relations': {rel_type: [relation.source_label, relation.target_label, list(relation.properties)]
+                              for rel_type, relation in self.relations.items()},
+            }, manifest_file)
+        shutil.rmtree(cache_dir, ignore_errors = True)
+        os.replace(temporary, cache_dir)
+
+    # Opens a cache written by save; every array is memory-mapped, nothing is parsed
+    @classmethod
+    def open(cls, cache_dir):
+        with open(os.path.join(cache_dir, 'manifest.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+
+        nodes = {}
+        for label, names in manifest['nodes'].items():
+            directory = os.path.join(cache_dir, label)
+            properties = {name: open_column(os.path.join(directory, name)) for name in names}
+            nodes[label] = NodeTable(label, StringColumn(os.path.join(directory, 'ids')), properties)
+
+        relations = {}
+        for rel_type, (source_label, target_label, names) in manifest['relations'].items():
+            directory = os.path.join(cache_dir, rel_type)
+            array = lambda name: np.load(os.path.join(directory, name + '.npy'), mmap_mode = 'r')
+            adjacency = {direction: CSR.from_arrays(array(direction + '_indptr'), array(direction + '_indices'),
+                                                    array(direction + '_edges'))
+                         for direction in ('out', 'in')}
+            properties = {name: open_column(os.path.join(directory, name)) for name in names}
+            relations[rel_type] = Relation(
+                rel_type, source_label, target_label, array('sources'), array('targets'), properties,
+                len(nodes[source_label]), len(nodes[target_label]), adjacency['out'], adjacency['in'],
+            )
+
+        return cls(nodes, relations)
+
+    # Opens the cache of data_dir, converting the csv files first if the cache is missing or
+    # older than them
+    @classmethod
+    def load(cls, data_dir = DATA_DIR, cache_dir = None, rebuild = False):
+        cache_dir = cache_dir or os.path.join(data_dir, CACHE_NAME)
+        sources = source_fingerprints(data_dir)
+        if not rebuild and cache_fingerprints(cache_dir) == sources:
+            return cls.open(cache_dir)
+        cls.from_csv(data_dir).save(cache_dir, sources)
+        return cls.open(cache_dir)
+
+    def node_count(self, label):
+        return len(self.nodes[label])
+
+    def property(self, label, name, indices = None):
+        values = self.nodes[label].properties[name]
+        return values if indices is None else values[indices]
+
+    def neighbors(self, rel_type, node, direction = 'out'):
+        return self.relations[rel_type].adjacency(direction).neighbors(node)
+
+    def degrees(self, rel_type, direction = 'out'):
+        return self.relations[rel_type].adjacency(direction).degrees()
+
+    # Follows a path of (relationship type, direction) steps from a set of start nodes and
+    # returns the distinct nodes reached at the end, e.g.
+    # store.traverse([paper], [('cites', 'in'), ('presented_in', 'out')])
+    def traverse(self, start, steps):
+        frontier = np.unique(np.asarray(start, dtype = np.int64))
+        for rel_type, direction in steps:
+            adjacency = self.relations[rel_type].adjacency(direction)
+            frontier = np.unique(adjacency.indices[adjacency.positions(frontier)])
+        return frontier
+
+    def summary(self):
+        lines = ['{label}: {count} nodes'.format(label = label, count = len(table)) for label, table in self.nodes.items()]
+        lines += ['{rel_type}: {count} relationships'.format(rel_type = rel_type, count = len(relation))
+                  for rel_type, relation in self.relations.items()]
+        return '\n'.join(lines)
+
+# (size, modification time) of every csv file the store is built from
+def source_fingerprints(data_dir):
+    file_names = [file_name for file_name, _ in NODE_FILES.values()]
+    file_names += [file_name for file_name, _, _, _ in RELATION_FILES.values()]
+    fingerprints = {}
+    for file_name in file_names:
+        status = os.stat(os.path.join(data_dir, file_name))
+        fingerprints[file_name] = [status.st_size, status.st_mtime_ns]
+    return {'format': CACHE_FORMAT, 'files': fingerprints}
+
+def cache_fingerprints(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json')) as manifest_file:
+            return json.load(manifest_file).get('sources')
+    except (OSError, ValueError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Convert the csv files to a memory-mapped columnar cache and print a summary.')
+    parser.add_argument('--data-dir', default = DATA_DIR)
+    parser.add_argument('--cache-dir', default = None, help = 'defaults to {name} in the data directory'.format(name = CACHE_NAME))
+    parser.add_argument('--rebuild', action = 'store_true', help = 'convert the csv files even if the cache is up to date')
+    args = parser.parse_args()
+
+    store = GraphStore.load(args.data_dir, args.cache_dir, args.rebuild)
+    print(store.summary())
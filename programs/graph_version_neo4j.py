@@ -0,0 +1,61 @@
+# Graph write epochs.
+# (:GraphVersion {element: '*', epoch}) is a global counter bumped by every write step, and
+# (:GraphVersion {element, epoch}) records the epoch of the last write to a label, a relationship
+# type or a property written by an algorithm (e.g. 'pagerank'). Readers (projection catalog, result
+# caches) compare these stamps to know if what they keep is still valid. The global node also gets
+# a random generation when it is created, so that a database wiped along with its epochs, where
+# the counter starts again from 1, is not mistaken for the one stamped before.
+
+ALL_ELEMENTS = '*'
+
+# Returns a static Cypher statement, so it can also be used as a step of the async runner
+def write_epoch_query(elements):
+    return """MERGE (g:GraphVersion {{element: '{all}'}})
+            ON CREATE SET g.generation = randomUUID()
+            SET g.epoch = coalesce(g.epoch, 0) + 1
+            WITH g
+            UNWIND {elements} AS element
+            MERGE (v:GraphVersion {{element: element}})
+            SET v.epoch = g.epoch;""".format(all = ALL_ELEMENTS, elements = repr(list(elements)))
+
+def bump_write_epoch(session, elements):
+    session.run(write_epoch_query(elements))
+
+# Runs a write statement and only bumps the epochs of elements when it changed the graph, so that
+# what is stamped with them stays valid across idempotent writes (MERGE of what already exists)
+def run_and_bump(session, query, elements, parameters = None):
+    result = session.run(query, parameters or {})
+    records = list(result)
+    summary = result.consume()
+    if summary.counters.contains_updates:
+        bump_write_epoch(session, elements)
+    return records, summary
+
+# Post-step hook of the async runner (AsyncStep.after): bumps the epochs of elements after the
+# step, only when one of its statements changed the graph unless on_updates is False
+def bump_hook(elements, on_updates = True):
+    async def hook(tx, summaries):
+        if not on_updates or any(summary.counters.contains_updates for summary in summaries):
+            await (await tx.run(write_epoch_query(elements))).consume()
+    return hook
+
+def query_write_epoch(session, elements = ()):
+    result = session.run(
+        """OPTIONAL MATCH (v:GraphVersion)
+            WHERE v.element = $all OR v.element IN $elements
+            RETURN v.element AS element, v.epoch AS epoch;""",
+        all = ALL_ELEMENTS, elements = list(elements)
+    )
+    return {record['element']: record['epoch'] for record in result if record['element'] is not None}
+
+QUERY_GRAPH_STAMP = """OPTIONAL MATCH (g:GraphVersion {element: $all})
+            RETURN g.generation AS generation, coalesce(g.epoch, 0) AS epoch;"""
+
+# Returns (generation, epoch) of the global counter, (None, 0) before the first write
+def query_graph_stamp(session):
+    record = session.run(QUERY_GRAPH_STAMP, all = ALL_ELEMENTS).single()
+    return record['generation'], record['epoch']
+
+async def query_graph_stamp_async(tx):
+    record = await (await tx.run(QUERY_GRAPH_STAMP, all = ALL_ELEMENTS)).single()
+    return record['generation'], record['epoch']
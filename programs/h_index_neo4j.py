@@ -0,0 +1,228 @@
+import argparse
+import os
+import numpy as np
+from graph_store import DATA_DIR, GraphStore
+from session_helper_neo4j import session_scope
+from graph_version_neo4j import bump_write_epoch
+
+BATCH_SIZE = 10000
+TOP_K = 5
+STATE_NAME = '.h_index.npz'
+
+# H-Index = the largest h such that h of the author's papers have at least h citations each.
+# counts[i] is the number of citations of the paper of the i-th writes edge, authors[i] its author.
+# Each author's counts are sorted in descending order; the rank of a paper inside its author
+# group is valid while count >= rank, so the largest valid rank is the h-index.
+def compute_h_index(counts, authors, author_count):
+    order = np.lexsort((-counts, authors))
+    sorted_authors = authors[order]
+    sorted_counts = counts[order]
+
+    group_start = np.searchsorted(sorted_authors, sorted_authors, side = 'left')
+    rank = np.arange(len(sorted_authors)) - group_start + 1
+    valid = sorted_counts >= rank
+
+    h_index = np.zeros(author_count, dtype = np.int64)
+    np.maximum.at(h_index, sorted_authors[valid], rank[valid])
+    return h_index
+
+def top_k(values, k = TOP_K):
+    k = min(k, len(values))
+    candidates = np.argpartition(-values, k - 1)[:k] if k > 0 else np.empty(0, dtype = np.int64)
+    # Ties are broken on the node position so that the answer is deterministic
+    return candidates[np.lexsort((candidates, -values[candidates]))]
+
+# Keeps the citation count of every paper and the h-index of every author, by their position in
+# author_ids and paper_ids. Added and removed cites and writes edges only trigger a recomputation
+# of the authors of the papers they touch; ids not seen yet are added with no papers or citations.
+# The engine is saved next to the csv files when hIndex is computed, and the delta loader feeds it
+# the edges of every load (update_h_index), so hIndex follows the graph without a full pass.
+class HIndexEngine:
+    def __init__(self, author_ids, paper_ids, writes_authors, writes_papers, citations):
+        self.author_ids = list(author_ids)
+        self.paper_ids = list(paper_ids)
+        self.author_positions = {author_id: position for position, author_id in enumerate(self.author_ids)}
+        self.paper_positions = {paper_id: position for position, paper_id in enumerate(self.paper_ids)}
+        self.citations = np.array(citations, dtype = np.int64)
+        self.papers_of = [[] for _ in range(len(self.author_ids))]
+        self.authors_of = [[] for _ in range(len(self.paper_ids))]
+        writes_authors = np.asarray(writes_authors, dtype = np.int64)
+        writes_papers = np.asarray(writes_papers, dtype = np.int64)
+        for author, paper in zip(writes_authors.tolist(), writes_papers.tolist()):
+            self.papers_of[author].append(paper)
+            self.authors_of[paper].append(author)
+
+        self.h_index = compute_h_index(self.citations[writes_papers], writes_authors, len(self.author_ids))
+
+    @classmethod
+    def from_store(cls, store):
+        writes = store.relations['writes']
+        return cls(
+            list(store.nodes['Author'].ids), list(store.nodes['Paper'].ids), writes.sources, writes.targets,
+            np.bincount(store.relations['cites'].targets, minlength = store.node_count('Paper')),
+        )
+
+    @classmethod
+    def open(cls, path):
+        with np.load(path) as state:
+            return cls(state['author_ids'].tolist(), state['paper_ids'].tolist(), state['writes_authors'],
+                       state['writes_papers'], state['citations'])
+
+    def save(self, path):
+        writes = [(author, paper) for author, papers in enumerate(self.papers_of) for paper in papers]
+        writes = np.array(writes, dtype = np.int64).reshape(-1, 2)
+        with open(path + '.tmp', 'wb') as state_file:
+            np.savez(state_file, author_ids = np.array(self.author_ids, dtype = str),
+                     paper_ids = np.array(self.paper_ids, dtype = str), writes_authors = writes[:, 0],
+                     writes_papers = writes[:, 1], citations = self.citations)
+        os.replace(path + '.tmp', path)
+
+    def author_indices(self, author_ids):
+        new = [author_id for author_id in dict.fromkeys(author_ids) if author_id not in self.author_positions]
+        for author_id in new:
+            self.author_positions[author_id] = len(self.author_ids)
+            self.author_ids.append(author_id)
+            self.papers_of.append([])
+        if new:
+            self.h_index = np.concatenate([self.h_index, np.zeros(len(new), dtype = np.int64)])
+        return np.array([self.author_positions[author_id] for author_id in author_ids], dtype = np.int64)
+
+    def paper_indices(self, paper_ids):
+        new = [paper_id for paper_id in dict.fromkeys(paper_ids) if paper_id not in self.paper_positions]
+        for paper_id in new:
+            self.paper_positions[paper_id] = len(self.paper_ids)
+            self.paper_ids.append(paper_id)
+            self.authors_of.append([])
+        if new:
+            self.citations = np.concatenate([self.citations, np.zeros(len(new), dtype = np.int64)])
+        return np.array([self.paper_positions[paper_id] for paper_id in paper_ids], dtype = np.int64)
+
+    def recompute(self, authors):
+        for author in authors:
+            counts = np.sort(self.citations[self.papers_of[author]])[::-1]
+            self.h_index[author] = np.count_nonzero(counts >= np.arange(1, len(counts) + 1))
+        return authors
+
+    # cited_papers are paper positions, once per cites edge
+    def add_citations(self, cited_papers, count = 1):
+        cited_papers = np.asarray(cited_papers, dtype = np.int64)
+        np.add.at(self.citations, cited_papers, count)
+        np.maximum(self.citations, 0, out = self.citations)
+        affected = {author for paper in set(cited_papers.tolist()) for author in self.authors_of[paper]}
+        return self.recompute(sorted(affected))
+
+    def remove_citations(self, cited_papers):
+        return self.add_citations(cited_papers, -1)
+
+    def add_writes(self, authors, papers):
+        authors = np.asarray(authors, dtype = np.int64).tolist()
+        for author, paper in zip(authors, np.asarray(papers, dtype = np.int64).tolist()):
+            self.papers_of[author].append(paper)
+            self.authors_of[paper].append(author)
+        return self.recompute(sorted(set(authors)))
+
+    def remove_writes(self, authors, papers):
+        authors = np.asarray(authors, dtype = np.int64).tolist()
+        for author, paper in zip(authors, np.asarray(papers, dtype = np.int64).tolist()):
+            if paper in self.papers_of[author]:
+                self.papers_of[author].remove(paper)
+                self.authors_of[paper].remove(author)
+        return self.recompute(sorted(set(authors)))
+
+    # Applies the rows (with START_ID and END_ID) of the cites or writes edges a load added and
+    # removed, and returns the positions of the authors whose h-index was recomputed
+    def apply_delta(self, element, inserted, deleted):
+        affected = set()
+        for rows, add in ((deleted, False), (inserted, True)):
+            if not rows:
+                continue
+            papers = self.paper_indices([row['END_ID'] for row in rows])
+            if element == 'cites':
+                affected.update(self.add_citations(papers) if add else self.remove_citations(papers))
+            else:
+                authors = self.author_indices([row['START_ID'] for row in rows])
+                affected.update(self.add_writes(authors, papers) if add else self.remove_writes(authors, papers))
+        return sorted(affected)
+
+    def top_k(self, k = TOP_K):
+        return top_k(self.h_index, k)
+
+def write_h_index_batch(tx, rows):
+    tx.run(
+        """UNWIND $rows AS row
+            MATCH (a:Author {ID: row.ID})
+            SET a.hIndex = row.hIndex""",
+        rows = rows
+    )
+
+# Writes hIndex back for the given author positions (all authors by default)
+def write_h_index(session, engine, authors = None, batch_size = BATCH_SIZE):
+    ids = engine.author_ids
+    authors = np.arange(len(ids)) if authors is None else np.asarray(authors, dtype = np.int64)
+    if len(authors) == 0:
+        return
+    for start in range(0, len(authors), batch_size):
+        batch = authors[start:start + batch_size]
+        rows = [{'ID': ids[author], 'hIndex': int(engine.h_index[author])} for author in batch]
+        session.execute_write(write_h_index_batch, rows)
+    session.execute_write(bump_write_epoch, ['hIndex'])
+
+def state_path(data_dir = DATA_DIR):
+    return os.path.join(data_dir, STATE_NAME)
+
+# A full load drops every hIndex, so the saved engine no longer describes the graph
+def discard_state(data_dir = DATA_DIR):
+    if os.path.exists(state_path(data_dir)):
+        os.remove(state_path(data_dir))
+
+# Keeps hIndex up to date through a delta load. changes maps 'cites' and 'writes' to the rows of
+# the edges the load (inserted, deleted); the saved engine takes them and only the affected authors
+# are written back. With rebuild (a file loaded from scratch) the engine is built again from the
+# store and every author is written. Nothing is done while hIndex was never computed. Returns the
+# number of authors written.
+def update_h_index(session, changes, data_dir = DATA_DIR, rebuild = False, batch_size = BATCH_SIZE):
+    path = state_path(data_dir)
+    if not os.path.exists(path):
+        return 0
+    if rebuild:
+        engine = HIndexEngine.from_store(GraphStore.load(data_dir))
+        authors = np.arange(len(engine.author_ids))
+    else:
+        engine = HIndexEngine.open(path)
+        authors = sorted({author for element, (inserted, deleted) in changes.items()
+                          for author in engine.apply_delta(element, inserted, deleted)})
+    write_h_index(session, engine, authors, batch_size)
+    engine.save(path)
+    return len(authors)
+
+def query_top_h_index(session, k = TOP_K):
+    result = session.run(
+        """MATCH (a:Author)
+            WHERE a.hIndex IS NOT NULL
+            RETURN a.name AS authorName,
+                   a.hIndex AS hIndex
+            ORDER BY hIndex DESC, a.ID
+            LIMIT $k;""",
+        k = k
+    )
+    records = list(result)
+    summary = result.consume()
+    return records, summary
+
+if __name__ == '__main__':
+    from queries_neo4j import print_query_results
+
+    parser = argparse.ArgumentParser(description = 'Compute the h-index of every author and store it as hIndex.')
+    parser.add_argument('--k', type = int, default = TOP_K)
+    parser.add_argument('--batch-size', type = int, default = BATCH_SIZE)
+    parser.add_argument('--data-dir', default = DATA_DIR)
+    args = parser.parse_args()
+
+    engine = HIndexEngine.from_store(GraphStore.load(args.data_dir))
+
+    with session_scope() as session:
+        print('Writing the h-index of every author into the database...')
+        write_h_index(session, engine, batch_size = args.batch_size)
+        engine.save(state_path(args.data_dir))
+        records, summary = session.execute_read(query_top_h_index, args.k)
+        print_query_results(records, summary)
@@ -0,0 +1,102 @@
+from session_helper_neo4j import session_scope
+
+# Materialized impact factor table: one (:JournalYear {year, publications, citations}) node per
+# journal and publication year, linked from the journal with [:has_year]. `publications` is the
+# number of papers published in that journal and year, `citations` the number of citations those
+# papers received. The impact factor is then a lookup:
+# Impact factor(year) = Citations(year) / Publications(year - 1) + Publications(year - 2)
+
+def drop_journal_year_table(session):
+    session.run("MATCH (jy:JournalYear) DETACH DELETE jy")
+
+# Built in one pass over published_in, using the in-degree of each paper for its citations
+def build_journal_year_table(session):
+    drop_journal_year_table(session)
+    session.run(
+        """MATCH (p:Paper) - [r:published_in] -> (j:Journal)
+            WITH j, r.year AS year, p, SIZE([(p) <- [:cites] - (:Paper) | 1]) AS numberOfCitations
+            WITH j, year, COUNT(p) AS publications, SUM(numberOfCitations) AS citations
+            CREATE (j) - [:has_year] -> (:JournalYear {
+                year: year,
+                publications: publications,
+                citations: citations
+            });"""
+    )
+
+# Deltas, to be applied after the new relations have been created in the graph.
+# rows are the csv rows of paper_published_in_journal.csv (START_ID, END_ID, year).
+def apply_published_in_delta(session, rows):
+    session.run(
+        """UNWIND $rows AS row
+            MATCH (p:Paper {ID: row.START_ID})
+            WITH p, row
+            MATCH (j:Journal {ID: row.END_ID})
+            MERGE (j) - [:has_year] -> (jy:JournalYear {year: toInteger(row.year)})
+            ON CREATE SET jy.publications = 0, jy.citations = 0
+            SET jy.publications = jy.publications + 1,
+                jy.citations = jy.citations + SIZE([(p) <- [:cites] - (:Paper) | 1]);""",
+        rows = rows
+    )
+
+# rows are the csv rows of paper_cites_paper.csv (START_ID, END_ID)
+def apply_cites_delta(session, rows):
+    session.run(
+        """UNWIND $rows AS row
+            MATCH (:Paper {ID: row.END_ID}) - [r:published_in] -> (j:Journal)
+            WITH r, j
+            MATCH (j) - [:has_year] -> (jy:JournalYear)
+            WHERE jy.year = r.year
+            SET jy.citations = jy.citations + 1;""",
+        rows = rows
+    )
+
+# Removals, to be applied while the relations of the rows are still in the graph: the year is
+# taken from the stored published_in relation, not from the row.
+def retract_published_in_delta(session, rows):
+    session.run(
+        """UNWIND $rows AS row
+            MATCH (p:Paper {ID: row.START_ID}) - [r:published_in] -> (j:Journal {ID: row.END_ID})
+            MATCH (j) - [:has_year] -> (jy:JournalYear)
+            WHERE jy.year = r.year
+            SET jy.publications = jy.publications - 1,
+                jy.citations = jy.citations - SIZE([(p) <- [:cites] - (:Paper) | 1]);""",
+        rows = rows
+    )
+
+def retract_cites_delta(session, rows):
+    session.run(
+        """UNWIND $rows AS row
+            MATCH (:Paper {ID: row.START_ID}) - [:cites] -> (:Paper {ID: row.END_ID}) - [r:published_in] -> (j:Journal)
+            WITH r, j
+            MATCH (j) - [:has_year] -> (jy:JournalYear)
+            WHERE jy.year = r.year
+            SET jy.citations = jy.citations - 1;""",
+        rows = rows
+    )
+
+QUERY_IMPACT_FACTOR_TABLE = """MATCH (j:Journal) - [:has_year] -> (jy:JournalYear)
+            WHERE jy.citations > 0
+            MATCH (j) - [:has_year] -> (previous:JournalYear)
+            WHERE previous.year = jy.year - 1 OR previous.year = jy.year - 2
+            WITH j, jy, SUM(previous.publications) AS totalPublications
+            WHERE totalPublications > 0
+            RETURN j.name AS journalName,
+                    jy.year AS yearOfPublication,
+                    toFloat(jy.citations)/totalPublications AS impactFactor
+            ORDER BY impactFactor DESC
+            LIMIT 5;"""
+
+def query_impact_factor_table(session):
+    result = session.run(QUERY_IMPACT_FACTOR_TABLE)
+    records = list(result)
+    summary = result.consume()
+    return records, summary
+
+if __name__ == '__main__':
+    from queries_neo4j import print_query_results
+
+    with session_scope() as session:
+        print('Building the journal-year impact factor table...')
+        session.execute_write(build_journal_year_table)
+        records, summary = session.execute_read(query_impact_factor_table)
+        print_query_results(records, summary)
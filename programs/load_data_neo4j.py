@@ -1,5 +1,31 @@
-from session_helper_neo4j import create_session, clean_session
-from drop_create_indexes_neo4j import drop_indexes, create_indexes
+import argparse
+import csv
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from session_helper_neo4j import get_driver, session_config, session_scope, clean_session, run_with_retry
+from drop_create_indexes_neo4j import apply_schema
+from impact_factor_neo4j import build_journal_year_table
+from graph_version_neo4j import bump_write_epoch
+from h_index_neo4j import discard_state as discard_h_index_state
+from venue_editions import discard_state as discard_venue_editions_state
+from graph_store import normalize_id
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+BATCH_SIZE = 10000
+WORKERS = 4
+
+LOADED_ELEMENTS = ['Keyword', 'Author', 'Conference', 'Journal', 'Proceeding', 'Paper', 'JournalYear',
+                   'is_part', 'writes', 'has', 'presented_in', 'published_in', 'cites', 'reviews', 'has_year']
+
+ID_COLUMNS = ('ID', 'START_ID', 'END_ID')
+
+# Author ids are written as floats in some files (e.g. '121567631.0'). LOAD CSV normalizes them
+# with this expression and the batched loader with graph_store.normalize_id, like the delta
+# loader, so that every loader builds the same graph.
+def normalized_id(column):
+    return "CASE WHEN {column} =~ '[0-9]+[.]0' THEN left({column}, size({column}) - 2) ELSE {column} END".format(column = column)
 
 def load_node_keyword_semantic(session):
     session.run(
@@ -15,7 +41,7 @@ def load_node_author_semantic(session):
     session.run(
         """LOAD CSV WITH HEADERS FROM 'file:///authors_semantic.csv' AS line
             CREATE (:Author {
-                ID: line.ID,
+                ID: """ + normalized_id('line.ID') + """,
                 name: line.name,
                 email: line.email
         })"""
@@ -60,27 +86,31 @@ def load_node_paper_semantic(session):
                 abstract: line.abstract,
                 pages: line.pages,
                 doi: line.doi,
-                link: line.link
+                link: line.link,
+                citationCount: 0
         })"""
     )
 
+# A pair of nodes has at most one relation of each type, as with the delta loader: the csv files
+# repeat some rows (e.g. of cites and writes), so the relations are merged and the first row of a
+# pair sets the properties.
 def load_relation_conference_ispart_proceeding(session):
     session.run(
         """LOAD CSV WITH HEADERS FROM 'file:///conference_part_of_proceedings.csv' AS line
             MATCH (conf:Conference {ID: line.START_ID})
             WITH conf, line
             MATCH (proc:Proceeding {ID: line.END_ID})
-            CREATE (conf)-[:is_part]->(proc)"""
+            MERGE (conf)-[:is_part]->(proc)"""
     )
 
 def load_relation_author_writes_paper(session):
     session.run(
         """LOAD CSV WITH HEADERS FROM 'file:///author_writes_papers.csv' AS line
-            MATCH (author:Author {ID: line.START_ID})
+            MATCH (author:Author {ID: """ + normalized_id('line.START_ID') + """})
             WITH author, line
             MATCH (paper:Paper {ID: line.END_ID})
-            CREATE (author)-[w:writes]->(paper)
-            SET w.corresponding_author = toBoolean(line.corresponding_author)"""
+            MERGE (author)-[w:writes]->(paper)
+            ON CREATE SET w.corresponding_author = toBoolean(line.corresponding_author)"""
     )
 
 def load_relation_paper_has_keyword(session):
@@ -89,7 +119,7 @@ def load_relation_paper_has_keyword(session):
             MATCH (paper:Paper {ID: line.START_ID})
             WITH paper, line
             MATCH (keyword:Keyword {ID: line.END_ID})
-            CREATE (paper) - [:has] -> (keyword)"""
+            MERGE (paper) - [:has] -> (keyword)"""
     )
 
 def load_relation_paper_presentedin_conference(session):
@@ -98,7 +128,7 @@ def load_relation_paper_presentedin_conference(session):
             MATCH (paper:Paper {ID: line.START_ID})
             WITH paper, line
             MATCH (conf:Conference {ID: line.END_ID})
-            CREATE (paper) - [:presented_in] -> (conf)"""
+            MERGE (paper) - [:presented_in] -> (conf)"""
     )
 
 def load_relation_paper_publishedin_journal(session):
@@ -107,8 +137,8 @@ def load_relation_paper_publishedin_journal(session):
             MATCH (paper:Paper {ID: line.START_ID})
             WITH paper, line
             MATCH (jour:Journal {ID: line.END_ID})
-            CREATE (paper) - [r:published_in] -> (jour)
-            SET r.volume = toInteger(line.volume), r.year = toInteger(line.year)"""
+            MERGE (paper) - [r:published_in] -> (jour)
+            ON CREATE SET r.volume = toInteger(line.volume), r.year = toInteger(line.year)"""
     )
 
 def load_relation_paper_cites_paper(session):
@@ -117,41 +147,233 @@ def load_relation_paper_cites_paper(session):
             MATCH (paper:Paper {ID: line.START_ID})
             WITH paper, line
             MATCH (citedPaper:Paper {ID: line.END_ID})
-            CREATE (paper) - [:cites] -> (citedPaper)"""
+            MERGE (paper) - [:cites] -> (citedPaper)
+            ON CREATE SET citedPaper.citationCount = citedPaper.citationCount + 1"""
     )
 
 def load_relation_author_reviews_paper(session):
     session.run(
         """LOAD CSV WITH HEADERS FROM 'file:///author_review_papers.csv' AS line
-            MATCH (author:Author {ID: line.START_ID})
+            MATCH (author:Author {ID: """ + normalized_id('line.START_ID') + """})
             WITH author, line
             MATCH (paper:Paper {ID: line.END_ID})
-            CREATE (author) - [:reviews] -> (paper)"""
+            MERGE (author) - [:reviews] -> (paper)
+            SET paper:PendingDecision"""
     )
 
-session = create_session()
-session = clean_session(session)
-
-print('Dropping the indexes created for the nodes and relations in the database...')
-session.execute_write(create_indexes)
-
-print('Creating and loading the nodes and relations into the database...')
-session.execute_write(load_node_keyword_semantic)
-session.execute_write(load_node_author_semantic)
-session.execute_write(load_node_conference_semantic)
-session.execute_write(load_node_journal_semantic)
-session.execute_write(load_node_proceeding_semantic)
-session.execute_write(load_node_paper_semantic)
-session.execute_write(load_relation_conference_ispart_proceeding)
-session.execute_write(load_relation_author_writes_paper)
-session.execute_write(load_relation_paper_has_keyword)
-session.execute_write(load_relation_paper_presentedin_conference)
-session.execute_write(load_relation_paper_publishedin_journal)
-session.execute_write(load_relation_paper_cites_paper)
-session.execute_write(load_relation_author_reviews_paper)
-print('Creation and loading done for the database.')
-
-print('Creating the indexes for the nodes and relations in the database...')
-session.execute_write(create_indexes)
-
-session.close()
\ No newline at end of file
+# Batched loading: the csv files are streamed from the client side and sent in chunks
+# as `UNWIND $rows` transactions instead of a single LOAD CSV transaction per file.
+# Each entry is (csv file, partition column, query), where the rows are partitioned on
+# the node the query writes to so that parallel workers never lock the same node: the start
+# node, except for cites, which updates the citationCount of the cited paper once per batch.
+BATCHED_NODES = [
+    ('keywords_semantic.csv', 'ID',
+        """UNWIND $rows AS line
+            CREATE (:Keyword {
+                ID: line.ID,
+                name: line.name,
+                domain: line.domain
+        })"""),
+    ('authors_semantic.csv', 'ID',
+        """UNWIND $rows AS line
+            CREATE (:Author {
+                ID: line.ID,
+                name: line.name,
+                email: line.email
+        })"""),
+    ('conference_semantic.csv', 'ID',
+        """UNWIND $rows AS line
+            CREATE (:Conference {
+                ID: line.ID,
+                name: line.name,
+                year: toInteger(line.year),
+                edition: toInteger(line.edition)
+        })"""),
+    ('journal_semantic.csv', 'ID',
+        """UNWIND $rows AS line
+            CREATE (:Journal {
+                ID: line.ID,
+                name: line.name
+        })"""),
+    ('proceedings_semantic.csv', 'ID',
+        """UNWIND $rows AS line
+            CREATE (:Proceeding {
+                ID: line.ID,
+                name: line.name,
+                city: line.city
+        })"""),
+    ('papers_semantic.csv', 'ID',
+        """UNWIND $rows AS line
+            CREATE (:Paper {
+                ID: line.ID,
+                title: line.title,
+                abstract: line.abstract,
+                pages: line.pages,
+                doi: line.doi,
+                link: line.link,
+                citationCount: 0
+        })"""),
+]
+
+BATCHED_RELATIONS = [
+    ('conference_part_of_proceedings.csv', 'START_ID',
+        """UNWIND $rows AS line
+            MATCH (conf:Conference {ID: line.START_ID})
+            WITH conf, line
+            MATCH (proc:Proceeding {ID: line.END_ID})
+            CREATE (conf)-[:is_part]->(proc)"""),
+    ('author_writes_papers.csv', 'START_ID',
+        """UNWIND $rows AS line
+            MATCH (author:Author {ID: line.START_ID})
+            WITH author, line
+            MATCH (paper:Paper {ID: line.END_ID})
+            CREATE (author)-[w:writes]->(paper)
+            SET w.corresponding_author = toBoolean(line.corresponding_author)"""),
+    ('paper_has_keywords.csv', 'START_ID',
+        """UNWIND $rows AS line
+            MATCH (paper:Paper {ID: line.START_ID})
+            WITH paper, line
+            MATCH (keyword:Keyword {ID: line.END_ID})
+            CREATE (paper) - [:has] -> (keyword)"""),
+    ('paper_presented_in_conference.csv', 'START_ID',
+        """UNWIND $rows AS line
+            MATCH (paper:Paper {ID: line.START_ID})
+            WITH paper, line
+            MATCH (conf:Conference {ID: line.END_ID})
+            CREATE (paper) - [:presented_in] -> (conf)"""),
+    ('paper_published_in_journal.csv', 'START_ID',
+        """UNWIND $rows AS line
+            MATCH (paper:Paper {ID: line.START_ID})
+            WITH paper, line
+            MATCH (jour:Journal {ID: line.END_ID})
+            CREATE (paper) - [r:published_in] -> (jour)
+            SET r.volume = toInteger(line.volume), r.year = toInteger(line.year)"""),
+    ('paper_cites_paper.csv', 'END_ID',
+        """UNWIND $rows AS line
+            MATCH (paper:Paper {ID: line.START_ID})
+            WITH paper, line
+            MATCH (citedPaper:Paper {ID: line.END_ID})
+            CREATE (paper) - [:cites] -> (citedPaper)
+            WITH citedPaper, COUNT(*) AS citations
+            SET citedPaper.citationCount = citedPaper.citationCount + citations"""),
+    ('author_review_papers.csv', 'START_ID',
+        """UNWIND $rows AS line
+            MATCH (author:Author {ID: line.START_ID})
+            WITH author, line
+            MATCH (paper:Paper {ID: line.END_ID})
+            CREATE (author) - [:reviews] -> (paper)
+            SET paper:PendingDecision"""),
+]
+
+# Streams a csv file in chunks of batch_size rows, keeping only the rows of one partition.
+# Empty fields are sent as null, the same way LOAD CSV reads them, and the ids are normalized.
+# Only the first row of a pair of nodes is kept in relation files, like the MERGE of LOAD CSV;
+# the rows of a pair have the same partition key, so the relations can still be CREATEd.
+def read_csv_batches(file_name, key, batch_size, partition = 0, partitions = 1, data_dir = DATA_DIR):
+    with open(os.path.join(data_dir, file_name), newline = '', encoding = 'utf-8') as csv_file:
+        batch = []
+        pairs = set()
+        for line in csv.DictReader(csv_file):
+            for column in ID_COLUMNS:
+                if line.get(column):
+                    line[column] = normalize_id(line[column])
+            if partitions > 1 and zlib.crc32(line[key].encode('utf-8')) % partitions != partition:
+                continue
+            if 'START_ID' in line:
+                pair = (line['START_ID'], line['END_ID'])
+                if pair in pairs:
+                    continue
+                pairs.add(pair)
+
+            batch.append({column: value if value != '' else None for column, value in line.items()})
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+def write_batch(tx, query, rows):
+    tx.run(query, rows = rows)
+
+# Every batch is committed in its own transaction
+def load_partition(driver, file_name, key, query, batch_size, partition, partitions, data_dir = DATA_DIR):
+    rows = 0
+    with driver.session(**session_config()) as session:
+        for batch in read_csv_batches(file_name, key, batch_size, partition, partitions, data_dir):
+            run_with_retry(session.execute_write, write_batch, query, batch)
+            rows += len(batch)
+    return rows
+
+def load_file_batched(driver, file_name, key, query, batch_size = BATCH_SIZE, workers = WORKERS, data_dir = DATA_DIR):
+    start = time.perf_counter()
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            rows = sum(executor.map(
+                lambda partition: load_partition(driver, file_name, key, query, batch_size, partition, workers, data_dir),
+                range(workers)
+            ))
+    else:
+        rows = load_partition(driver, file_name, key, query, batch_size, 0, 1, data_dir)
+
+    elapsed = time.perf_counter() - start
+    print("Loaded {rows} rows from {file_name} in {elapsed:.2f} s ({rate:.0f} rows/s).".format(
+        rows = rows, file_name = file_name, elapsed = elapsed,
+        rate = rows / elapsed if elapsed > 0 else 0,
+    ))
+    return rows
+
+def load_all_batched(driver, batch_size = BATCH_SIZE, workers = WORKERS, data_dir = DATA_DIR):
+    for file_name, key, query in BATCHED_NODES + BATCHED_RELATIONS:
+        load_file_batched(driver, file_name, key, query, batch_size, workers, data_dir)
+
+# Empties the database and loads the csv files of data_dir (LOAD CSV reads the neo4j import
+# directory instead, so data_dir only applies to the batched loader). The manifest of the delta
+# loader is written for the files of data_dir, so the next delta load only applies their changes.
+def load_dataset(session, batched = False, batch_size = BATCH_SIZE, workers = WORKERS, data_dir = DATA_DIR):
+    clean_session(session)
+    discard_h_index_state(data_dir)
+    discard_venue_editions_state(data_dir)
+
+    # The constraints are created before the load, so that matching the ends of every relation is an index seek
+    print('Creating the constraints and indexes for the nodes and relations in the database...')
+    apply_schema(session)
+
+    print('Creating and loading the nodes and relations into the database...')
+    if batched:
+        load_all_batched(get_driver(), batch_size, workers, data_dir)
+    else:
+        session.execute_write(load_node_keyword_semantic)
+        session.execute_write(load_node_author_semantic)
+        session.execute_write(load_node_conference_semantic)
+        session.execute_write(load_node_journal_semantic)
+        session.execute_write(load_node_proceeding_semantic)
+        session.execute_write(load_node_paper_semantic)
+        session.execute_write(load_relation_conference_ispart_proceeding)
+        session.execute_write(load_relation_author_writes_paper)
+        session.execute_write(load_relation_paper_has_keyword)
+        session.execute_write(load_relation_paper_presentedin_conference)
+        session.execute_write(load_relation_paper_publishedin_journal)
+        session.execute_write(load_relation_paper_cites_paper)
+        session.execute_write(load_relation_author_reviews_paper)
+    print('Creation and loading done for the database.')
+
+    print('Building the journal-year impact factor table...')
+    session.execute_write(build_journal_year_table)
+    session.execute_write(bump_write_epoch, LOADED_ELEMENTS)
+
+    # delta_load_neo4j imports this module
+    from delta_load_neo4j import write_load_manifest
+    write_load_manifest(data_dir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Load the csv files from data/ into neo4j.')
+    parser.add_argument('--batched', action = 'store_true',
+                        help = 'stream the csv files from the client in UNWIND batches instead of LOAD CSV')
+    parser.add_argument('--batch-size', type = int, default = BATCH_SIZE)
+    parser.add_argument('--workers', type = int, default = WORKERS)
+    args = parser.parse_args()
+
+    with session_scope() as session:
+        load_dataset(session, args.batched, args.batch_size, args.workers)
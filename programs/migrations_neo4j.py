@@ -0,0 +1,133 @@
+import zlib
+from collections import namedtuple
+from session_helper_neo4j import run_with_retry
+from load_data_neo4j import DATA_DIR, read_csv_batches
+from graph_version_neo4j import bump_write_epoch
+
+BATCH_SIZE = 10000
+
+# Versioned schema evolution.
+# A migration has a version number, the constraints it needs (created before any of its steps, so
+# that its MERGEs are index lookups) and a list of steps. A step either streams a csv file from
+# data_dir in UNWIND $rows batches, or runs a single statement when it has no file. Every step
+# must be idempotent (MATCH / MERGE / SET), since a step interrupted by a failure is resumed.
+#
+# The progress is kept in (:Migration {version, name, checksum, status, step, rows}): the batch
+# and the progress update are committed in the same transaction, so a failed run is resumed at
+# the first row that was not committed. Applied migrations are never run again; the elements
+# they write get a new write epoch when they are applied.
+Migration = namedtuple('Migration', ['version', 'name', 'constraints', 'steps', 'elements'])
+MigrationStep = namedtuple('MigrationStep', ['query', 'file_name'], defaults = (None,))
+
+QUERY_MIGRATION_CONSTRAINT = """CREATE CONSTRAINT migration_version IF NOT EXISTS
+            FOR (m:Migration)
+            REQUIRE m.version IS UNIQUE;"""
+
+def migration_checksum(migration):
+    text = '\n'.join(list(migration.constraints) + [step.query + (step.file_name or '') for step in migration.steps])
+    return zlib.crc32(text.encode('utf-8'))
+
+def start_migration(tx, migration):
+    result = tx.run(
+        """MERGE (m:Migration {version: $version})
+            ON CREATE SET m.name = $name, m.checksum = $checksum, m.status = 'running',
+                          m.step = 0, m.rows = 0, m.startedAt = timestamp()
+            RETURN m.status AS status, m.checksum AS checksum, m.step AS step, m.rows AS rows;""",
+        version = migration.version, name = migration.name, checksum = migration_checksum(migration)
+    )
+    return result.single().data()
+
+def set_progress(tx, version, step, rows):
+    tx.run(
+        """MATCH (m:Migration {version: $version})
+            SET m.step = $step, m.rows = $rows;""",
+        version = version, step = step, rows = rows
+    )
+
+def apply_batch(tx, version, query, rows, step, applied):
+    tx.run(query, rows = rows)
+    set_progress(tx, version, step, applied)
+
+def apply_statement(tx, version, query, step):
+    tx.run(query)
+    set_progress(tx, version, step + 1, 0)
+
+def finish_migration(tx, version):
+    tx.run(
+        """MATCH (m:Migration {version: $version})
+            SET m.status = 'applied', m.appliedAt = timestamp();""",
+        version = version
+    )
+
+# Runs step number `step` of a migration from its `done` first rows on. The progress points at
+# the next step once the step is complete.
+def run_step(session, migration, step, done, batch_size, data_dir):
+    query, file_name = migration.steps[step]
+    if file_name is None:
+        run_with_retry(session.execute_write, apply_statement, migration.version, query, step)
+        return
+
+    applied = 0
+    for batch in read_csv_batches(file_name, None, batch_size, data_dir = data_dir):
+        applied += len(batch)
+        if applied <= done:
+            continue
+        if applied - len(batch) < done:
+            batch = batch[done - applied + len(batch):]
+        run_with_retry(session.execute_write, apply_batch, migration.version, query, batch, step, applied)
+    session.execute_write(set_progress, migration.version, step + 1, 0)
+    print('{name}: {rows} rows from {file_name}.'.format(name = migration.name, rows = applied - done, file_name = file_name))
+
+def apply_migration(session, migration, batch_size = BATCH_SIZE, data_dir = DATA_DIR):
+    state = session.execute_write(start_migration, migration)
+    if state['status'] == 'applied':
+        if state['checksum'] != migration_checksum(migration):
+            print('Migration {version} ({name}) changed after it was applied; it is not run again.'.format(
+                version = migration.version, name = migration.name,
+            ))
+        return False
+
+    if state['step'] or state['rows']:
+        print('Resuming migration {version} ({name}) at step {step}, row {rows}.'.format(
+            version = migration.version, name = migration.name, **state
+        ))
+    else:
+        print('Applying migration {version} ({name})...'.format(version = migration.version, name = migration.name))
+
+    for constraint in migration.constraints:
+        session.run(constraint).consume()
+
+    done = state['rows']
+    for step in range(state['step'], len(migration.steps)):
+        run_step(session, migration, step, done, batch_size, data_dir)
+        done = 0
+
+    session.execute_write(finish_migration, migration.version)
+    session.execute_write(bump_write_epoch, migration.elements)
+    return True
+
+# Applies the pending migrations in version order, up to target when it is given
+def migrate(session, migrations, target = None, batch_size = BATCH_SIZE, data_dir = DATA_DIR):
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError('Duplicate migration versions: {versions}'.format(versions = versions))
+
+    session.run(QUERY_MIGRATION_CONSTRAINT).consume()
+    applied = 0
+    for migration in sorted(migrations, key = lambda migration: migration.version):
+        if target is not None and migration.version > target:
+            break
+        applied += apply_migration(session, migration, batch_size, data_dir)
+    return applied
+
+def query_migrations(session):
+    result = session.run(
+        """MATCH (m:Migration)
+            RETURN m.version AS version, m.name AS name, m.status AS status,
+                   m.step AS step, m.rows AS rows,
+                   datetime({epochMillis: m.appliedAt}) AS appliedAt
+            ORDER BY m.version;"""
+    )
+    records = list(result)
+    summary = result.consume()
+    return records, summary
@@ -0,0 +1,145 @@
+import argparse
+import numpy as np
+from session_helper_neo4j import session_scope
+from graph_version_neo4j import bump_write_epoch
+
+DAMPING_FACTOR = 0.85
+TOLERANCE = 1e-6
+MAX_ITERATIONS = 100
+BATCH_SIZE = 10000
+
+# Page-rank by sparse power iteration over the cites edges (sources[i] cites targets[i]).
+# - the scores are a probability distribution (they sum to 1); the order is the same as with
+#   the GDS scores, which are only scaled differently
+# - the mass of dangling nodes (papers citing nothing) is spread following the teleport vector
+# - personalization gives the teleport vector (e.g. 1 for the papers of a research community),
+#   uniform by default; it must have some positive weight
+# - initial warm-starts the iteration from previous scores; NaN entries (new papers) start
+#   from the teleport vector
+# Iterates until the L1 change between two iterations is below tolerance.
+def pagerank(sources, targets, node_count, damping = DAMPING_FACTOR, tolerance = TOLERANCE,
+             max_iterations = MAX_ITERATIONS, personalization = None, initial = None):
+    if node_count == 0:
+        return np.zeros(0), 0, 0.0
+
+    if personalization is None:
+        teleport = np.full(node_count, 1.0 / node_count)
+    else:
+        teleport = np.asarray(personalization, dtype = np.float64)
+        if not teleport.sum() > 0:
+            raise ValueError('The personalization vector has no positive weight (is the community empty?)')
+        teleport = teleport / teleport.sum()
+
+    scores = teleport.copy()
+    if initial is not None:
+        initial = np.asarray(initial, dtype = np.float64)
+        known = ~np.isnan(initial)
+        scores[known] = initial[known]
+        scores = scores / scores.sum()
+
+    out_degree = np.bincount(sources, minlength = node_count).astype(np.float64)
+    dangling = out_degree == 0
+    inverse_degree = np.divide(1.0, out_degree, out = np.zeros(node_count), where = ~dangling)
+
+    delta = np.inf
+    iteration = 0
+    while iteration < max_iterations and delta >= tolerance:
+        iteration += 1
+        spread = np.bincount(targets, weights = (scores * inverse_degree)[sources], minlength = node_count)
+        updated = damping * (spread + scores[dangling].sum() * teleport) + (1 - damping) * teleport
+        delta = np.abs(updated - scores).sum()
+        scores = updated
+
+    return scores, iteration, delta
+
+# Keeps the edges whose both ends are in keep (a boolean mask) and renumbers the nodes,
+# which is what the GDS cypher projection does with validateRelationships: false
+def subgraph(sources, targets, keep):
+    positions = np.cumsum(keep) - 1
+    inside = keep[sources] & keep[targets]
+    return positions[sources[inside]], positions[targets[inside]]
+
+def pagerank_from_store(store, **kwargs):
+    cites = store.relations['cites']
+    return pagerank(cites.sources, cites.targets, store.node_count('Paper'), **kwargs)
+
+# Reads the citation graph, the current scores and the community papers from the database
+def fetch_citation_graph(session, community = None):
+    result = session.run(
+        """MATCH (p:Paper)
+            OPTIONAL MATCH (p) - [m:in_community] -> (:ResearchCommunity {name: $community})
+            RETURN p.ID AS ID, p.pagerank AS pagerank, m IS NOT NULL AS inCommunity;""",
+        community = community
+    )
+    ids = []
+    initial = []
+    in_community = []
+    for record in result:
+        ids.append(record['ID'])
+        initial.append(np.nan if record['pagerank'] is None else record['pagerank'])
+        in_community.append(record['inCommunity'])
+
+    positions = {paper_id: position for position, paper_id in enumerate(ids)}
+    result = session.run(
+        """MATCH (p1:Paper) - [:cites] -> (p2:Paper)
+            RETURN p1.ID AS source, p2.ID AS target;"""
+    )
+    edges = np.array([(positions[record['source']], positions[record['target']]) for record in result],
+                     dtype = np.int64).reshape(-1, 2)
+
+    return (np.array(ids, dtype = object), edges[:, 0], edges[:, 1],
+            np.array(initial, dtype = np.float64), np.array(in_community, dtype = bool))
+
+def write_pagerank_batch(tx, rows):
+    tx.run(
+        """UNWIND $rows AS row
+            MATCH (p:Paper {ID: row.ID})
+            SET p.pagerank = row.pagerank""",
+        rows = rows
+    )
+
+def write_pagerank(session, ids, scores, batch_size = BATCH_SIZE):
+    for start in range(0, len(ids), batch_size):
+        rows = [{'ID': paper_id, 'pagerank': float(score)}
+                for paper_id, score in zip(ids[start:start + batch_size], scores[start:start + batch_size])]
+        session.execute_write(write_pagerank_batch, rows)
+    session.execute_write(bump_write_epoch, ['pagerank'])
+
+# mode 'subgraph' ranks only the community papers (like the recommender's GDS projection),
+# 'personalized' ranks every paper with teleports to the community papers, and 'global' ranks
+# every paper with uniform teleports.
+def run_native_pagerank(session, community = 'Databases', mode = 'subgraph', warm_start = True,
+                        damping = DAMPING_FACTOR, tolerance = TOLERANCE, max_iterations = MAX_ITERATIONS):
+    ids, sources, targets, initial, in_community = session.execute_read(fetch_citation_graph, community)
+
+    personalization = None
+    if mode == 'subgraph':
+        sources, targets = subgraph(sources, targets, in_community)
+        ids = ids[in_community]
+        initial = initial[in_community]
+    elif mode == 'personalized':
+        personalization = in_community.astype(np.float64)
+
+    scores, iterations, delta = pagerank(
+        sources, targets, len(ids), damping, tolerance, max_iterations, personalization,
+        initial if warm_start else None,
+    )
+    print('Page-rank converged to {delta:.2e} after {iterations} iterations over {nodes} papers.'.format(
+        delta = delta, iterations = iterations, nodes = len(ids),
+    ))
+    write_pagerank(session, ids, scores)
+    return iterations
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Page-rank of the citation graph without GDS.')
+    parser.add_argument('--community', default = 'Databases')
+    parser.add_argument('--mode', choices = ['subgraph', 'personalized', 'global'], default = 'subgraph')
+    parser.add_argument('--cold', action = 'store_true', help = 'start from uniform scores instead of the stored ones')
+    parser.add_argument('--damping', type = float, default = DAMPING_FACTOR)
+    parser.add_argument('--tolerance', type = float, default = TOLERANCE)
+    parser.add_argument('--max-iterations', type = int, default = MAX_ITERATIONS)
+    args = parser.parse_args()
+
+    with session_scope() as session:
+        run_native_pagerank(session, args.community, args.mode, not args.cold,
+                            args.damping, args.tolerance, args.max_iterations)
@@ -0,0 +1,117 @@
+from collections import namedtuple
+
+# Reusable GDS projections.
+# A projection is stamped with the write epochs (graph_version_neo4j) and the counts of the
+# labels and relationship types it reads, and the stamp is kept in a (:GraphProjection) node next
+# to the time of its last use, its size and how long it took to project. While the stamp does not
+# change and the projection is still in the GDS catalog it is reused; otherwise it is projected
+# again. Before projecting, the least recently used projections are dropped while the free heap
+# is below MIN_FREE_HEAP of the total heap.
+ProjectionSpec = namedtuple('ProjectionSpec', ['name', 'project_query', 'labels', 'types'])
+
+MIN_FREE_HEAP = 0.25
+
+def stamp_query(spec):
+    query = """OPTIONAL MATCH (v:GraphVersion)
+            WHERE v.element IN $elements
+            WITH v ORDER BY v.element
+            WITH [version IN COLLECT(v) | version.element + '@' + toString(version.epoch)] AS stamp"""
+    for label in spec.labels:
+        query += """
+            CALL {{ MATCH (n:`{label}`) RETURN COUNT(n) AS elementCount }}
+            WITH stamp + ['{label}=' + toString(elementCount)] AS stamp""".format(label = label)
+    for rel_type in spec.types:
+        query += """
+            CALL {{ MATCH () - [r:`{rel_type}`] -> () RETURN COUNT(r) AS elementCount }}
+            WITH stamp + ['{rel_type}=' + toString(elementCount)] AS stamp""".format(rel_type = rel_type)
+    return query + """
+            RETURN stamp;"""
+
+# The steps of ensure_projection, written once for the sync and the async transactions: it yields
+# (query, parameters) and is sent back the records of each query as a list of dicts.
+def projection_plan(spec, min_free_heap = MIN_FREE_HEAP):
+    records = yield stamp_query(spec), {'elements': list(spec.labels) + list(spec.types)}
+    stamp = records[0]['stamp']
+
+    records = yield """CALL gds.graph.exists($name) YIELD exists
+            OPTIONAL MATCH (gp:GraphProjection {name: $name})
+            RETURN exists, gp.stamp AS stamp;""", {'name': spec.name}
+    if records[0]['exists'] and records[0]['stamp'] == stamp:
+        yield """MATCH (gp:GraphProjection {name: $name})
+            SET gp.lastUsed = timestamp(), gp.uses = gp.uses + 1;""", {'name': spec.name}
+        print('Reusing the projection {name}.'.format(name = spec.name))
+        return True
+
+    # Least recently used eviction, using the sizes reported by the catalog
+    monitor = (yield "CALL gds.systemMonitor() YIELD freeHeap, totalHeap RETURN freeHeap, totalHeap;", {})[0]
+    free_heap = monitor['freeHeap']
+    projections = yield """CALL gds.graph.list() YIELD graphName, sizeInBytes
+            OPTIONAL MATCH (gp:GraphProjection {name: graphName})
+            WITH graphName, sizeInBytes, coalesce(gp.lastUsed, 0) AS lastUsed
+            WHERE graphName <> $name
+            RETURN graphName, sizeInBytes
+            ORDER BY lastUsed;""", {'name': spec.name}
+    for projection in projections:
+        if free_heap >= min_free_heap * monitor['totalHeap']:
+            break
+        yield """CALL gds.graph.drop($name, false) YIELD graphName
+            WITH graphName
+            MATCH (gp:GraphProjection {name: graphName})
+            DELETE gp;""", {'name': projection['graphName']}
+        free_heap += projection['sizeInBytes']
+        print('Evicted the projection {name} ({size} bytes).'.format(
+            name = projection['graphName'], size = projection['sizeInBytes'],
+        ))
+
+    yield "CALL gds.graph.drop($name, false);", {'name': spec.name}
+    projected = (yield spec.project_query, {})[0]
+    size = (yield "CALL gds.graph.list($name) YIELD sizeInBytes RETURN sizeInBytes;", {'name': spec.name})[0]['sizeInBytes']
+    yield """MERGE (gp:GraphProjection {name: $name})
+            SET gp.stamp = $stamp,
+                gp.lastUsed = timestamp(),
+                gp.uses = 1,
+                gp.sizeInBytes = $size,
+                gp.projectMillis = $projectMillis;""", {
+        'name': spec.name, 'stamp': stamp, 'size': size, 'projectMillis': projected['projectMillis'],
+    }
+    print('Projected {name}: {nodes} nodes, {relationships} relationships, {size} bytes in {millis} ms.'.format(
+        name = spec.name, nodes = projected['nodeCount'], relationships = projected['relationshipCount'],
+        size = size, millis = projected['projectMillis'],
+    ))
+    return False
+
+# Returns True when an existing projection was reused
+def ensure_projection(session, spec, min_free_heap = MIN_FREE_HEAP):
+    plan = projection_plan(spec, min_free_heap)
+    records = None
+    try:
+        while True:
+            query, parameters = plan.send(records)
+            records = [record.data() for record in session.run(query, parameters)]
+    except StopIteration as done:
+        return done.value
+
+async def ensure_projection_async(tx, spec, min_free_heap = MIN_FREE_HEAP):
+    plan = projection_plan(spec, min_free_heap)
+    records = None
+    try:
+        while True:
+            query, parameters = plan.send(records)
+            result = await tx.run(query, parameters)
+            records = [record.data() async for record in result]
+    except StopIteration as done:
+        return done.value
+
+def query_projection_catalog(session):
+    result = session.run(
+        """MATCH (gp:GraphProjection)
+            RETURN gp.name AS projection,
+                   gp.sizeInBytes AS sizeInBytes,
+                   gp.projectMillis AS projectMillis,
+                   gp.uses AS uses,
+                   datetime({epochMillis: gp.lastUsed}) AS lastUsed
+            ORDER BY gp.lastUsed DESC;"""
+    )
+    records = list(result)
+    summary = result.consume()
+    return records, summary
@@ -1,7 +1,9 @@
+import argparse
 import pprint
-from session_helper_neo4j import create_session
-
-session = create_session()
+from session_helper_neo4j import session_scope
+from async_runner_neo4j import AsyncStep
+from result_cache_neo4j import ResultCache, run_read
+from impact_factor_neo4j import QUERY_IMPACT_FACTOR_TABLE
 
 # Printing query results and summary 
 def print_query_results(records, summary):
@@ -18,11 +20,12 @@ def print_query_results(records, summary):
 
 
 # Query 1: Top 3 most cited papers per conference
-def query_top3_cited_papers_conference(session):
-    result = session.run(
-        """MATCH (p:Paper) - [r1:cites] -> (citedPaper:Paper) - [r2:presented_in] -> (c:Conference) 
-            WITH c, citedPaper, count(r1) AS numberOfCitations
-            ORDER BY c, numberOfCitations DESC
+# Uses the citationCount kept on every paper by the loader instead of counting all the cites
+# relations; top_cited_neo4j answers the same question for any k with a bounded heap per venue.
+QUERY_TOP3_CITED_PAPERS_CONFERENCE = """MATCH (citedPaper:Paper) - [r2:presented_in] -> (c:Conference)
+            WHERE citedPaper.citationCount > 0
+            WITH c, citedPaper
+            ORDER BY c, citedPaper.citationCount DESC, citedPaper.ID
             WITH c, COLLECT(citedPaper)[0..3] AS top3
             WHERE top3[1].title <> 'None' AND top3[2].title <> 'None'
             RETURN c.name as conference, 
@@ -30,15 +33,14 @@ def query_top3_cited_papers_conference(session):
                    top3[1].title AS topCitedPaper2,
                    top3[2].title AS topCitedPaper3
             ;"""
-        )
-    records = list(result)
-    summary = result.consume()
-    return records, summary
+
+def query_top3_cited_papers_conference(session, cache = None):
+    return run_read(session, QUERY_TOP3_CITED_PAPERS_CONFERENCE, cache)
 
 # Query 2: Authors that have published in the same conference in at least 4 editions
-def query_authors_published_same_conference_4editions(session):
-    result = session.run(
-        """MATCH (a:Author) - [:writes] -> (p:Paper) - [:presented_in] -> (c:Conference)
+# venue_editions keeps the editions of every author and conference as bitsets and answers it
+# completely, for any number of editions, along with the pairs of such authors.
+QUERY_AUTHORS_PUBLISHED_SAME_CONFERENCE_4EDITIONS = """MATCH (a:Author) - [:writes] -> (p:Paper) - [:presented_in] -> (c:Conference)
             WITH c.name as conferenceName, a, COUNT(DISTINCT c.edition) AS distinctEditions
             WHERE distinctEditions >= 4
             WITH conferenceName, a
@@ -52,7 +54,9 @@ def query_authors_published_same_conference_4editions(session):
                    a2.name as author2_name,
                    a2.email as author2_email
             LIMIT 5;"""
-    )
+
+def query_authors_published_same_conference_4editions(session, cache = None):
+    records, summary = run_read(session, QUERY_AUTHORS_PUBLISHED_SAME_CONFERENCE_4EDITIONS, cache)
     
     ### Alternative Solution
     # result = session.run(
@@ -66,65 +70,65 @@ def query_authors_published_same_conference_4editions(session):
     #     """
     # )
     
-    records = list(result)
-    summary = result.consume()
     return records, summary
 
 # Query 3 Impact factor
 # Impact factor = Citations(year1) / Publications(year1) + Publications(year2)
-def query_impact_factor(session):
-    result = session.run(
-        """MATCH(p:Paper) - [r1:cites] -> (citedP:Paper) - [r2:published_in] -> (j:Journal) 
-            WITH j, r2.year as currYear, COUNT(r1) AS totalCitations
-            MATCH (p2:Paper) - [r3:published_in] -> (j)
-            WHERE r3.year = currYear - 1 OR r3.year = currYear - 2
-            WITH j, currYear, totalCitations, COUNT(r3) AS totalPublications
-            WHERE totalPublications > 0
-            RETURN j.name AS journalName,
-                    currYear AS yearOfPublication,
-                    toFloat(totalCitations)/totalPublications AS impactFactor
-            ORDER BY impactFactor DESC
-            LIMIT 5;"""
-    )
-    records = list(result)
-    summary = result.consume()
-    return records, summary
+# Answered by lookup from the JournalYear table kept by impact_factor_neo4j, instead of
+# joining every citation with the publications of the two previous years
+QUERY_IMPACT_FACTOR = QUERY_IMPACT_FACTOR_TABLE
+
+def query_impact_factor(session, cache = None):
+    return run_read(session, QUERY_IMPACT_FACTOR, cache)
 
-# Query 4 H-Index ----- getting op of 3k+ rows
+# Query 4 H-Index
 # H-Index = atleast h publications have h citations
+# The citation counts of each author's papers are sorted in descending order, and h is the
+# number of positions i (1-based) whose count is >= i. h_index_neo4j computes the same value
+# for every author at once and stores it as a.hIndex.
 
-def query_h_index(session):
-    result = session.run(
-        """MATCH(a:Author) - [r1:writes] -> (p1:Paper) - [r2:cites] -> (p2:Paper)
-            WITH a, p2, COLLECT(p1) as papers
-            WITH a, p2, RANGE(1, SIZE(papers)) AS listOfPapers
-            UNWIND listOfPapers AS lp
-            WITH a, lp AS currHIndex, count(p2) AS citedPapers
-            WHERE currHIndex <= citedPapers
+QUERY_H_INDEX = """MATCH (a:Author) - [:writes] -> (p:Paper)
+            OPTIONAL MATCH (p) <- [c:cites] - (:Paper)
+            WITH a, p, COUNT(c) AS numberOfCitations
+            ORDER BY numberOfCitations DESC
+            WITH a, COLLECT(numberOfCitations) AS citations
+            WITH a, SIZE([i IN RANGE(1, SIZE(citations)) WHERE citations[i - 1] >= i]) AS hIndex
             RETURN a.name AS authorName,
-                   currHIndex as hIndex
-            ORDER BY currHIndex DESC
+                   hIndex
+            ORDER BY hIndex DESC
             LIMIT 5;"""
-    )
-    records = list(result)
-    summary = result.consume()
-    return records, summary
 
+def query_h_index(session, cache = None):
+    return run_read(session, QUERY_H_INDEX, cache)
+
+# The four queries are independent reads, so the async runner can run them all at once
+QUERY_STEPS = [
+    AsyncStep('query_top3_cited_papers_conference', [QUERY_TOP3_CITED_PAPERS_CONFERENCE]),
+    AsyncStep('query_authors_published_same_conference_4editions', [QUERY_AUTHORS_PUBLISHED_SAME_CONFERENCE_4EDITIONS]),
+    AsyncStep('query_impact_factor', [QUERY_IMPACT_FACTOR]),
+    AsyncStep('query_h_index', [QUERY_H_INDEX]),
+]
 
-records, summary = session.execute_read(query_top3_cited_papers_conference)
-print('Query Result 1.........')
-print_query_results(records, summary)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run the four analytical queries.')
+    parser.add_argument('--cache-dir', default = None,
+                        help = 'answer the queries from a result cache kept in this directory until the next graph write')
+    args = parser.parse_args()
 
-records, summary = session.execute_read(query_authors_published_same_conference_4editions)
-print('Query Result 2.........')
-print_query_results(records, summary)
+    cache = ResultCache(disk_dir = args.cache_dir) if args.cache_dir else None
+    with session_scope() as session:
+        records, summary = session.execute_read(query_top3_cited_papers_conference, cache)
+        print('Query Result 1.........')
+        print_query_results(records, summary)
 
-records, summary = session.execute_read(query_impact_factor)
-print('Query Result 3.........')
-print_query_results(records, summary)
+        records, summary = session.execute_read(query_authors_published_same_conference_4editions, cache)
+        print('Query Result 2.........')
+        print_query_results(records, summary)
 
-records, summary = session.execute_read(query_h_index)
-print('Query Result 4.........')
-print_query_results(records, summary)
+        records, summary = session.execute_read(query_impact_factor, cache)
+        print('Query Result 3.........')
+        print_query_results(records, summary)
 
-session.close()
\ No newline at end of file
+        records, summary = session.execute_read(query_h_index, cache)
+        print('Query Result 4.........')
+        print_query_results(records, summary)
@@ -0,0 +1,193 @@
+import argparse
+import json
+import re
+import sys
+from neo4j.exceptions import Neo4jError
+from session_helper_neo4j import session_scope
+from async_runner_neo4j import GDS_WRITE, pipeline_steps, step_statements
+
+THRESHOLD = 0.2
+SCAN_OPERATORS = ('AllNodesScan', 'NodeByLabelScan')
+
+# Plan capture and index-usage guard.
+# Every Cypher statement of each pipeline step (its writes as well as its reads) is planned with
+# EXPLAIN, or executed in order with PROFILE inside a transaction that is rolled back, so that the
+# Cypher writes of a step do not change the graph. GDS write procedures (gds.pageRank.write) are
+# only planned with EXPLAIN even then: they write in transactions of their own, which the roll
+# back can not undo, and their work is not in the Cypher plan anyway. The projections of a step
+# are not run. The plans of a step are flattened into one list of operators with their details,
+# estimated rows and, when profiled, rows and db hits.
+#
+# Problems, which fail the check:
+# - an AllNodesScan;
+# - a NodeByLabelScan whose rows are then filtered on a property: an index on that label and
+#   property is suggested, unless it exists already;
+# - against a baseline: more scans than before, or more db hits than THRESHOLD allows.
+# A NodeByLabelScan without a property filter (an aggregation that has to read every node of a
+# label) is only a warning, unless --strict is given.
+
+def operator_name(operator_type):
+    return operator_type.split('@')[0]
+
+# The operators of a plan in pre-order, each with the index of its parent
+def flatten_plan(plan, parent = None, operators = None):
+    operators = [] if operators is None else operators
+    arguments = plan.get('args', plan.get('arguments', {}))
+    position = len(operators)
+    operators.append({
+        'operator': operator_name(plan.get('operatorType', '')),
+        'details': arguments.get('Details', ''),
+        'estimated_rows': arguments.get('EstimatedRows'),
+        'rows': plan.get('rows'),
+        'db_hits': plan.get('dbHits'),
+        'parent': parent,
+    })
+    for child in plan.get('children', []):
+        flatten_plan(child, position, operators)
+    return operators
+
+# (variable, label) of a scan, from details such as 'p:Paper'
+def scanned_variable(operator):
+    match = re.match(r'\s*`?(\w+)`?\s*:\s*`?(\w+)`?', operator['details'])
+    return (match.group(1), match.group(2)) if match else (None, None)
+
+# Properties of variable compared in the Filter operators right above a scan
+def filtered_properties(operators, position, variable):
+    properties = set()
+    parent = operators[position]['parent']
+    while parent is not None and operators[parent]['operator'] == 'Filter':
+        properties |= set(re.findall(r'\b{variable}\.`?(\w+)`?'.format(variable = re.escape(variable)),
+                                     operators[parent]['details']))
+        parent = operators[parent]['parent']
+    return properties
+
+def query_existing_indexes(session):
+    result = session.run(
+        """SHOW INDEXES YIELD name, entityType, labelsOrTypes, properties
+            WHERE entityType = 'NODE' AND labelsOrTypes IS NOT NULL
+            RETURN name, labelsOrTypes, properties;"""
+    )
+    return {(record['labelsOrTypes'][0], tuple(record['properties'])): record['name'] for record in result}
+
+def check_plan(operators, existing_indexes, strict = False):
+    problems = []
+    warnings = []
+    suggestions = []
+    for position, operator in enumerate(operators):
+        if operator['operator'] == 'AllNodesScan':
+            problems.append('AllNodesScan {details}'.format(details = operator['details']))
+        elif operator['operator'] == 'NodeByLabelScan':
+            variable, label = scanned_variable(operator)
+            properties = filtered_properties(operators, position, variable) if variable else set()
+            missing = sorted(prop for prop in properties if (label, (prop,)) not in existing_indexes)
+            if missing:
+                problems.append('NodeByLabelScan of {label} filtered on {properties}'.format(
+                    label = label, properties = ', '.join(missing)))
+                suggestions += ['CREATE INDEX IF NOT EXISTS FOR (n:{label}) ON (n.{prop});'.format(label = label, prop = prop)
+                                for prop in missing]
+            elif strict:
+                problems.append('NodeByLabelScan of {label}'.format(label = label))
+            else:
+                warnings.append('NodeByLabelScan of {label}'.format(label = label))
+    return problems, warnings, suggestions
+
+def capture_plan(session, step, profile = False):
+    operators = []
+    if not profile:
+        for query in step_statements(step):
+            summary = session.run('EXPLAIN ' + query, step.parameters or {}).consume()
+            flatten_plan(summary.plan, None, operators)
+        return operators
+
+    tx = session.begin_transaction()
+    try:
+        for query in step_statements(step):
+            if GDS_WRITE.search(query):
+                flatten_plan(tx.run('EXPLAIN ' + query, step.parameters or {}).consume().plan, None, operators)
+            else:
+                flatten_plan(tx.run('PROFILE ' + query, step.parameters or {}).consume().profile, None, operators)
+    finally:
+        tx.rollback()
+    return operators
+
+def capture_plans(session, profile = False, strict = False):
+    existing_indexes = query_existing_indexes(session)
+    plans = {}
+    for pipeline, steps in pipeline_steps().items():
+        for step in steps:
+            try:
+                operators = capture_plan(session, step, profile)
+            except Neo4jError as error:
+                operators = []
+                problems, warnings, suggestions = ['could not be planned: {error}'.format(error = error.message)], [], []
+            else:
+                problems, warnings, suggestions = check_plan(operators, existing_indexes, strict)
+            plans[step.name] = {
+                'pipeline': pipeline,
+                'queries': step_statements(step),
+                'operators': operators,
+                'scans': sum(operator['operator'] in SCAN_OPERATORS for operator in operators),
+                'db_hits': sum(operator['db_hits'] or 0 for operator in operators) if profile else None,
+                'problems': problems,
+                'warnings': warnings,
+                'suggestions': suggestions,
+            }
+
+    # Indexes that none of the plans seeks or scans
+    used = ' '.join(operator['details'] for plan in plans.values() for operator in plan['operators']
+                    if 'Index' in operator['operator'])
+    unused = sorted(name for (label, properties), name in existing_indexes.items()
+                    if not all(re.search(r':{label}\b.*\b{prop}\b'.format(label = label, prop = prop), used)
+                               for prop in properties))
+    return plans, unused
+
+def compare_plans(baseline, plans, threshold = THRESHOLD):
+    regressions = []
+    for name, plan in plans.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if plan['scans'] > before['scans']:
+            regressions.append('{name}: {old} -> {new} scans'.format(name = name, old = before['scans'], new = plan['scans']))
+        if plan['db_hits'] is not None and before['db_hits'] is not None \
+                and plan['db_hits'] > before['db_hits'] * (1 + threshold):
+            regressions.append('{name}: {old} -> {new} db hits'.format(name = name, old = before['db_hits'], new = plan['db_hits']))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Capture the plans of the registered queries and check their index usage.')
+    parser.add_argument('--output', help = 'store the plans as json')
+    parser.add_argument('--baseline', help = 'plans stored by an earlier run to compare with')
+    parser.add_argument('--profile', action = 'store_true', help = 'PROFILE in a rolled back transaction instead of EXPLAIN (GDS write procedures are only explained)')
+    parser.add_argument('--strict', action = 'store_true', help = 'also fail on label scans without a property filter')
+    parser.add_argument('--threshold', type = float, default = THRESHOLD)
+    args = parser.parse_args()
+
+    with session_scope() as session:
+        plans, unused = capture_plans(session, args.profile, args.strict)
+
+    failed = False
+    for name, plan in plans.items():
+        for problem in plan['problems']:
+            print('FAIL {name}: {problem}'.format(name = name, problem = problem))
+            failed = True
+        for warning in plan['warnings']:
+            print('WARN {name}: {warning}'.format(name = name, warning = warning))
+    for suggestion in sorted({suggestion for plan in plans.values() for suggestion in plan['suggestions']}):
+        print('Suggested index: ' + suggestion)
+    for name in unused:
+        print('Index {name} is not used by any registered query.'.format(name = name))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            for regression in compare_plans(json.load(baseline_file), plans, args.threshold):
+                print('REGRESSION ' + regression)
+                failed = True
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(plans, output, indent = 2, default = str)
+
+    if failed:
+        sys.exit(1)
+    print('All the query plans passed.')
@@ -1,7 +1,14 @@
+import argparse
 import pprint
-from session_helper_neo4j import create_session
-
-session = create_session()
+from session_helper_neo4j import session_scope
+from async_runner_neo4j import AsyncStep
+from community_neo4j import (
+    COMMUNITY_RATIO, MEMBERSHIP_ELEMENTS, MEMBERSHIP_QUERIES, QUERY_COMMUNITY_MEMBERSHIP, refresh_community_membership,
+)
+from pagerank_neo4j import run_native_pagerank
+from projection_catalog_neo4j import ProjectionSpec, ensure_projection, ensure_projection_async
+from graph_version_neo4j import bump_hook, bump_write_epoch, run_and_bump
+from result_cache_neo4j import ResultCache, run_read
 
 # Printing query results and summary 
 def print_query_results(records, summary):
@@ -17,18 +24,17 @@ def print_query_results(records, summary):
         print()
 
 # Query 1: Define research community
-def query_define_research_community(session):
-    session.run(
-        "MATCH (n: ResearchCommunity) DETACH DELETE n"
-    )
+# The community and its keywords are merged, not recreated, and the epochs are only bumped when
+# something was created, so that the page-rank projection of the community is reused across runs.
+QUERY_MERGE_RESEARCH_COMMUNITY = """MERGE (rc:ResearchCommunity {name:"Databases"});"""
 
-    session.run(
-        """MERGE (rc:ResearchCommunity {name:"Databases"});"""
-    )
+QUERY_RESEARCH_COMMUNITY = """MATCH (rc:ResearchCommunity {name:"Databases"})
+            RETURN rc.name AS researchCommunity;"""
 
-def query_keywords_belongingTo_community(session):
-    result = session.run(
-        """MATCH(k:Keyword)
+def query_define_research_community(session):
+    run_and_bump(session, QUERY_MERGE_RESEARCH_COMMUNITY, ['ResearchCommunity'])
+
+QUERY_KEYWORDS_BELONGINGTO_COMMUNITY = """MATCH(k:Keyword)
             WHERE k.name IN ['Data Management', 'Indexing', 'Data Modeling', 'Big Data', 'Data Processing', 'Data Storage','Data Querying']
             WITH k
             MATCH(rc:ResearchCommunity {name:"Databases"})
@@ -37,76 +43,68 @@ def query_keywords_belongingTo_community(session):
                     r1 AS belongs_to, 
                     rc AS researchCommunity
             LIMIT 5;"""
-    )
-    records = list(result)
-    summary = result.consume()
-    return records, summary
+
+QUERY_KEYWORDS_COMMUNITY = """MATCH (k:Keyword) - [r1:belongs_to] -> (rc:ResearchCommunity {name:"Databases"})
+            RETURN k AS keyword,
+                    r1 AS belongs_to,
+                    rc AS researchCommunity
+            LIMIT 5;"""
+
+def query_keywords_belongingTo_community(session):
+    return run_and_bump(session, QUERY_KEYWORDS_BELONGINGTO_COMMUNITY, ['belongs_to'])
 
 # Query 2: Identifying papers from conferences or journals belonging to the community
-def query_conference_journals_community(session):
-    result = session.run(
-        """MATCH (rc:ResearchCommunity {name:"Databases"}) <- [:belongs_to] - (k:Keyword) <- [:has*1..] - (cp:Paper) - [r1] -> (x)
-            WHERE x:Journal OR x:Conference AND x.title <> 'None' AND r1 IN ['published_in','presented_in']
-            WITH cp, COUNT(DISTINCT cp) AS numberOfCommunityPapers
-            MATCH (p:Paper) - [r2] -> (x)
-            WHERE x:Journal OR x:Conference AND r2 IN ['published_in','presented_in']
-            WITH p, cp, x, numberOfCommunityPapers, COUNT(DISTINCT p) AS numberOfPapers
-            WHERE (toFloat(numberOfCommunityPapers) / (numberOfPapers)) >= 0.9
+# Membership is materialized by community_neo4j.refresh_community_membership, which runs right
+# after the keywords are linked to the community; the queries below only read it.
+QUERY_CONFERENCE_JOURNALS_COMMUNITY = """MATCH (rc:ResearchCommunity {name:"Databases"}) <- [:in_community] - (p:Paper) - [:published_in|presented_in] -> (x) - [:in_community] -> (rc)
             RETURN p.title AS paperName, 
                 labels(x)[0] AS confJour, 
                 x.name AS nameOfConfJour
             LIMIT 5;"""
-    )
-    records = list(result)
-    summary = result.consume()
-    return records, summary
 
-# Identifying the top 100 ranked papers wrt citations from the community
-def query_run_pageRank_algorithm(session):
-    print('Storing the graph from Part-2 into cypher catalog')
-    session.run("""CALL gds.graph.drop('graph1_papers_belongingTo_databases_community',false);""")
+def query_conference_journals_community(session, cache = None):
+    return run_read(session, QUERY_CONFERENCE_JOURNALS_COMMUNITY, cache)
 
-    session.run(
-        """CALL gds.graph.project.cypher('graph1_papers_belongingTo_databases_community',    
-            'MATCH (rc:ResearchCommunity {name:"Databases"}) <- [:belongs_to] - (k:Keyword) <- [:has*1..] - (cp:Paper) - [r1:published_in|presented_in] -> (x)
-            WHERE x:Journal OR x:Conference
-            WITH cp, COUNT(DISTINCT cp) AS numberOfCommunityPapers
-            MATCH (p:Paper) - [r2:published_in|presented_in] -> (x)
-            WHERE x:Journal OR x:Conference
-            WITH p, cp, x, numberOfCommunityPapers, COUNT(DISTINCT p) AS numberOfPapers
-            WHERE (toFloat(numberOfCommunityPapers) / (numberOfPapers)) >= 0.9
+# Identifying the top 100 ranked papers wrt citations from the community
+QUERY_PROJECT_PAGERANK_GRAPH = """CALL gds.graph.project.cypher('graph1_papers_belongingTo_databases_community',    
+            'MATCH (:ResearchCommunity {name:"Databases"}) <- [:in_community] - (p:Paper)
             RETURN id(p) AS id;',
             'MATCH (p1:Paper) - [:cites] -> (p2:Paper)
             RETURN id(p1) AS source,
                    id(p2) AS target',           
             {validateRelationships:FALSE});"""
-    )
 
-    print('Running the page-rank algorithm for the stored graph')
-    session.run(
-        """CALL gds.pageRank.write('graph1_papers_belongingTo_databases_community', {
+# Reprojected only when the papers, citations or community membership have changed
+PAGERANK_GRAPH = ProjectionSpec('graph1_papers_belongingTo_databases_community', QUERY_PROJECT_PAGERANK_GRAPH,
+                                ['Paper', 'ResearchCommunity'], ['in_community', 'cites'])
+
+QUERY_WRITE_PAGERANK = """CALL gds.pageRank.write('graph1_papers_belongingTo_databases_community', {
            maxIterations: 20,
            dampingFactor: 0.85,
            writeProperty: 'pagerank'
            });"""
-    )
 
-def query_top100_papers_pageRank(session):
-    result = session.run(
-        """MATCH (rc:ResearchCommunity {name:"Databases"}) <- [:belongs_to] - (k:Keyword) <- [:has*1..] - (cp:Paper) - [r1:published_in|presented_in] -> (x)
-            WHERE x:Journal OR x:Conference
-            WITH cp, COUNT(DISTINCT cp) AS numberOfCommunityPapers
-            MATCH (p:Paper) - [r2:published_in|presented_in] -> (x)
+def query_run_pageRank_algorithm(session):
+    print('Storing the graph from Part-2 into cypher catalog')
+    ensure_projection(session, PAGERANK_GRAPH)
+
+    print('Running the page-rank algorithm for the stored graph')
+    session.run(QUERY_WRITE_PAGERANK)
+    # GDS writes the property in its own transactions, so the counters of the call report no update
+    bump_write_epoch(session, ['pagerank'])
+
+QUERY_TOP100_PAPERS_PAGERANK = """MATCH (rc:ResearchCommunity {name:"Databases"}) <- [:in_community] - (x)
             WHERE x:Journal OR x:Conference
-            WITH p, cp, x, numberOfCommunityPapers, COUNT(DISTINCT p) AS numberOfPapers
-            WHERE (toFloat(numberOfCommunityPapers) / (numberOfPapers)) >= 0.9
+            MATCH (p:Paper) - [:published_in|presented_in] -> (x)
             WITH x, p
             ORDER BY p.pagerank DESC
             WITH x, COLLECT(p) AS p
             RETURN labels(x)[0] AS confJour, x.name AS nameOfConfJour, p[0..100] AS top100Papers
             ORDER BY x
             LIMIT 5;"""
-    )
+
+def query_top100_papers_pageRank(session, cache = None):
+    records, summary = run_read(session, QUERY_TOP100_PAPERS_PAGERANK, cache)
     
     ### Alternative solution
     # result = session.run(
@@ -126,20 +124,13 @@ def query_top100_papers_pageRank(session):
     #     """
     # )
     
-    records = list(result)
-    summary = result.consume()
     return records, summary
 
 # Identifying potential reviewers (gurus) who authored atleast 2 of top100 papers from Query 3
-def query_gurus_conferences(session):
-    result = session.run(
-        """MATCH (rc:ResearchCommunity {name:"Databases"}) <- [:belongs_to] - (k:Keyword) <- [:has*1..] - (cp:Paper) - [r1:published_in|presented_in] -> (x)
+# reviewer_assignment_neo4j assigns the reviewers of every paper, without conflicts of interest.
+QUERY_GURUS_CONFERENCES = """MATCH (rc:ResearchCommunity {name:"Databases"}) <- [:in_community] - (x)
             WHERE x:Journal OR x:Conference
-            WITH cp, COUNT(DISTINCT cp) AS numberOfCommunityPapers
-            MATCH (p:Paper) - [r2:published_in|presented_in] -> (x)
-            WHERE x:Journal OR x:Conference
-            WITH p, cp, x, numberOfCommunityPapers, COUNT(DISTINCT p) AS numberOfPapers
-            WHERE (toFloat(numberOfCommunityPapers) / (numberOfPapers)) >= 0.9
+            MATCH (p:Paper) - [:published_in|presented_in] -> (x)
             WITH x, p
             ORDER BY p.pagerank DESC
             WITH x, COLLECT(DISTINCT p) AS p
@@ -154,7 +145,9 @@ def query_gurus_conferences(session):
                 a.email AS potentialReviewerEmail,
                 numberOfWrittenPapers AS guru
             LIMIT 5;"""
-    )
+
+def query_gurus_conferences(session, cache = None):
+    records, summary = run_read(session, QUERY_GURUS_CONFERENCES, cache)
     
     ### Alternative Solution
     # result = session.run(
@@ -183,33 +176,68 @@ def query_gurus_conferences(session):
     #     """
     # )
     
-    records = list(result)
-    summary = result.consume()
     return records, summary
 
-
-print('Part 1..........')    
-print('Creating Research Community node with name = Databases')
-session.execute_write(query_define_research_community)
-print('Creating relations from keywords to the Research Community')
-records, summary = session.execute_write(query_keywords_belongingTo_community)
-print_query_results(records, summary)
-
-
-print('Part 2..........')
-print('Finding papers from conferences or journals that belong to research community of databases')
-records, summary = session.execute_read(query_conference_journals_community)
-print_query_results(records, summary)
-
-print('Part 3..........')
-session.execute_write(query_run_pageRank_algorithm)
-print('Obtaining the results of page-rank')
-records, summary = session.execute_read(query_top100_papers_pageRank)
-print_query_results(records, summary)
-
-print('Part 4..........')
-print('Finding gurus of the top conferences and journals')
-records, summary = session.execute_read(query_gurus_conferences)
-print_query_results(records, summary)
-
-session.close()
\ No newline at end of file
+# The write steps run in order; the community papers read only needs the membership to be
+# refreshed, so it overlaps with the page-rank projection, and both page-rank reads start as
+# soon as the scores are written.
+RECOMMENDER_STEPS = [
+    AsyncStep('query_define_research_community',
+              [QUERY_MERGE_RESEARCH_COMMUNITY, QUERY_RESEARCH_COMMUNITY], write = True,
+              after = [bump_hook(['ResearchCommunity'])]),
+    AsyncStep('query_keywords_belongingTo_community',
+              [QUERY_KEYWORDS_BELONGINGTO_COMMUNITY, QUERY_KEYWORDS_COMMUNITY], write = True,
+              after = [bump_hook(['belongs_to'])]),
+    AsyncStep('refresh_community_membership',
+              MEMBERSHIP_QUERIES + [QUERY_COMMUNITY_MEMBERSHIP], write = True,
+              parameters = {'ratio': COMMUNITY_RATIO}, after = [bump_hook(MEMBERSHIP_ELEMENTS)]),
+    AsyncStep('query_conference_journals_community',
+              [QUERY_CONFERENCE_JOURNALS_COMMUNITY], depends_on = ['refresh_community_membership']),
+    # GDS writes the scores in its own transactions, so the counters of the call report no update
+    AsyncStep('query_run_pageRank_algorithm',
+              [lambda tx: ensure_projection_async(tx, PAGERANK_GRAPH), QUERY_WRITE_PAGERANK], write = True,
+              after = [bump_hook(['pagerank'], on_updates = False)]),
+    AsyncStep('query_top100_papers_pageRank',
+              [QUERY_TOP100_PAPERS_PAGERANK], depends_on = ['query_run_pageRank_algorithm']),
+    AsyncStep('query_gurus_conferences',
+              [QUERY_GURUS_CONFERENCES], depends_on = ['query_run_pageRank_algorithm']),
+]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Research community recommender.')
+    parser.add_argument('--native-pagerank', action = 'store_true',
+                        help = 'rank the community papers with pagerank_neo4j instead of GDS')
+    parser.add_argument('--cache-dir', default = None,
+                        help = 'answer the reads from a result cache kept in this directory until the next graph write')
+    args = parser.parse_args()
+
+    cache = ResultCache(disk_dir = args.cache_dir) if args.cache_dir else None
+    with session_scope() as session:
+        print('Part 1..........')    
+        print('Creating Research Community node with name = Databases')
+        session.execute_write(query_define_research_community)
+        print('Creating relations from keywords to the Research Community')
+        records, summary = session.execute_write(query_keywords_belongingTo_community)
+        print_query_results(records, summary)
+        print('Storing the research community membership of conferences, journals and papers')
+        session.execute_write(refresh_community_membership)
+
+
+        print('Part 2..........')
+        print('Finding papers from conferences or journals that belong to research community of databases')
+        records, summary = session.execute_read(query_conference_journals_community, cache)
+        print_query_results(records, summary)
+
+        print('Part 3..........')
+        if args.native_pagerank:
+            run_native_pagerank(session, 'Databases')
+        else:
+            session.execute_write(query_run_pageRank_algorithm)
+        print('Obtaining the results of page-rank')
+        records, summary = session.execute_read(query_top100_papers_pageRank, cache)
+        print_query_results(records, summary)
+
+        print('Part 4..........')
+        print('Finding gurus of the top conferences and journals')
+        records, summary = session.execute_read(query_gurus_conferences, cache)
+        print_query_results(records, summary)
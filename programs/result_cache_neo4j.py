@@ -0,0 +1,233 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import time
+from collections import OrderedDict, namedtuple
+from neo4j import Record
+from session_helper_neo4j import session_scope
+from graph_version_neo4j import query_graph_stamp, query_graph_stamp_async
+
+MAX_ENTRIES = 256
+CHECK_SECONDS = 0.0
+REPEAT = 3
+
+# The read queries the dashboards run again and again between loads, imported lazily since
+# their modules read through this one
+def dashboard_queries():
+    from queries_neo4j import QUERY_STEPS
+    from recommender_neo4j import RECOMMENDER_STEPS
+    return [(step.name, step.queries[-1]) for step in QUERY_STEPS + RECOMMENDER_STEPS if not step.write]
+
+# Stands in for the summary of a query answered from the cache, with the fields
+# print_query_results uses; result_available_after is the lookup time in ms.
+CachedSummary = namedtuple('CachedSummary', ['query', 'parameters', 'result_available_after', 'epoch'])
+
+def cache_key(query, parameters):
+    text = query + '\0' + json.dumps(parameters or {}, sort_keys = True, default = str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+# Result cache for read queries, keyed on the query text and its parameters.
+# Every entry is stamped with the generation and the global write epoch (graph_version_neo4j) at
+# the time it was read. The loader, the delta loader, the evolve migrations, the reviewer
+# assignment, the decisions, the recommender and the algorithms that write their scores back
+# (pagerank, h-index, citation counts, betweenness, similarity) all bump that epoch, and a wipe
+# that also deletes the epochs starts a new generation, so an entry is only returned while both
+# are the same; when they move on the whole in-memory tier is dropped. By default the stamp is read
+# on every lookup (one single-row read instead of the query), so a result is never served after
+# the next write. A check_seconds above 0 is an opt-in staleness window: the stamp is then read at
+# most once every check_seconds and the reads in between are answered from a dict without a round
+# trip, possibly up to check_seconds after a write. Up to max_entries results are kept in memory
+# in least recently used order. With a disk_dir, results are also pickled there, one file per key, so that
+# they outlive the process; stale files are removed as they are found.
+class ResultCache:
+    def __init__(self, max_entries = MAX_ENTRIES, disk_dir = None, check_seconds = CHECK_SECONDS):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.check_seconds = check_seconds
+        self.entries = OrderedDict()
+        self.generation = None
+        self.epoch = None
+        self.checked_at = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok = True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Forces the epoch to be read again at the next lookup, e.g. right after a write in this process
+    def invalidate(self):
+        self.checked_at = None
+
+    def clear(self):
+        self.entries.clear()
+        self.invalidate()
+        if self.disk_dir is not None:
+            for file_name in os.listdir(self.disk_dir):
+                if file_name.endswith('.pickle'):
+                    os.remove(os.path.join(self.disk_dir, file_name))
+
+    def stamp_due(self):
+        return self.checked_at is None or time.monotonic() - self.checked_at >= self.check_seconds
+
+    def update_stamp(self, stamp):
+        if stamp != (self.generation, self.epoch):
+            if self.epoch is not None:
+                self.invalidations += 1
+            self.entries.clear()
+            self.generation, self.epoch = stamp
+        self.checked_at = time.monotonic()
+
+    def current_stamp(self, session):
+        if self.stamp_due():
+            self.update_stamp(query_graph_stamp(session))
+        return self.generation, self.epoch
+
+    async def current_stamp_async(self, tx):
+        if self.stamp_due():
+            self.update_stamp(await query_graph_stamp_async(tx))
+        return self.generation, self.epoch
+
+    def disk_path(self, key):
+        return os.path.join(self.disk_dir, key + '.pickle')
+
+    def read_disk(self, key, stamp):
+        if self.disk_dir is None or not os.path.exists(self.disk_path(key)):
+            return None
+        try:
+            with open(self.disk_path(key), 'rb') as cache_file:
+                entry = pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if entry[0] != stamp:
+            os.remove(self.disk_path(key))
+            return None
+        return entry
+
+    def write_disk(self, key, entry):
+        path = self.disk_path(key)
+        with open(path + '.tmp', 'wb') as cache_file:
+            pickle.dump(entry, cache_file, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last = False)
+            self.evictions += 1
+
+    # The records and summary of the cached entry of key, or None (counted as a miss)
+    def lookup(self, key, stamp, query, parameters, started):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        else:
+            entry = self.read_disk(key, stamp)
+            if entry is not None:
+                self.store(key, entry)
+                self.disk_hits += 1
+        if entry is None:
+            self.misses += 1
+            return None
+        records = [Record(zip(entry[1], values)) for values in entry[2]]
+        return records, CachedSummary(query, parameters, (time.perf_counter() - started) * 1000, stamp[1])
+
+    def remember(self, key, stamp, records):
+        entry = (stamp, list(records[0].keys()) if records else [], [list(record.values()) for record in records])
+        self.store(key, entry)
+        if self.disk_dir is not None:
+            self.write_disk(key, entry)
+
+    # Same as session.run(query, parameters) followed by (list(result), result.consume()), with
+    # the records rebuilt from the cache while the generation and the write epoch have not changed.
+    # session can also be the transaction of execute_read.
+    def run(self, session, query, parameters = None):
+        started = time.perf_counter()
+        stamp = self.current_stamp(session)
+        key = cache_key(query, parameters)
+        cached = self.lookup(key, stamp, query, parameters, started)
+        if cached is not None:
+            return cached
+
+        result = session.run(query, parameters or {})
+        records = list(result)
+        summary = result.consume()
+        self.remember(key, stamp, records)
+        return records, summary
+
+    # The same for a transaction of the async driver (async_runner_neo4j)
+    async def run_async(self, tx, query, parameters = None):
+        started = time.perf_counter()
+        stamp = await self.current_stamp_async(tx)
+        key = cache_key(query, parameters)
+        cached = self.lookup(key, stamp, query, parameters, started)
+        if cached is not None:
+            return cached
+
+        result = await tx.run(query, parameters or {})
+        records = [record async for record in result]
+        summary = await result.consume()
+        self.remember(key, stamp, records)
+        return records, summary
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'generation': self.generation,
+            'epoch': self.epoch,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+# session.run(query, parameters) read to the end, through cache when one is given
+def run_read(session, query, cache = None, parameters = None):
+    if cache is not None:
+        return cache.run(session, query, parameters)
+    result = session.run(query, parameters or {})
+    records = list(result)
+    summary = result.consume()
+    return records, summary
+
+if __name__ == '__main__':
+    from queries_neo4j import print_query_results
+
+    parser = argparse.ArgumentParser(description = 'Run the dashboard read queries through the write-epoch result cache.')
+    parser.add_argument('--repeat', type = int, default = REPEAT, help = 'times every query is run')
+    parser.add_argument('--max-entries', type = int, default = MAX_ENTRIES)
+    parser.add_argument('--disk-dir', default = None, help = 'also keep the results in this directory')
+    parser.add_argument('--check-seconds', type = float, default = CHECK_SECONDS,
+                        help = 'seconds between two reads of the write epoch (0 reads it on every lookup)')
+    parser.add_argument('--clear', action = 'store_true', help = 'empty the cache before running')
+    parser.add_argument('--print', action = 'store_true', help = 'print the records of every query')
+    args = parser.parse_args()
+
+    cache = ResultCache(args.max_entries, args.disk_dir, args.check_seconds)
+    if args.clear:
+        cache.clear()
+
+    with session_scope() as session:
+        for run in range(args.repeat):
+            for name, query in dashboard_queries():
+                started = time.perf_counter()
+                records, summary = cache.run(session, query)
+                print('Run {run}, {name}: {records} records in {micros:.0f} us{cached}.'.format(
+                    run = run + 1, name = name, records = len(records), micros = (time.perf_counter() - started) * 1e6,
+                    cached = ' (cached)' if isinstance(summary, CachedSummary) else '',
+                ))
+                if args.print and run == 0:
+                    print_query_results(records, summary)
+
+    print('Cache: {stats}'.format(stats = cache.stats()))
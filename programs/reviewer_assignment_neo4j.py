@@ -0,0 +1,255 @@
+import argparse
+import time
+import numpy as np
+from graph_store import DATA_DIR, CSR, GraphStore
+from pagerank_neo4j import pagerank_from_store
+from session_helper_neo4j import session_scope, run_with_retry
+from graph_version_neo4j import bump_write_epoch
+
+REVIEWERS = 3
+MAX_LOAD = 5
+HOPS = 1
+CANDIDATES = 50
+WINDOW = 50
+EXPERTISE_WEIGHT = 0.5
+BATCH_SIZE = 10000
+
+# Position of every item inside its run of equal values, for sorted values
+def group_ranks(values):
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]]) if len(values) else np.zeros(0, dtype = np.int64)
+    return np.arange(len(values)) - np.repeat(starts, np.diff(np.append(starts, len(values))))
+
+# Whether each key is in sorted_keys, and its position there
+def lookup(sorted_keys, keys):
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype = bool), np.zeros(len(keys), dtype = np.int64)
+    found = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[found] == keys, found
+
+# Batch reviewer assignment.
+# Conflicts of interest: an author can not review a paper that they wrote, that was written by
+# someone within `hops` co-authorship hops of them, or by an author from the same Institution.
+# Candidates are scored by how much they wrote about the keywords of the paper (the mean over
+# the paper's keywords of log(1 + number of their papers with it)), plus expertise_weight times
+# their expertise: the page-rank of their papers summed, scaled to [0, 1].
+#
+# The assignment goes in rounds. A round draws the pool of every keyword: its best authors among
+# the reviewers that are not full yet, as many as twice the reviews its papers need (and at
+# least `window`). Each paper of the keyword is shown the next `window` authors of the pool, so
+# that they do not all compete for the same first authors. The candidates of all the papers
+# short of reviewers are scored and checked for conflicts at once, as arrays of (paper, author)
+# pairs, and every paper keeps its best `candidates` of them. Those pairs are then assigned
+# greedily by score descending, as long as the paper needs reviewers and the reviewer has less
+# than max_load papers. Rounds stop when one assigns nothing; papers still short of reviewers
+# are then completed by the least loaded non-conflicted authors, without keyword overlap. The
+# reviews already in the data count towards both the paper and the reviewer.
+class ReviewerAssignment:
+    def __init__(self, store, hops = HOPS, candidates = CANDIDATES, window = WINDOW, expertise_weight = EXPERTISE_WEIGHT):
+        self.store = store
+        self.hops = hops
+        self.candidates = candidates
+        self.window = window
+        self.author_count = store.node_count('Author')
+        self.paper_count = store.node_count('Paper')
+        self.writes = store.relations['writes']
+        self.has = store.relations['has']
+
+        institutions = np.asarray(store.property('Author', 'institution')[np.arange(self.author_count)], dtype = str)
+        codes = np.unique(institutions, return_inverse = True)[1]
+        self.institutions = np.where(institutions == '', -1, codes)
+
+        writes_authors = np.asarray(self.writes.sources, dtype = np.int64)
+        writes_papers = np.asarray(self.writes.targets, dtype = np.int64)
+        paper_scores = pagerank_from_store(store)[0]
+        expertise = np.bincount(writes_authors, weights = paper_scores[writes_papers], minlength = self.author_count)
+        self.expertise = expertise_weight * expertise / expertise.max() if expertise.max() > 0 else expertise
+
+        # author1 * author_count + author2 of every two authors within hops co-authorship hops
+        pair_authors = np.repeat(writes_authors, self.writes.incoming.degrees()[writes_papers])
+        coauthors = np.asarray(self.writes.incoming.indices[self.writes.incoming.positions(writes_papers)], dtype = np.int64)
+        coauthor_keys = np.unique(pair_authors * self.author_count + coauthors)
+        self.nearby = np.zeros(0, dtype = np.int64) if hops == 0 else coauthor_keys
+        coauthors = CSR(coauthor_keys // self.author_count, coauthor_keys % self.author_count, self.author_count)
+        for _ in range(hops - 1):
+            pair_authors, others = self.nearby // self.author_count, self.nearby % self.author_count
+            pair_authors = np.repeat(pair_authors, coauthors.degrees()[others])
+            self.nearby = np.union1d(self.nearby, pair_authors * self.author_count + coauthors.indices[coauthors.positions(others)])
+
+        # keyword -> (author, weight) from the keywords of the papers of every author, by keyword
+        # and then score descending
+        authors = np.repeat(writes_authors, self.has.out.degrees()[writes_papers])
+        keywords = np.asarray(self.has.out.indices[self.has.out.positions(writes_papers)], dtype = np.int64)
+        keyword_count = store.node_count('Keyword')
+        self.keyword_count = keyword_count
+        self.author_keywords, counts = np.unique(authors * keyword_count + keywords, return_counts = True)
+        self.author_keyword_weights = np.log1p(counts)
+        keywords, authors = self.author_keywords % keyword_count, self.author_keywords // keyword_count
+        order = np.lexsort((authors, -(self.author_keyword_weights + self.expertise[authors]), keywords))
+        self.keywords, self.keyword_authors = keywords[order], authors[order]
+
+    # keyword -> author adjacency of the best open authors of every keyword, sizes[keyword] of them
+    def keyword_pool(self, open_authors, sizes):
+        kept = open_authors[self.keyword_authors]
+        keywords, authors = self.keywords[kept], self.keyword_authors[kept]
+        kept = group_ranks(keywords) < sizes[keywords]
+        return CSR(keywords[kept], authors[kept], self.keyword_count)
+
+    # Mean over the keywords of each paper of the weight of the author for it
+    def overlap(self, papers, authors):
+        pairs = np.repeat(np.arange(len(papers)), self.has.out.degrees()[papers])
+        keys = authors[pairs] * self.keyword_count + self.has.out.indices[self.has.out.positions(papers)]
+        known, found = lookup(self.author_keywords, keys)
+        weights = np.where(known, self.author_keyword_weights[found], 0.0)
+        return np.bincount(pairs, weights = weights, minlength = len(papers)) / np.maximum(self.has.out.degrees()[papers], 1)
+
+    # Authors of the paper and everyone within hops co-authorship hops of them
+    def conflicted_authors(self, paper):
+        authors = np.asarray(self.writes.incoming.neighbors(paper), dtype = np.int64)
+        ranges = np.searchsorted(self.nearby, np.stack([authors, authors + 1]) * self.author_count)
+        nearby = [self.nearby[start:end] % self.author_count for start, end in ranges.T]
+        return np.unique(np.concatenate([authors] + nearby))
+
+    # Whether each (paper, author) pair is a conflict of interest, checked against every author of the paper
+    def conflicts(self, papers, authors):
+        pairs = np.repeat(np.arange(len(papers)), self.writes.incoming.degrees()[papers])
+        paper_authors = np.asarray(self.writes.incoming.indices[self.writes.incoming.positions(papers)], dtype = np.int64)
+        others = authors[pairs]
+        conflicted = (paper_authors == others) | lookup(self.nearby, paper_authors * self.author_count + others)[0]
+        conflicted |= (self.institutions[paper_authors] >= 0) & (self.institutions[paper_authors] == self.institutions[others])
+        return np.bincount(pairs[conflicted], minlength = len(papers)) > 0
+
+    # (papers, authors, scores) of the best non-conflicted candidates of every paper among the
+    # open authors
+    def candidate_pairs(self, papers, needed, open_authors, max_load):
+        pair_papers = np.repeat(papers, self.has.out.degrees()[papers])
+        keywords = np.asarray(self.has.out.indices[self.has.out.positions(papers)], dtype = np.int64)
+        demand = np.bincount(keywords, weights = needed[pair_papers], minlength = self.keyword_count)
+        pool = self.keyword_pool(open_authors, np.maximum(self.window, np.ceil(2 * demand / max_load)))
+
+        # The i-th paper of a keyword gets the window starting at i * window, wrapping around the pool
+        order = np.lexsort((pair_papers, keywords))
+        pair_papers, keywords = pair_papers[order], keywords[order]
+        sizes = pool.degrees()[keywords]
+        windows = np.minimum(sizes, self.window)
+        pairs = np.repeat(np.arange(len(keywords)), windows)
+        steps = np.arange(len(pairs)) - np.repeat(np.cumsum(windows) - windows, windows)
+        positions = pool.indptr[keywords[pairs]] + (group_ranks(keywords)[pairs] * self.window + steps) % sizes[pairs]
+        keys = np.sort(pair_papers[pairs] * self.author_count + pool.indices[positions])
+        keys = keys[np.r_[True, keys[1:] != keys[:-1]]] if len(keys) else keys
+        pair_papers, pair_authors = keys // self.author_count, keys % self.author_count
+        scores = self.overlap(pair_papers, pair_authors) + self.expertise[pair_authors]
+
+        # Only twice the candidates of every paper are checked for conflicts, which are few. The
+        # pairs are sorted by paper and author, so the stable sort breaks ties on the author.
+        order = np.lexsort((-scores, pair_papers))
+        pair_papers, pair_authors, scores = pair_papers[order], pair_authors[order], scores[order]
+        best = group_ranks(pair_papers) < 2 * self.candidates
+        pair_papers, pair_authors, scores = pair_papers[best], pair_authors[best], scores[best]
+
+        allowed = ~self.conflicts(pair_papers, pair_authors)
+        pair_papers, pair_authors, scores = pair_papers[allowed], pair_authors[allowed], scores[allowed]
+        best = group_ranks(pair_papers) < self.candidates
+        return pair_papers[best], pair_authors[best], scores[best]
+
+    # (papers, reviewers, scores) of the new assignments, and the papers that are still short of reviewers
+    def assign(self, papers = None, reviewers = REVIEWERS, max_load = MAX_LOAD):
+        papers = np.arange(self.paper_count) if papers is None else np.asarray(papers, dtype = np.int64)
+        reviews = self.store.relations['reviews']
+        needed = np.full(self.paper_count, reviewers, dtype = np.int64) - np.bincount(reviews.targets, minlength = self.paper_count)
+        load = np.bincount(reviews.sources, minlength = self.author_count).astype(np.int64)
+        assigned = set(zip(np.asarray(reviews.targets).tolist(), np.asarray(reviews.sources).tolist()))
+
+        result_papers, result_authors, result_scores = [], [], []
+        progress = True
+        while progress and (needed[papers] > 0).any():
+            progress = False
+            candidate_papers, candidate_authors, candidate_scores = self.candidate_pairs(papers[needed[papers] > 0], needed, load < max_load, max_load)
+
+            # Ties are broken on the paper and then the reviewer, so the assignment is deterministic
+            order = np.lexsort((candidate_authors, candidate_papers, -candidate_scores))
+            for paper, author, score in zip(candidate_papers[order].tolist(), candidate_authors[order].tolist(),
+                                            candidate_scores[order].tolist()):
+                if needed[paper] > 0 and load[author] < max_load and (paper, author) not in assigned:
+                    needed[paper] -= 1
+                    load[author] += 1
+                    assigned.add((paper, author))
+                    result_papers.append(paper)
+                    result_authors.append(author)
+                    result_scores.append(score)
+                    progress = True
+
+        # The authors left with the lowest load after the greedy pass come first; first skips
+        # the ones that got full since
+        available = np.flatnonzero(load < max_load)
+        available = available[np.lexsort((available, load[available]))].tolist()
+        first = 0
+        for paper in papers[needed[papers] > 0].tolist():
+            conflicted = set(self.conflicted_authors(paper).tolist())
+            institutions = set(self.institutions[self.writes.incoming.neighbors(paper)].tolist()) - {-1}
+            while first < len(available) and load[available[first]] >= max_load:
+                first += 1
+            for author in available[first:]:
+                if needed[paper] == 0:
+                    break
+                if load[author] < max_load and author not in conflicted and self.institutions[author] not in institutions \
+                        and (paper, author) not in assigned:
+                    needed[paper] -= 1
+                    load[author] += 1
+                    assigned.add((paper, author))
+                    result_papers.append(paper)
+                    result_authors.append(author)
+                    result_scores.append(0.0)
+
+        return (np.array(result_papers, dtype = np.int64), np.array(result_authors, dtype = np.int64),
+                np.array(result_scores, dtype = np.float64), papers[needed[papers] > 0])
+
+def write_reviews_batch(tx, rows):
+    tx.run(
+        """UNWIND $rows AS row
+            MATCH (author:Author {ID: row.author})
+            WITH author, row
+            MATCH (paper:Paper {ID: row.paper})
+            MERGE (author) - [r:reviews] -> (paper)
+            SET r.assignmentScore = row.score, paper:PendingDecision""",
+        rows = rows
+    )
+
+def write_reviews(session, store, papers, authors, scores, batch_size = BATCH_SIZE):
+    paper_ids = store.nodes['Paper'].ids
+    author_ids = store.nodes['Author'].ids
+    for start in range(0, len(papers), batch_size):
+        rows = [{'paper': paper_ids[int(paper)], 'author': author_ids[int(author)], 'score': float(score)}
+                for paper, author, score in zip(papers[start:start + batch_size], authors[start:start + batch_size],
+                                                scores[start:start + batch_size])]
+        run_with_retry(session.execute_write, write_reviews_batch, rows)
+    if len(papers):
+        session.execute_write(bump_write_epoch, ['reviews'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Assign reviewers to every paper, avoiding conflicts of interest.')
+    parser.add_argument('--reviewers', type = int, default = REVIEWERS, help = 'reviewers per paper')
+    parser.add_argument('--max-load', type = int, default = MAX_LOAD, help = 'papers per reviewer')
+    parser.add_argument('--hops', type = int, default = HOPS, help = 'co-authorship hops that are a conflict')
+    parser.add_argument('--candidates', type = int, default = CANDIDATES, help = 'best candidates kept per paper')
+    parser.add_argument('--window', type = int, default = WINDOW, help = 'authors of each keyword shown to a paper')
+    parser.add_argument('--expertise-weight', type = float, default = EXPERTISE_WEIGHT)
+    parser.add_argument('--data-dir', default = DATA_DIR)
+    parser.add_argument('--write', action = 'store_true', help = 'store the assignments as reviews relations')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = GraphStore.load(args.data_dir)
+    assignment = ReviewerAssignment(store, args.hops, args.candidates, args.window, args.expertise_weight)
+    papers, authors, scores, short = assignment.assign(reviewers = args.reviewers, max_load = args.max_load)
+    print('Assigned {assigned} reviews in {elapsed:.2f} s; {short} papers are short of reviewers.'.format(
+        assigned = len(papers), elapsed = time.perf_counter() - start, short = len(short)))
+
+    if args.write:
+        with session_scope() as session:
+            print('Writing the reviews relations into the database...')
+            write_reviews(session, store, papers, authors, scores)
+    else:
+        titles = store.property('Paper', 'title')
+        names = store.property('Author', 'name')
+        for paper, author, score in zip(papers, authors, scores):
+            print('{title}: {name} ({score:.3f})'.format(title = titles[int(paper)], name = names[int(author)], score = score))
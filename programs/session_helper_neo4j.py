@@ -1,25 +1,142 @@
-from neo4j import GraphDatabase
+import atexit
+import configparser
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from neo4j import AsyncGraphDatabase, GraphDatabase
+from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
 
+# Connection settings, read from the environment first and then from the [neo4j] section
+# of the ini file given by NEO4J_CONFIG (if any). Defaults match the local lab setup.
+DEFAULT_CONFIG = {
+    'uri': 'bolt://localhost:7687',
+    'user': 'neo4j',
+    'password': 'neo4j',
+    'database': '',
+    'max_connection_pool_size': '50',
+    'max_connection_lifetime': '3600',
+    'connection_acquisition_timeout': '60',
+    'fetch_size': '1000',
+    'retries': '5',
+    'retry_backoff': '0.5',
+}
+
+TRANSIENT_ERRORS = (TransientError, ServiceUnavailable, SessionExpired)
+
+_driver = None
+_driver_lock = threading.Lock()
+
+def load_config():
+    config = dict(DEFAULT_CONFIG)
+
+    config_file = os.environ.get('NEO4J_CONFIG')
+    if config_file:
+        parser = configparser.ConfigParser()
+        parser.read(config_file)
+        if parser.has_section('neo4j'):
+            config.update(parser['neo4j'])
+
+    for key in DEFAULT_CONFIG:
+        value = os.environ.get('NEO4J_' + key.upper())
+        if value is not None:
+            config[key] = value
+
+    return config
+
+def driver_config(config):
+    return {
+        'auth': (config['user'], config['password']),
+        'max_connection_pool_size': int(config['max_connection_pool_size']),
+        'max_connection_lifetime': float(config['max_connection_lifetime']),
+        'connection_acquisition_timeout': float(config['connection_acquisition_timeout']),
+    }
+
+# One driver (and so one connection pool) per process, created on first use
+def get_driver():
+    global _driver
+
+    with _driver_lock:
+        if _driver is None:
+            config = load_config()
+            print('Creating a connection with neo4j...')
+            _driver = GraphDatabase.driver(config['uri'], **driver_config(config))
+        return _driver
+
+# Async drivers are bound to the event loop that uses them, so the caller owns
+# this one and has to close it before the loop ends.
+def create_async_driver():
+    config = load_config()
+    print('Creating an async connection with neo4j...')
+    return AsyncGraphDatabase.driver(config['uri'], **driver_config(config))
+
+def close_driver():
+    global _driver
+
+    with _driver_lock:
+        if _driver is not None:
+            _driver.close()
+            _driver = None
+
+atexit.register(close_driver)
+
+def session_config():
+    config = load_config()
+    kwargs = {'fetch_size': int(config['fetch_size'])}
+    if config['database']:
+        kwargs['database'] = config['database']
+    return kwargs
+
+@contextmanager
+def session_scope(**kwargs):
+    session = get_driver().session(**{**session_config(), **kwargs})
+    try:
+        yield session
+    finally:
+        session.close()
+
+# Runs work(*args) again on transient errors, with exponential backoff and jitter.
+# execute_read/execute_write already retry inside a transaction; this also covers
+# auto-commit session.run calls and a lost connection while opening a session.
+def run_with_retry(work, *args, retries = None, backoff = None, **kwargs):
+    config = load_config()
+    retries = int(config['retries']) if retries is None else retries
+    backoff = float(config['retry_backoff']) if backoff is None else backoff
+
+    for attempt in range(retries + 1):
+        try:
+            return work(*args, **kwargs)
+        except TRANSIENT_ERRORS as error:
+            if attempt == retries:
+                raise
+            delay = backoff * (2 ** attempt) * (1 + random.random())
+            print('Transient error ({error}), retrying in {delay:.2f} s...'.format(
+                error = type(error).__name__, delay = delay,
+            ))
+            time.sleep(delay)
+
+# The write epochs (graph_version_neo4j) are kept, so that they keep counting up across reloads
+# and nothing stamped before the wipe can match the reloaded graph
 def delete_and_detach_all_nodes(session):
     session.run(
-        "MATCH (n) DETACH DELETE n"
+        "MATCH (n) WHERE NOT n:GraphVersion DETACH DELETE n"
     )
 
-def create_session():
-    username = 'neo4j'
-    password = 'neo4j'
-
-    print('Creating a connection with neo4j...')
-    driver = GraphDatabase.driver("bolt://localhost:7687", auth=(username, password))
+def create_driver():
+    return get_driver()
 
-    session = driver.session()
+# Kept for the scripts that manage the session themselves; the session now comes
+# from the shared driver, so closing it only returns its connection to the pool.
+def create_session():
+    session = get_driver().session(**session_config())
     print('Session Initiated....')
 
     return session
 
 def clean_session(session):
-    
+
     print('Deleting and detaching all the previous nodes in the database.')
     session.execute_write(delete_and_detach_all_nodes)
 
-    return session
\ No newline at end of file
+    return session
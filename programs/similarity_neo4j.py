@@ -0,0 +1,199 @@
+import argparse
+import heapq
+import zlib
+from collections import defaultdict
+import numpy as np
+from graph_store import CSR
+from session_helper_neo4j import session_scope
+from graph_version_neo4j import bump_write_epoch
+
+TOP_K = 10
+NUM_PERMUTATIONS = 128
+BANDS = 32
+BATCH_SIZE = 10000
+
+# Exact Jaccard similarity of papers over their keywords, without GDS.
+# Row i of the paper-paper intersection matrix A.A^T is computed from the sparse paper->keyword
+# and keyword->paper adjacencies: every keyword of i votes for the papers that also have it, and
+# the votes are counted by sorting them instead of with a counter per paper, so the work is
+# proportional to the pairs that actually share a keyword, not to all pairs.
+class KeywordSimilarity:
+    def __init__(self, papers, keywords, paper_count, keyword_count):
+        pairs = np.unique(np.stack([papers, keywords], axis = 1), axis = 0).reshape(-1, 2)
+        self.paper_count = paper_count
+        self.keywords_of = CSR(pairs[:, 0], pairs[:, 1], paper_count)
+        self.papers_of = CSR(pairs[:, 1], pairs[:, 0], keyword_count)
+        self.degrees = self.keywords_of.degrees()
+
+    @classmethod
+    def from_store(cls, store):
+        has = store.relations['has']
+        return cls(has.sources, has.targets, store.node_count('Paper'), store.node_count('Keyword'))
+
+    def intersections(self, paper):
+        others = self.papers_of.indices[self.papers_of.positions(self.keywords_of.neighbors(paper))]
+        candidates, counts = np.unique(others, return_counts = True)
+        other = candidates != paper
+        return candidates[other], counts[other]
+
+    # The k most similar papers to paper, by similarity descending and then position
+    def similar(self, paper, k = TOP_K):
+        candidates, shared = self.intersections(paper)
+        scores = shared / (self.degrees[paper] + self.degrees[candidates] - shared)
+        order = np.lexsort((candidates, -scores))[:k]
+        return candidates[order], scores[order]
+
+    # (paper1, paper2, similarity) for the top k neighbours of every paper, like nodeSimilarity
+    def all_top_k(self, k = TOP_K):
+        for paper in range(self.paper_count):
+            others, scores = self.similar(paper, k)
+            for other, score in zip(others, scores):
+                yield paper, int(other), float(score)
+
+# Approximate similarity with MinHash signatures and LSH banding. A paper's signature is the
+# minimum of NUM_PERMUTATIONS random hash functions over its keywords, and two papers agree on
+# one position with probability equal to their Jaccard similarity. The signature is cut into
+# BANDS bands; papers sharing a band bucket become candidates, which are then ranked by exact
+# Jaccard on their keyword sets. Papers can be added or re-tagged at any time.
+class MinHashLSH:
+    PRIME = (1 << 31) - 1
+
+    def __init__(self, num_permutations = NUM_PERMUTATIONS, bands = BANDS, seed = 0):
+        if num_permutations % bands != 0:
+            raise ValueError('num_permutations must be a multiple of bands')
+        generator = np.random.default_rng(seed)
+        self.a = generator.integers(1, self.PRIME, size = num_permutations, dtype = np.uint64)
+        self.b = generator.integers(0, self.PRIME, size = num_permutations, dtype = np.uint64)
+        self.bands = bands
+        self.rows = num_permutations // bands
+        self.keywords = {}
+        self.signatures = {}
+        self.buckets = [defaultdict(set) for _ in range(bands)]
+
+    def signature(self, keywords):
+        values = np.array([zlib.crc32(str(keyword).encode('utf-8')) % self.PRIME for keyword in keywords],
+                          dtype = np.uint64)
+        if len(values) == 0:
+            return np.full(len(self.a), self.PRIME, dtype = np.uint64)
+        return ((self.a[:, None] * values[None, :] + self.b[:, None]) % self.PRIME).min(axis = 1)
+
+    def band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def remove(self, paper):
+        if paper in self.signatures:
+            for band, key in enumerate(self.band_keys(self.signatures.pop(paper))):
+                self.buckets[band][key].discard(paper)
+            del self.keywords[paper]
+
+    # Adds keywords to a paper (a new paper, or new tags for a known one)
+    def add(self, paper, keywords):
+        keywords = set(keywords) | self.keywords.get(paper, set())
+        self.remove(paper)
+        self.keywords[paper] = keywords
+        signature = self.signature(sorted(keywords))
+        self.signatures[paper] = signature
+        for band, key in enumerate(self.band_keys(signature)):
+            self.buckets[band][key].add(paper)
+
+    def candidates(self, paper):
+        found = set()
+        for band, key in enumerate(self.band_keys(self.signatures[paper])):
+            found |= self.buckets[band].get(key, set())
+        found.discard(paper)
+        return found
+
+    # Papers that are not indexed or have no keywords have no similar papers
+    def similar(self, paper, k = TOP_K):
+        keywords = self.keywords.get(paper)
+        if not keywords:
+            return []
+        scored = [(len(keywords & self.keywords[other]) / len(keywords | self.keywords[other]), other)
+                  for other in self.candidates(paper)]
+        scored.sort(key = lambda item: (-item[0], item[1]))
+        return [(other, score) for score, other in scored[:k] if score > 0]
+
+# The overall most similar pairs (each pair once), by similarity descending
+def top_pairs(similarity, limit = 5, k = TOP_K):
+    pairs = ((score, paper, other) for paper, other, score in similarity.all_top_k(k) if paper < other)
+    return heapq.nsmallest(limit, pairs, key = lambda pair: (-pair[0], pair[1], pair[2]))
+
+def fetch_paper_keywords(session):
+    result = session.run(
+        """MATCH (p:Paper) - [:has] -> (k:Keyword)
+            RETURN p.ID AS paper, k.ID AS keyword;"""
+    )
+    return [(record['paper'], record['keyword']) for record in result]
+
+def build_similarity(pairs):
+    paper_ids = sorted({paper for paper, _ in pairs})
+    keyword_ids = sorted({keyword for _, keyword in pairs})
+    paper_positions = {paper: position for position, paper in enumerate(paper_ids)}
+    keyword_positions = {keyword: position for position, keyword in enumerate(keyword_ids)}
+    papers = np.array([paper_positions[paper] for paper, _ in pairs], dtype = np.int64)
+    keywords = np.array([keyword_positions[keyword] for _, keyword in pairs], dtype = np.int64)
+    return paper_ids, KeywordSimilarity(papers, keywords, len(paper_ids), len(keyword_ids))
+
+def build_lsh(pairs, num_permutations = NUM_PERMUTATIONS, bands = BANDS):
+    keywords_of = defaultdict(set)
+    for paper, keyword in pairs:
+        keywords_of[paper].add(keyword)
+
+    index = MinHashLSH(num_permutations, bands)
+    for paper, keywords in keywords_of.items():
+        index.add(paper, keywords)
+    return index
+
+def write_similar_batch(tx, rows):
+    tx.run(
+        """UNWIND $rows AS row
+            MATCH (p1:Paper {ID: row.paper1})
+            WITH p1, row
+            MATCH (p2:Paper {ID: row.paper2})
+            MERGE (p1) - [s:SIMILAR] -> (p2)
+            SET s.score = row.score""",
+        rows = rows
+    )
+
+# Same output as gds.nodeSimilarity.write with writeRelationshipType SIMILAR and writeProperty score
+def write_similarities(session, paper_ids, similarity, k = TOP_K, batch_size = BATCH_SIZE):
+    rows = []
+    for paper, other, score in similarity.all_top_k(k):
+        rows.append({'paper1': paper_ids[paper], 'paper2': paper_ids[other], 'score': score})
+        if len(rows) == batch_size:
+            session.execute_write(write_similar_batch, rows)
+            rows = []
+    if rows:
+        session.execute_write(write_similar_batch, rows)
+    session.execute_write(bump_write_epoch, ['SIMILAR'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Paper similarity over keywords without GDS.')
+    parser.add_argument('--mode', choices = ['exact', 'approximate'], default = 'exact')
+    parser.add_argument('--k', type = int, default = TOP_K)
+    parser.add_argument('--paper', help = 'only print the papers most similar to this paper ID')
+    parser.add_argument('--write', action = 'store_true', help = 'store the exact top k as SIMILAR relations')
+    args = parser.parse_args()
+
+    with session_scope() as session:
+        pairs = session.execute_read(fetch_paper_keywords)
+
+        if args.mode == 'approximate':
+            index = build_lsh(pairs)
+            papers = [args.paper] if args.paper else sorted(index.keywords)
+            for paper in papers:
+                for other, score in index.similar(paper, args.k):
+                    print(paper, other, round(score, 4))
+        else:
+            paper_ids, similarity = build_similarity(pairs)
+            if args.write:
+                print('Writing the SIMILAR relations into the database...')
+                write_similarities(session, paper_ids, similarity, args.k)
+            positions = {paper_id: position for position, paper_id in enumerate(paper_ids)}
+            if args.paper and args.paper not in positions:
+                print('The paper {paper} has no keywords or does not exist.'.format(paper = args.paper))
+            papers = [positions[args.paper]] if args.paper in positions else [] if args.paper else range(len(paper_ids))
+            for paper in papers:
+                others, scores = similarity.similar(paper, args.k)
+                for other, score in zip(others, scores):
+                    print(paper_ids[paper], paper_ids[other], round(float(score), 4))
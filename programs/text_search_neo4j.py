@@ -0,0 +1,383 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import numpy as np
+from graph_store import DATA_DIR, read_csv
+from session_helper_neo4j import session_scope
+
+K1 = 1.2
+B = 0.75
+TOP_K = 10
+
+# Full-text search over the titles and abstracts of the papers, with BM25 ranking.
+# The index is a directory of segments. Every call to add() writes a new segment with the
+# vocabulary (sorted terms), the postings of every term (document, term frequency) and the
+# positions of every posting, all as flat numpy arrays opened with mmap, so opening the index
+# reads nothing but meta.json. Adding a paper that is already indexed clears it from the older
+# segments' live masks, which are replaced with a rename so that readers never see them half
+# written. merge() rewrites the live documents of every segment into a single segment from their
+# postings, without the texts, and rebuilding drops the segments and indexes the papers again.
+#
+# Queries are lists of words (any of them may match, they add up to the score), "quoted
+# phrases" (required, the words have to be consecutive) and prefix* words (any term starting
+# with the prefix).
+TOKEN = re.compile(r'\w+', re.UNICODE)
+QUERY_CLAUSE = re.compile(r'"([^"]*)"|(\S+)')
+
+def tokenize(text):
+    return TOKEN.findall(text.lower()) if text else []
+
+def paper_text(title, abstract):
+    return ' '.join(part for part in (title, abstract) if part)
+
+def write_strings(directory, name, strings):
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    with open(os.path.join(directory, name + '.bin'), 'wb') as output:
+        output.write(b''.join(encoded))
+    np.save(os.path.join(directory, name + '_offsets.npy'), offsets)
+
+class Strings:
+    def __init__(self, directory, name):
+        path = os.path.join(directory, name + '.bin')
+        self.data = np.memmap(path, dtype = np.uint8, mode = 'r') if os.path.getsize(path) else np.zeros(0, dtype = np.uint8)
+        self.offsets = np.load(os.path.join(directory, name + '_offsets.npy'), mmap_mode = 'r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return self.data[self.offsets[position]:self.offsets[position + 1]].tobytes().decode('utf-8')
+
+    # First position whose string is >= value (the strings are sorted)
+    def bisect(self, value):
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self[middle] < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+def write_segment(directory, ids, texts):
+    return write_tokens(directory, ids, [tokenize(text) for text in texts])
+
+def write_live(directory, live):
+    path = os.path.join(directory, 'live.npy')
+    np.save(path + '.tmp.npy', live)
+    os.replace(path + '.tmp.npy', path)
+
+# Writes a segment of documents given as lists of tokens. Returns their total length.
+def write_tokens(directory, ids, tokens):
+    os.makedirs(directory)
+    vocabulary = sorted({token for document in tokens for token in document})
+    term_ids = {term: position for position, term in enumerate(vocabulary)}
+
+    lengths = np.array([len(document) for document in tokens], dtype = np.int32)
+    terms = np.fromiter((term_ids[token] for document in tokens for token in document), dtype = np.int64, count = int(lengths.sum()))
+    documents = np.repeat(np.arange(len(tokens), dtype = np.int64), lengths)
+    positions = np.arange(len(terms)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    order = np.lexsort((positions, documents, terms))
+    terms, documents, positions = terms[order], documents[order], positions[order]
+
+    # One posting per (term, document), with the range of its positions
+    starts = np.flatnonzero(np.r_[True, (terms[1:] != terms[:-1]) | (documents[1:] != documents[:-1])]) if len(terms) else np.zeros(0, dtype = np.int64)
+    position_offsets = np.append(starts, len(terms)).astype(np.int64)
+    posting_terms = terms[starts]
+    postings_offsets = np.searchsorted(posting_terms, np.arange(len(vocabulary) + 1)).astype(np.int64)
+
+    write_strings(directory, 'vocabulary', vocabulary)
+    write_strings(directory, 'ids', ids)
+    np.save(os.path.join(directory, 'id_order.npy'), np.array(sorted(range(len(ids)), key = ids.__getitem__), dtype = np.int64))
+    np.save(os.path.join(directory, 'postings_offsets.npy'), postings_offsets)
+    np.save(os.path.join(directory, 'documents.npy'), documents[starts].astype(np.int32))
+    np.save(os.path.join(directory, 'frequencies.npy'), np.diff(position_offsets).astype(np.int32))
+    np.save(os.path.join(directory, 'position_offsets.npy'), position_offsets)
+    np.save(os.path.join(directory, 'positions.npy'), positions.astype(np.int32))
+    np.save(os.path.join(directory, 'lengths.npy'), lengths)
+    write_live(directory, np.ones(len(ids), dtype = bool))
+    return int(lengths.sum())
+
+class Segment:
+    def __init__(self, directory):
+        self.directory = directory
+        self.vocabulary = Strings(directory, 'vocabulary')
+        self.ids = Strings(directory, 'ids')
+        for name in ('postings_offsets', 'documents', 'frequencies', 'position_offsets', 'positions', 'lengths', 'live',
+                     'id_order'):
+            setattr(self, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode = 'r'))
+
+    # (ids, tokens) of the live documents, rebuilt from the postings and their positions
+    def live_documents(self):
+        offsets = np.asarray(self.postings_offsets)
+        posting_terms = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        frequencies = np.asarray(self.frequencies)
+        terms = np.repeat(posting_terms, frequencies)
+        documents = np.repeat(np.asarray(self.documents), frequencies)
+        positions = np.asarray(self.positions)
+        live = np.flatnonzero(np.asarray(self.live))
+        keep = np.asarray(self.live)[documents]
+        terms, documents, positions = terms[keep], documents[keep], positions[keep]
+        order = np.lexsort((positions, documents))
+        terms, documents = terms[order], documents[order]
+        bounds = np.searchsorted(documents, np.append(live, len(self.live)))
+        vocabulary = [self.vocabulary[term] for term in range(len(self.vocabulary))]
+        tokens = [[vocabulary[term] for term in terms[start:end].tolist()] for start, end in zip(bounds[:-1], bounds[1:])]
+        return [self.ids[document] for document in live.tolist()], tokens
+
+    # Position of a paper id in the segment, by binary search over the ids in sorted order
+    def find(self, paper_id):
+        low, high = 0, len(self.id_order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.ids[self.id_order[middle]] < paper_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.id_order) and self.ids[self.id_order[low]] == paper_id:
+            return int(self.id_order[low])
+        return None
+
+    def term(self, term):
+        position = self.vocabulary.bisect(term)
+        return position if position < len(self.vocabulary) and self.vocabulary[position] == term else None
+
+    def prefix_terms(self, prefix):
+        start = self.vocabulary.bisect(prefix)
+        end = start
+        while end < len(self.vocabulary) and self.vocabulary[end].startswith(prefix):
+            end += 1
+        return range(start, end)
+
+    # (documents, frequencies, posting positions) of a term id
+    def postings(self, term):
+        start, end = self.postings_offsets[term], self.postings_offsets[term + 1]
+        return np.asarray(self.documents[start:end]), np.asarray(self.frequencies[start:end]), np.arange(start, end)
+
+    def term_positions(self, posting):
+        return np.asarray(self.positions[self.position_offsets[posting]:self.position_offsets[posting + 1]])
+
+class TextIndex:
+    def __init__(self, directory, k1 = K1, b = B):
+        self.directory = directory
+        meta_path = os.path.join(directory, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as meta_file:
+                self.meta = json.load(meta_file)
+        else:
+            os.makedirs(directory, exist_ok = True)
+            self.meta = {'segments': [], 'documents': 0, 'total_length': 0, 'k1': k1, 'b': b}
+        self.segments = [Segment(os.path.join(directory, name)) for name in self.meta['segments']]
+
+    def save_meta(self):
+        path = os.path.join(self.directory, 'meta.json')
+        with open(path + '.tmp', 'w') as meta_file:
+            json.dump(self.meta, meta_file)
+        os.replace(path + '.tmp', path)
+
+    def clear(self):
+        for name in self.meta['segments']:
+            shutil.rmtree(os.path.join(self.directory, name))
+        self.meta.update(segments = [], documents = 0, total_length = 0)
+        self.segments = []
+        self.save_meta()
+
+    def next_segment(self):
+        return '{number:06d}'.format(number = max((int(name) + 1 for name in self.meta['segments']), default = 0))
+
+    # Replaces the segments with one segment of their live documents. Returns the number of
+    # segments merged.
+    def merge(self):
+        if len(self.segments) < 2:
+            return 0
+        ids, tokens = [], []
+        for segment in self.segments:
+            segment_ids, segment_tokens = segment.live_documents()
+            ids += segment_ids
+            tokens += segment_tokens
+
+        name = self.next_segment()
+        write_tokens(os.path.join(self.directory, name), ids, tokens)
+        merged = self.meta['segments']
+        self.meta['segments'] = [name]
+        self.save_meta()
+        self.segments = [Segment(os.path.join(self.directory, name))]
+        for old in merged:
+            shutil.rmtree(os.path.join(self.directory, old))
+        return len(merged)
+
+    # Indexes (paper id, title, abstract) triples as a new segment
+    def add(self, papers):
+        papers = list({paper_id: (paper_id, title, abstract) for paper_id, title, abstract in papers}.values())
+        if not papers:
+            return 0
+        added = {paper_id for paper_id, _, _ in papers}
+
+        for segment in self.segments:
+            dead = [position for position in (segment.find(paper_id) for paper_id in added)
+                    if position is not None and segment.live[position]]
+            if dead:
+                live = np.array(segment.live)
+                live[dead] = False
+                write_live(segment.directory, live)
+                self.meta['documents'] -= len(dead)
+                self.meta['total_length'] -= int(np.asarray(segment.lengths)[dead].sum())
+
+        name = self.next_segment()
+        total_length = write_segment(os.path.join(self.directory, name), [paper_id for paper_id, _, _ in papers],
+                                     [paper_text(title, abstract) for _, title, abstract in papers])
+        self.meta['segments'].append(name)
+        self.meta['documents'] += len(papers)
+        self.meta['total_length'] += total_length
+        self.save_meta()
+        self.segments = [Segment(os.path.join(self.directory, name)) for name in self.meta['segments']]
+        return len(papers)
+
+    def parse(self, query):
+        words, phrases, prefixes = [], [], []
+        for phrase, word in QUERY_CLAUSE.findall(query):
+            if phrase:
+                phrases.append(tokenize(phrase))
+            elif word.endswith('*'):
+                prefixes += tokenize(word[:-1])[:1]
+            else:
+                words += tokenize(word)
+        return words, [phrase for phrase in phrases if phrase], prefixes
+
+    def document_frequency(self, term):
+        frequency = 0
+        for segment in self.segments:
+            position = segment.term(term)
+            if position is not None:
+                documents, _, _ = segment.postings(position)
+                frequency += int(np.asarray(segment.live)[documents].sum())
+        return frequency
+
+    def phrase_documents(self, segment, phrase):
+        postings = []
+        for term in phrase:
+            position = segment.term(term)
+            if position is None:
+                return np.zeros(0, dtype = np.int64)
+            documents, _, posting_ids = segment.postings(position)
+            postings.append(dict(zip(documents.tolist(), posting_ids.tolist())))
+
+        matched = []
+        for document in set(postings[0]).intersection(*postings[1:]):
+            starts = set(segment.term_positions(postings[0][document]).tolist())
+            for offset, term_postings in enumerate(postings[1:], 1):
+                starts &= {position - offset for position in segment.term_positions(term_postings[document]).tolist()}
+            if starts:
+                matched.append(document)
+        return np.array(matched, dtype = np.int64)
+
+    # [(paper id, score)] of the best k papers
+    def search(self, query, k = TOP_K):
+        words, phrases, prefixes = self.parse(query)
+        documents = max(self.meta['documents'], 1)
+        average_length = max(self.meta['total_length'] / documents, 1)
+        k1, b = self.meta['k1'], self.meta['b']
+
+        terms = set(words) | {term for phrase in phrases for term in phrase}
+        for prefix in prefixes:
+            for segment in self.segments:
+                terms |= {segment.vocabulary[position] for position in segment.prefix_terms(prefix)}
+        idf = {}
+        for term in terms:
+            frequency = self.document_frequency(term)
+            idf[term] = np.log(1 + (documents - frequency + 0.5) / (frequency + 0.5))
+
+        hits = []
+        for segment in self.segments:
+            live = np.asarray(segment.live)
+            scores = np.zeros(len(live))
+            lengths = np.asarray(segment.lengths)
+            for term in terms:
+                position = segment.term(term)
+                if position is None:
+                    continue
+                matched, frequencies, _ = segment.postings(position)
+                normalization = k1 * (1 - b + b * lengths[matched] / average_length)
+                scores[matched] += idf[term] * frequencies * (k1 + 1) / (frequencies + normalization)
+
+            allowed = live & (scores > 0)
+            for phrase in phrases:
+                required = np.zeros(len(live), dtype = bool)
+                required[self.phrase_documents(segment, phrase)] = True
+                allowed &= required
+            candidates = np.flatnonzero(allowed)
+            # Every document tied with the k-th score is kept, so that the ties are broken on the
+            # paper id whatever segment the documents are in
+            if len(candidates) > k:
+                kth = -np.partition(-scores[candidates], k - 1)[k - 1]
+                candidates = candidates[scores[candidates] >= kth]
+            hits += [(segment.ids[document], float(scores[document])) for document in candidates]
+
+        hits.sort(key = lambda hit: (-hit[1], hit[0]))
+        return hits[:k]
+
+def papers_from_csv(data_dir = DATA_DIR):
+    papers = read_csv(data_dir, 'papers_semantic.csv')
+    return zip(papers['ID'], papers['title'], papers['abstract'])
+
+def fetch_papers(session):
+    result = session.run(
+        """MATCH (p:Paper)
+            RETURN p.ID AS ID, p.title AS title, p.abstract AS abstract;"""
+    )
+    return [(record['ID'], record['title'], record['abstract']) for record in result]
+
+# The matched papers in the order of the search results
+def query_papers(session, paper_ids):
+    result = session.run(
+        """UNWIND range(0, size($ids) - 1) AS rank
+            MATCH (p:Paper {ID: $ids[rank]})
+            RETURN rank, p.ID AS ID, p.title AS title
+            ORDER BY rank;""",
+        ids = paper_ids
+    )
+    records = list(result)
+    summary = result.consume()
+    return records, summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'BM25 search over the titles and abstracts of the papers.')
+    parser.add_argument('index_dir')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    add_parser = commands.add_parser('add', help = 'index papers (again) as a new segment')
+    add_parser.add_argument('--graph', action = 'store_true', help = 'read the papers from the database instead of the csv file')
+    add_parser.add_argument('--data-dir', default = DATA_DIR)
+    add_parser.add_argument('--rebuild', action = 'store_true', help = 'drop the existing segments first')
+    commands.add_parser('merge', help = 'merge the segments into one')
+    search_parser = commands.add_parser('search')
+    search_parser.add_argument('query')
+    search_parser.add_argument('--k', type = int, default = TOP_K)
+    search_parser.add_argument('--graph', action = 'store_true', help = 'look the results up in the database')
+    args = parser.parse_args()
+
+    index = TextIndex(args.index_dir)
+    if args.command == 'add':
+        if args.graph:
+            with session_scope() as session:
+                papers = session.execute_read(fetch_papers)
+        else:
+            papers = papers_from_csv(args.data_dir)
+        if args.rebuild:
+            index.clear()
+        print('Indexed {papers} papers.'.format(papers = index.add(papers)))
+    elif args.command == 'merge':
+        print('Merged {segments} segments.'.format(segments = index.merge()))
+    else:
+        hits = index.search(args.query, args.k)
+        if args.graph:
+            from queries_neo4j import print_query_results
+            with session_scope() as session:
+                records, summary = session.execute_read(query_papers, [paper_id for paper_id, _ in hits])
+                print_query_results(records, summary)
+        else:
+            for paper_id, score in hits:
+                print(round(score, 4), paper_id)
@@ -0,0 +1,98 @@
+import argparse
+import heapq
+from session_helper_neo4j import session_scope
+from graph_version_neo4j import bump_write_epoch
+
+TOP_K = 3
+
+# Paper.citationCount is set to 0 when a paper is created and incremented by the loader for
+# every cites relation. This recomputes it for graphs loaded before the counter existed.
+def set_citation_counts(session):
+    session.run(
+        """MATCH (p:Paper)
+            SET p.citationCount = SIZE([(p) <- [:cites] - (:Paper) | 1]);"""
+    )
+    bump_write_epoch(session, ['citationCount'])
+
+# Keeps the k best items of every group in a bounded min-heap, so n items cost O(n log k)
+# instead of a full sort. items are (group, key, score) tuples; the result maps each group to
+# its items ordered by score descending, with ties broken on the smallest key. With k <= 0 every
+# group is empty.
+def top_k_per_group(items, k = TOP_K):
+    heaps = {}
+    for group, key, score in items:
+        heap = heaps.setdefault(group, [])
+        # The heap root is the worst kept item: the lowest score, then the largest key
+        entry = (score, _ReversedKey(key))
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif heap and entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    return {
+        group: [(entry[1].key, entry[0]) for entry in sorted(heap, reverse = True)]
+        for group, heap in heaps.items()
+    }
+
+class _ReversedKey:
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+# Venue: (relation from Paper, venue label)
+VENUES = {
+    'conference': ('presented_in', 'Conference'),
+    'journal': ('published_in', 'Journal'),
+}
+
+# Streams one row per (venue, cited paper) and keeps the top k papers of every venue.
+# The records are consumed lazily, so the full list is never collected or sorted.
+def query_top_k_cited_papers(session, k = TOP_K, venue = 'conference'):
+    relation, label = VENUES[venue]
+    result = session.run(
+        """MATCH (p:Paper) - [:{relation}] -> (x:{label})
+            WHERE p.citationCount > 0
+            RETURN x.ID AS venueID,
+                   x.name AS venue,
+                   p.ID AS ID,
+                   p.title AS title,
+                   p.citationCount AS numberOfCitations;""".format(relation = relation, label = label)
+    )
+    # Groups are venue nodes (as in query_top3_cited_papers_conference), and the paper ID comes
+    # first in the key so that ties are ordered on it
+    top = top_k_per_group(
+        (((record['venueID'], record['venue']), (record['ID'], record['title']), record['numberOfCitations'])
+         for record in result), k
+    )
+    summary = result.consume()
+    return top, summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Top k most cited papers per conference or journal.')
+    parser.add_argument('--k', type = int, default = TOP_K)
+    parser.add_argument('--venue', choices = sorted(VENUES), default = 'conference')
+    parser.add_argument('--backfill', action = 'store_true', help = 'recompute Paper.citationCount first')
+    args = parser.parse_args()
+    if args.k < 1:
+        parser.error('--k must be at least 1')
+
+    with session_scope() as session:
+        if args.backfill:
+            print('Recomputing the citation count of every paper...')
+            session.execute_write(set_citation_counts)
+
+        top, summary = session.execute_read(query_top_k_cited_papers, args.k, args.venue)
+        print("The query returned the top {k} papers of {groups} venues in {time} ms.".format(
+            k = args.k, groups = len(top), time = summary.result_available_after,
+        ))
+        for (venue_id, venue), papers in sorted(top.items(), key = lambda item: (item[0][1] or '', item[0][0])):
+            print(venue)
+            for (paper_id, title), citations in papers:
+                print('    {citations:5d}  {title}'.format(citations = citations, title = title))
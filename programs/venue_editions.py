@@ -0,0 +1,286 @@
+import argparse
+import os
+import pickle
+import numpy as np
+from graph_store import DATA_DIR, GraphStore, source_fingerprints
+
+MIN_EDITIONS = 4
+MIN_SHARED = 1
+WORD_BITS = 64
+STATE_NAME = '.venue_editions.pickle'
+
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype = np.uint8)
+
+# Number of bits set in each row of a 2-d array of uint64 words
+def popcount(words):
+    words = np.ascontiguousarray(words, dtype = np.uint64)
+    return POPCOUNT[words.view(np.uint8)].reshape(len(words), -1).sum(axis = 1, dtype = np.int64)
+
+# The editions in which the authors of one conference series have published, as one row of
+# uint64 words per author. Every edition gets a bit position the first time it is seen.
+class SeriesEditions:
+    def __init__(self):
+        self.editions = []
+        self.slots = {}
+        self.authors = []
+        self.rows = {}
+        self.bits = np.zeros((0, 1), dtype = np.uint64)
+
+    def __len__(self):
+        return len(self.authors)
+
+    def slot(self, edition):
+        if edition not in self.slots:
+            self.slots[edition] = len(self.editions)
+            self.editions.append(edition)
+        return self.slots[edition]
+
+    def row(self, author):
+        if author not in self.rows:
+            self.rows[author] = len(self.authors)
+            self.authors.append(author)
+        return self.rows[author]
+
+    def set(self, authors, editions):
+        unique_editions, edition_inverse = np.unique(editions, return_inverse = True)
+        slots = np.array([self.slot(int(edition)) for edition in unique_editions], dtype = np.int64)[edition_inverse]
+        unique_authors, author_inverse = np.unique(authors, return_inverse = True)
+        rows = np.array([self.row(int(author)) for author in unique_authors], dtype = np.int64)[author_inverse]
+
+        # Grows the rows by doubling and the words as new editions come in
+        words = max(self.bits.shape[1], len(self.editions) // WORD_BITS + 1)
+        if len(self.authors) > len(self.bits) or words > self.bits.shape[1]:
+            bits = np.zeros((max(len(self.authors), 2 * len(self.bits)), words), dtype = np.uint64)
+            bits[:len(self.bits), :self.bits.shape[1]] = self.bits
+            self.bits = bits
+        np.bitwise_or.at(self.bits, (rows, slots // WORD_BITS), np.left_shift(np.uint64(1), (slots % WORD_BITS).astype(np.uint64)))
+
+    def counts(self):
+        return popcount(self.bits[:len(self.authors)])
+
+    def author_editions(self, author):
+        row = self.bits[self.rows[author]] if author in self.rows else np.zeros(1, dtype = np.uint64)
+        return sorted(edition for slot, edition in enumerate(self.editions)
+                      if int(row[slot // WORD_BITS]) >> (slot % WORD_BITS) & 1)
+
+# Index from (author, conference series) to the set of editions the author published in, where a
+# series is every Conference node with the same name. It is kept up to date from the writes and
+# presented_in edges as they are added, so the repeated-publication questions of Query 2 become
+# popcounts and intersections of bitsets instead of a self-join of author-paper-conference paths.
+# Authors, papers and conferences are positions in author_ids, paper_ids and conference_ids (the
+# node positions of the GraphStore it was built from); ids not seen yet are appended. The index is
+# saved next to the csv files, and the delta loader adds the new conferences and edges of every
+# load to it (update_venue_editions); bits can not be taken back, so deletes rebuild it.
+class VenueEditionIndex:
+    def __init__(self, conference_ids, conference_names, conference_editions, author_ids = (), paper_ids = ()):
+        self.series_names = []
+        self.series_codes = {}
+        self.series = []
+        self.conference_series = np.zeros(0, dtype = np.int64)
+        self.conference_editions = np.zeros(0, dtype = np.int64)
+        self.authors_of = {}
+        self.conferences_of = {}
+        self.ids = {'Author': [], 'Paper': [], 'Conference': []}
+        self.positions = {'Author': {}, 'Paper': {}, 'Conference': {}}
+        self.indices('Author', author_ids)
+        self.indices('Paper', paper_ids)
+        for conference, (name, edition) in zip(self.indices('Conference', conference_ids).tolist(),
+                                               zip(conference_names, conference_editions)):
+            self.add_conference(conference, name, edition)
+
+    @classmethod
+    def from_store(cls, store):
+        index = cls(list(store.nodes['Conference'].ids), store.property('Conference', 'name'),
+                    store.property('Conference', 'edition'), list(store.nodes['Author'].ids),
+                    list(store.nodes['Paper'].ids))
+        writes = store.relations['writes']
+        presented_in = store.relations['presented_in']
+        index.add_writes(writes.sources, writes.targets)
+        index.add_presented_in(presented_in.sources, presented_in.targets)
+        return index
+
+    # Opens the index saved in data_dir while the csv files are the ones it was saved with,
+    # and builds it from the store (and saves it) otherwise
+    @classmethod
+    def load(cls, data_dir = DATA_DIR):
+        sources = source_fingerprints(data_dir)
+        saved = read_state(data_dir)
+        if saved is not None and saved[0] == sources:
+            return saved[1]
+        index = cls.from_store(GraphStore.load(data_dir))
+        write_state(data_dir, sources, index)
+        return index
+
+    # Positions of the ids of a label, appending the ones not seen yet
+    def indices(self, label, node_ids):
+        ids, positions = self.ids[label], self.positions[label]
+        for node_id in node_ids:
+            if node_id not in positions:
+                positions[node_id] = len(ids)
+                ids.append(node_id)
+        return np.array([positions[node_id] for node_id in node_ids], dtype = np.int64)
+
+    # Conferences without an edition are never counted
+    def add_conference(self, conference, name, edition):
+        if conference >= len(self.conference_series):
+            grown = conference + 1 - len(self.conference_series)
+            self.conference_series = np.append(self.conference_series, np.full(grown, -1, dtype = np.int64))
+            self.conference_editions = np.append(self.conference_editions, np.full(grown, -1, dtype = np.int64))
+        if name not in self.series_codes:
+            self.series_codes[name] = len(self.series_names)
+            self.series_names.append(name)
+            self.series.append(SeriesEditions())
+        self.conference_series[conference] = self.series_codes[name] if edition is not None and edition >= 0 else -1
+        self.conference_editions[conference] = edition if edition is not None else -1
+
+    def set_bits(self, authors, conferences):
+        authors = np.asarray(authors, dtype = np.int64)
+        conferences = np.asarray(conferences, dtype = np.int64)
+        series_codes = self.conference_series[conferences]
+        for series in np.unique(series_codes[series_codes >= 0]):
+            found = series_codes == series
+            self.series[series].set(authors[found], self.conference_editions[conferences[found]])
+
+    def add_writes(self, authors, papers):
+        pairs_authors, pairs_conferences = [], []
+        for author, paper in zip(np.asarray(authors).tolist(), np.asarray(papers).tolist()):
+            self.authors_of.setdefault(paper, []).append(author)
+            for conference in self.conferences_of.get(paper, ()):
+                pairs_authors.append(author)
+                pairs_conferences.append(conference)
+        self.set_bits(pairs_authors, pairs_conferences)
+
+    def add_presented_in(self, papers, conferences):
+        pairs_authors, pairs_conferences = [], []
+        for paper, conference in zip(np.asarray(papers).tolist(), np.asarray(conferences).tolist()):
+            self.conferences_of.setdefault(paper, []).append(conference)
+            for author in self.authors_of.get(paper, ()):
+                pairs_authors.append(author)
+                pairs_conferences.append(conference)
+        self.set_bits(pairs_authors, pairs_conferences)
+
+    # Adds the conferences and the writes and presented_in edges of the rows a load inserted
+    def apply_inserted(self, element, rows):
+        if element == 'Conference':
+            for conference, row in zip(self.indices('Conference', [row['ID'] for row in rows]).tolist(), rows):
+                self.add_conference(conference, row['name'], int(float(row['edition'])) if row['edition'] else None)
+        elif element == 'writes':
+            self.add_writes(self.indices('Author', [row['START_ID'] for row in rows]),
+                            self.indices('Paper', [row['END_ID'] for row in rows]))
+        elif element == 'presented_in':
+            # Like MATCH in the loader, edges to conferences that do not exist are dropped
+            rows = [row for row in rows if row['END_ID'] in self.positions['Conference']]
+            self.add_presented_in(self.indices('Paper', [row['START_ID'] for row in rows]),
+                                  self.indices('Conference', [row['END_ID'] for row in rows]))
+
+    def editions(self, series_name, author):
+        return self.series[self.series_codes[series_name]].author_editions(author)
+
+    # Every author with at least min_editions editions in the series, as (authors, edition counts)
+    # by count descending and then author
+    def authors_with_editions(self, series_name, min_editions = MIN_EDITIONS):
+        series = self.series[self.series_codes[series_name]]
+        counts = series.counts()
+        found = np.flatnonzero(counts >= min_editions)
+        authors = np.array(series.authors, dtype = np.int64)[found]
+        order = np.lexsort((authors, -counts[found]))
+        return authors[order], counts[found][order]
+
+    # Every pair of authors that both have at least min_editions editions in the series and took
+    # part in at least min_shared of the same editions, as (author1, author2, shared) with
+    # author1 < author2
+    def co_participants(self, series_name, min_editions = MIN_EDITIONS, min_shared = MIN_SHARED):
+        series = self.series[self.series_codes[series_name]]
+        qualified = np.flatnonzero(series.counts() >= min_editions)
+        qualified = qualified[np.argsort(np.array(series.authors, dtype = np.int64)[qualified], kind = 'stable')]
+        bits = series.bits[qualified]
+        authors = np.array(series.authors, dtype = np.int64)[qualified]
+        pairs = []
+        for position in range(len(qualified) - 1):
+            shared = popcount(bits[position] & bits[position + 1:])
+            for other in np.flatnonzero(shared >= min_shared):
+                pairs.append((int(authors[position]), int(authors[position + 1 + other]), int(shared[other])))
+        return pairs
+
+    # (series name, author, edition count) over every series, the complete answer of Query 2
+    def all_authors_with_editions(self, min_editions = MIN_EDITIONS):
+        for series_name in self.series_names:
+            authors, counts = self.authors_with_editions(series_name, min_editions)
+            for author, count in zip(authors, counts):
+                yield series_name, int(author), int(count)
+
+def state_path(data_dir = DATA_DIR):
+    return os.path.join(data_dir, STATE_NAME)
+
+# The index is saved as the attributes of its objects rather than the objects themselves, so that
+# it reads back whether it was saved by this module or by its command line (__main__)
+def read_state(data_dir = DATA_DIR):
+    try:
+        with open(state_path(data_dir), 'rb') as state_file:
+            sources, attributes = pickle.load(state_file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    index = VenueEditionIndex.__new__(VenueEditionIndex)
+    index.__dict__.update(attributes)
+    index.series = []
+    for series_attributes in attributes['series']:
+        series = SeriesEditions.__new__(SeriesEditions)
+        series.__dict__.update(series_attributes)
+        index.series.append(series)
+    return sources, index
+
+def write_state(data_dir, sources, index):
+    path = state_path(data_dir)
+    attributes = dict(vars(index), series = [vars(series) for series in index.series])
+    with open(path + '.tmp', 'wb') as state_file:
+        pickle.dump((sources, attributes), state_file, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+# A full load may bring other csv files, so the saved index is dropped with the graph
+def discard_state(data_dir = DATA_DIR):
+    if os.path.exists(state_path(data_dir)):
+        os.remove(state_path(data_dir))
+
+# Keeps the saved index up to date through a delta load. changes maps 'Conference', 'writes' and
+# 'presented_in' to the delta_load_neo4j.Delta of their file; inserted rows are added to the index,
+# while deleted rows, changed conferences or a file loaded from scratch (rebuild) build it again
+# from the store. Nothing is done while no index was saved.
+def update_venue_editions(changes, data_dir = DATA_DIR, rebuild = False):
+    saved = read_state(data_dir)
+    if saved is None:
+        return
+    rebuild = rebuild or any(delta.deleted for delta in changes.values())
+    rebuild = rebuild or ('Conference' in changes and bool(changes['Conference'].updated))
+    if rebuild:
+        index = VenueEditionIndex.from_store(GraphStore.load(data_dir))
+    else:
+        index = saved[1]
+        for element in ('Conference', 'writes', 'presented_in'):
+            if element in changes:
+                index.apply_inserted(element, changes[element].inserted)
+    write_state(data_dir, source_fingerprints(data_dir), index)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Authors that published in at least N editions of the same conference.')
+    parser.add_argument('--venue', help = 'a conference name (all of them by default)')
+    parser.add_argument('--min-editions', type = int, default = MIN_EDITIONS)
+    parser.add_argument('--pairs', action = 'store_true', help = 'print the pairs of such authors that met at a same edition')
+    parser.add_argument('--min-shared', type = int, default = MIN_SHARED, help = 'editions the two authors of a pair share')
+    parser.add_argument('--data-dir', default = DATA_DIR)
+    args = parser.parse_args()
+
+    index = VenueEditionIndex.load(args.data_dir)
+    store = GraphStore.load(args.data_dir)
+    author_table = store.nodes['Author']
+    name = lambda author: store.property('Author', 'name', author_table.index(index.ids['Author'][author]))
+    venues = [args.venue] if args.venue else index.series_names
+
+    for venue in venues:
+        if args.pairs:
+            for author1, author2, shared in index.co_participants(venue, args.min_editions, args.min_shared):
+                print('{venue}: {author1} - {author2} ({shared} editions)'.format(
+                    venue = venue, author1 = name(author1), author2 = name(author2), shared = shared))
+        else:
+            authors, counts = index.authors_with_editions(venue, args.min_editions)
+            for author, count in zip(authors, counts):
+                print('{venue}: {author} ({count} editions)'.format(venue = venue, author = name(author), count = count))